@@ -0,0 +1,285 @@
+# api_server.py
+# Read-only HTTP API over the apps' storage, for SCADA dashboards and the mobile app
+# - GET /api/v1/state              last reading, pump status and staleness per device
+# - GET /api/v1/readings/<stream>  history | flow: raw records, or minute / hour / day rollups (resolution=auto
+#                                  picks one from the range)
+# - GET /api/v1/events             irrigation sessions / actions, one page at a time
+# - GET /api/v1/config             current config document
+# - every response carries an ETag built from the version of the data it reads (segment sizes, document
+#   revision), If-None-Match is answered with 304 before any record is read; bodies are also kept in a small
+#   LRU keyed by (request, version) so many clients polling the same query share one computation
+# - gzip when the client accepts it; raw ranges are streamed day by day as one JSON array
+# - its own process, no Streamlit rerun is involved:
+#     IRRIGATION_DATA_DIR=data python api_server.py        (web_phan_quyen layout, the default)
+#     IRRIGATION_DATA_DIR=. python api_server.py           (web_tuoi_tieu layout)
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from flask import Flask, Response, request
+
+from file_utils import file_version
+from irrigation_events import IrrigationEvents, PAGE_ROWS
+from latest_state import read_snapshot
+from rollups import get_rollups
+from sqlite_store import get_sqlite_backend
+from timeseries_store import get_store
+
+DATA_DIR = Path(os.environ.get("IRRIGATION_DATA_DIR", Path(__file__).parent.resolve() / "data"))
+STORAGE_BACKEND = os.environ.get("IRRIGATION_STORAGE", "json")
+
+# stream name -> (directory, time key, numeric fields)
+STREAMS = {
+    "history": ("history_irrigation", "timestamp", ["sensor_hum", "sensor_temp"]),
+    "flow": ("flow_data", "time", ["flow"]),
+}
+RESOLUTIONS = ("raw", "auto", "minute", "hour", "day")
+MAX_RAW_DAYS = 31       # raw ranges longer than this must use a rollup resolution
+MAX_PAGE_ROWS = 500
+GZIP_MIN_BYTES = 1024
+BODY_CACHE_ITEMS = 256
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _parse_day(value, default):
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        raise ApiError(f"invalid date: {value}")
+
+
+def _int_arg(name, default, lo, hi):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        raise ApiError(f"invalid {name}")
+    return min(max(value, lo), hi)
+
+
+def _accepts_gzip():
+    return "gzip" in (request.headers.get("Accept-Encoding") or "").lower()
+
+
+class ReadApi:
+    def __init__(self, data_dir=DATA_DIR, storage=STORAGE_BACKEND):
+        self.data_dir = Path(data_dir)
+        self.streams = {}
+        for name, (folder, time_key, fields) in STREAMS.items():
+            store = get_store(self.data_dir / folder, time_key=time_key)
+            self.streams[name] = (store, get_rollups(store, fields))
+        # not the registry: the one-time import of the old layouts belongs to the apps
+        self.events = IrrigationEvents(self.data_dir / "irrigation_events")
+        self.sqlite = get_sqlite_backend(self.data_dir / "irrigation.db") if storage == "sqlite" else None
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+    # -----------------------
+    # Data versions (ETag input)
+    # -----------------------
+    def _segments_version(self, store, start=None, end=None):
+        out = []
+        for day in store.days():
+            if (start and day < start) or (end and day > end):
+                continue
+            try:
+                out.append((day, os.path.getsize(store.segment_path(day))))
+            except OSError:
+                pass
+        return out
+
+    def _config_version(self):
+        if self.sqlite is not None:
+            return self.sqlite.doc_version("config.json")
+        return file_version(self.data_dir / "config.json")
+
+    # -----------------------
+    # Response helpers
+    # -----------------------
+    def _etag(self, version):
+        return hashlib.sha1(_dumps([request.full_path, version]).encode("utf-8")).hexdigest()[:24]
+
+    def _not_modified(self, etag):
+        return request.if_none_match.contains_weak(etag)
+
+    def _headers(self, resp, etag):
+        resp.set_etag(etag, weak=True)  # weak: the same entity may be sent gzipped or not
+        resp.headers["Cache-Control"] = "no-cache"
+        resp.headers["Vary"] = "Accept-Encoding"
+        return resp
+
+    def respond(self, version, build):
+        # build() only runs when neither the client nor the body cache has this version
+        etag = self._etag(version)
+        if self._not_modified(etag):
+            return self._headers(Response(status=304), etag)
+        with self._lock:
+            body = self._bodies.get(etag)
+            if body is not None:
+                self._bodies.move_to_end(etag)
+        if body is None:
+            raw = _dumps(build()).encode("utf-8")
+            body = (raw, gzip.compress(raw, 5) if len(raw) >= GZIP_MIN_BYTES else None)
+            with self._lock:
+                self._bodies[etag] = body
+                while len(self._bodies) > BODY_CACHE_ITEMS:
+                    self._bodies.popitem(last=False)
+        raw, packed = body
+        resp = Response(raw, mimetype="application/json")
+        if packed is not None and _accepts_gzip():
+            resp.set_data(packed)
+            resp.headers["Content-Encoding"] = "gzip"
+        return self._headers(resp, etag)
+
+    def stream(self, version, chunks):
+        # chunks(): iterable of JSON-encoded records, sent as one array without building it in memory
+        etag = self._etag(version)
+        if self._not_modified(etag):
+            return self._headers(Response(status=304), etag)
+        use_gzip = _accepts_gzip()
+
+        def generate():
+            packer = zlib.compressobj(5, zlib.DEFLATED, 31) if use_gzip else None
+            first = True
+            yield packer.compress(b"[") if packer else b"["
+            for item in chunks():
+                part = (b"" if first else b",") + item.encode("utf-8")
+                first = False
+                if packer:
+                    part = packer.compress(part)
+                    if not part:
+                        continue
+                yield part
+            yield (packer.compress(b"]") + packer.flush()) if packer else b"]"
+
+        resp = Response(generate(), mimetype="application/json")
+        if use_gzip:
+            resp.headers["Content-Encoding"] = "gzip"
+        return self._headers(resp, etag)
+
+    # -----------------------
+    # Endpoints
+    # -----------------------
+    def state(self):
+        # the apps' latest-value snapshot (latest_state.py): one small file, whatever the history size;
+        # the minute is part of the version so the stale flags are recomputed even when nothing arrives
+        location = request.args.get("location")
+        path = self.data_dir / "latest_state.json"
+        version = [file_version(path), int(time.time() // 60)]
+
+        def build():
+            data = read_snapshot(path) or {"devices": []}
+            devices = [d for d in data["devices"] if location is None or d.get("location") == location]
+            return {"generated_at": datetime.now().astimezone().isoformat(), "devices": devices}
+
+        return self.respond(version, build)
+
+    def readings(self, stream):
+        if stream not in self.streams:
+            raise ApiError(f"unknown stream: {stream}", 404)
+        store, rollups = self.streams[stream]
+        today = date.today()
+        start = _parse_day(request.args.get("start"), today)
+        end = _parse_day(request.args.get("end"), start)
+        if end < start:
+            raise ApiError("end is before start")
+        location = request.args.get("location")
+        resolution = request.args.get("resolution", "auto")
+        if resolution not in RESOLUTIONS:
+            raise ApiError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+        version = self._segments_version(store, start.isoformat(), end.isoformat())
+
+        if resolution == "raw":
+            if (end - start).days + 1 > MAX_RAW_DAYS:
+                raise ApiError(f"raw ranges are limited to {MAX_RAW_DAYS} days, use a rollup resolution")
+
+            def chunks():
+                for day, _ in version:
+                    for rec in store.read(day, day):
+                        if location is None or (rec.get("location") or "") == location:
+                            yield _dumps(rec)
+
+            return self.stream(version, chunks)
+
+        max_points = _int_arg("max_points", 1500, 10, 20000)
+
+        def build():
+            res = rollups.pick_resolution(start, end, max_points) if resolution == "auto" else resolution
+            rows = rollups.query(start, end, location=location, resolution=res)
+            return {"stream": stream, "resolution": res, "start": start.isoformat(), "end": end.isoformat(), "rows": rows}
+
+        return self.respond(version, build)
+
+    def events_page(self):
+        kind = request.args.get("kind", "sessions")
+        if kind not in ("sessions", "actions"):
+            raise ApiError("kind must be sessions or actions")
+        start = _parse_day(request.args.get("start"), None)
+        end = _parse_day(request.args.get("end"), None)
+        newest_first = request.args.get("order", "desc") != "asc"
+        offset = _int_arg("offset", 0, 0, 10 ** 9)
+        limit = _int_arg("limit", PAGE_ROWS, 1, MAX_PAGE_ROWS)
+        self.events.refresh()
+        version = self._segments_version(self.events.store)
+
+        def build():
+            rows, total = self.events.page(
+                kind, request.args.get("location"),
+                start=start.isoformat() if start else None,
+                end=(end + timedelta(days=1)).isoformat() if end else None,
+                newest_first=newest_first, offset=offset, limit=limit,
+            )
+            return {"kind": kind, "total": total, "offset": offset, "limit": limit, "rows": rows}
+
+        return self.respond(version, build)
+
+    def config(self):
+        def build():
+            if self.sqlite is not None:
+                return self.sqlite.load_doc("config.json", {})
+            try:
+                with open(self.data_dir / "config.json", "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return {}
+
+        return self.respond(self._config_version(), build)
+
+
+def create_app(data_dir=DATA_DIR, storage=STORAGE_BACKEND):
+    app = Flask(__name__)
+    api = ReadApi(data_dir, storage)
+    app.config["READ_API"] = api
+
+    app.add_url_rule("/api/v1/state", "state", api.state)
+    app.add_url_rule("/api/v1/readings/<stream>", "readings", api.readings)
+    app.add_url_rule("/api/v1/events", "events", api.events_page)
+    app.add_url_rule("/api/v1/config", "config", api.config)
+
+    @app.errorhandler(ApiError)
+    def _api_error(e):
+        return Response(_dumps({"error": str(e)}), status=e.status, mimetype="application/json")
+
+    return app
+
+
+if __name__ == "__main__":
+    create_app().run(host=os.environ.get("API_HOST", "0.0.0.0"), port=int(os.environ.get("API_PORT", "8600")), threaded=True)
@@ -0,0 +1,135 @@
+# chart_cache.py
+# Cache of rendered charts (PNG bytes) keyed by query parameters + data version
+# - DataVersions counts appends per (stream, day) through the store listeners, so ingestion bumps the version of
+#   exactly the days it wrote; a chart over past days keeps its version and is served from cache
+# - ChartCache is an LRU over PNG bytes with a memory cap (max_bytes); a hit skips subplots / twinx /
+#   tight_layout / savefig entirely
+# - render functions return a matplotlib figure, the cache saves it as PNG and closes it
+
+import io
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+
+
+def _day(value):
+    if value is None:
+        return None
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()[:10]
+    return str(value)[:10]
+
+
+class DataVersions:
+    def __init__(self):
+        self._versions = {}  # stream -> {day: appends}
+        self._watched = set()
+        self._lock = threading.Lock()
+
+    def watch(self, stream, store):
+        # bump the written days after every append / flush of `store`; safe to call on every rerun
+        with self._lock:
+            if stream in self._watched:
+                return
+            self._watched.add(stream)
+        store.add_listener(lambda days: self.bump(stream, days))
+
+    def bump(self, stream, days):
+        with self._lock:
+            per_day = self._versions.setdefault(stream, {})
+            for day in days:
+                per_day[day] = per_day.get(day, 0) + 1
+
+    def version(self, stream, start=None, end=None):
+        # changes whenever any day in start..end (inclusive, None = open) received data
+        start, end = _day(start), _day(end)
+        with self._lock:
+            per_day = dict(self._versions.get(stream, {}))
+        return sum(v for d, v in per_day.items() if (start is None or d >= start) and (end is None or d <= end))
+
+
+class ChartCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, dpi=100):
+        self.max_bytes = max_bytes
+        self.dpi = dpi
+        self._items = OrderedDict()  # key -> png bytes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            png = self._items.get(key)
+            if png is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return png
+
+    def put(self, key, png):
+        if len(png) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = png
+            self._bytes += len(png)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_or_render(self, key, render):
+        # PNG bytes for key; render() -> matplotlib figure is only called on a miss
+        png = self.get(key)
+        if png is not None:
+            return png
+        import matplotlib.pyplot as plt
+        fig = render()
+        try:
+            buf = io.BytesIO()
+            fig.savefig(buf, format="png", dpi=self.dpi)
+            png = buf.getvalue()
+        finally:
+            plt.close(fig)
+        self.put(key, png)
+        return png
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# -----------------------
+# Process-wide singletons
+# -----------------------
+_cache = None
+_versions = None
+_singleton_lock = threading.Lock()
+
+
+def get_chart_cache():
+    global _cache
+    with _singleton_lock:
+        if _cache is None:
+            _cache = ChartCache()
+        return _cache
+
+
+def get_data_versions():
+    global _versions
+    with _singleton_lock:
+        if _versions is None:
+            _versions = DataVersions()
+        return _versions
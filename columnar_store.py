@@ -0,0 +1,263 @@
+# columnar_store.py
+# Optional columnar binary backend for sensor / flow history (NumPy memory-mapped columns)
+# - one directory per day: <root>/<day>/ts.i8 (int64 epoch ms), loc.u2 (uint16 location code), <field>.f4 (float32, NaN = missing)
+# - append only writes a few bytes to the end of each column file, timestamps are parsed once at write time
+# - reads memory-map the column files: slicing one day is zero-copy, ~14 bytes per sample instead of ~120 bytes of JSON
+# - ts.i8 is written last and is the row count of the day: when the store is opened, every column is cut back
+#   to len(ts) (a crash between the column writes leaves no misaligned rows for the next append)
+# - closed days already in the JSON-lines segments can be imported in the background (import_segments); a day
+#   that already has live rows (backend enabled during the day) gets the segment records older than its first
+#   live row, and a .imported marker records that the day is complete; only days before yesterday are imported,
+#   so samples of the day that just ended still waiting in the write-behind buffer are not imported twice
+# - expire() drops whole day directories (retention job, same policy as the segments they mirror)
+
+import json
+import os
+import shutil
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+TS_FILE = "ts.i8"
+LOC_FILE = "loc.u2"
+IMPORTED_MARKER = ".imported"
+
+
+def _epoch_ms(value):
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def _as_day(value):
+    if value is None:
+        return None
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()[:10]
+    return str(value)[:10]
+
+
+class ColumnarStore:
+    def __init__(self, root, time_key, fields, location_key="location"):
+        self.root = Path(root)
+        self.time_key = time_key
+        self.fields = list(fields)
+        self.location_key = location_key
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._loc_path = self.root / "locations.json"
+        try:
+            with open(self._loc_path, "r", encoding="utf-8") as f:
+                self._locations = json.load(f)
+        except (OSError, ValueError):
+            self._locations = [""]
+        self._loc_codes = {name: i for i, name in enumerate(self._locations)}
+        for day_dir in self.root.iterdir():
+            if day_dir.is_dir():
+                self._repair(day_dir)
+
+    def _repair(self, day_dir):
+        # cut every column back to the committed row count (len(ts)), also a torn last timestamp
+        ts_path = day_dir / TS_FILE
+        n = os.path.getsize(ts_path) // 8 if ts_path.exists() else 0
+        for name, width in [(TS_FILE, 8), (LOC_FILE, 2)] + [(f"{field}.f4", 4) for field in self.fields]:
+            path = day_dir / name
+            try:
+                if os.path.getsize(path) > n * width:
+                    os.truncate(path, n * width)
+            except OSError:
+                pass
+
+    # -----------------------
+    # Locations <-> uint16 codes
+    # -----------------------
+    def _loc_code(self, name):
+        name = name or ""
+        code = self._loc_codes.get(name)
+        if code is None:
+            code = len(self._locations)
+            self._locations.append(name)
+            self._loc_codes[name] = code
+            tmp = self._loc_path.with_name("locations.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._locations, f, ensure_ascii=False)
+            os.replace(tmp, self._loc_path)
+        return code
+
+    def location_name(self, code):
+        return self._locations[code] if 0 <= code < len(self._locations) else ""
+
+    # -----------------------
+    # Write path
+    # -----------------------
+    def days(self):
+        return sorted(p.name for p in self.root.iterdir() if p.is_dir() and (p / TS_FILE).exists())
+
+    def append(self, record):
+        return self.append_many([record])
+
+    def append_many(self, records):
+        groups = {}
+        for rec in records:
+            ts = rec.get(self.time_key)
+            if not isinstance(ts, str) or len(ts) < 10:
+                continue
+            try:
+                ms = _epoch_ms(ts)
+            except ValueError:
+                continue
+            groups.setdefault(ts[:10], []).append((ms, rec))
+        written = 0
+        with self._lock:
+            for day, rows in groups.items():
+                day_dir = self.root / day
+                day_dir.mkdir(exist_ok=True)
+                cols = {
+                    TS_FILE: np.fromiter((ms for ms, _ in rows), dtype=np.int64, count=len(rows)),
+                    LOC_FILE: np.fromiter((self._loc_code(r.get(self.location_key)) for _, r in rows), dtype=np.uint16, count=len(rows)),
+                }
+                for field in self.fields:
+                    cols[f"{field}.f4"] = np.array([_to_float(r.get(field)) for _, r in rows], dtype=np.float32)
+                # timestamps last: a reader never sees a timestamp whose values are not written yet
+                for name in [n for n in cols if n != TS_FILE] + [TS_FILE]:
+                    with open(day_dir / name, "ab") as f:
+                        f.write(cols[name].tobytes())
+                written += len(rows)
+        return written
+
+    # -----------------------
+    # Read path (memory-mapped, zero-copy per day)
+    # -----------------------
+    def _map(self, path, dtype, n):
+        if n == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(n,))
+
+    def read_day(self, day):
+        day_dir = self.root / _as_day(day)
+        ts_path = day_dir / TS_FILE
+        if not ts_path.exists():
+            return None
+        # columns may be a few rows ahead of ts.i8 while a write is in progress
+        n = os.path.getsize(ts_path) // 8
+        cols = {"ts": self._map(ts_path, np.int64, n)}
+        loc_path = day_dir / LOC_FILE
+        cols["loc"] = self._map(loc_path, np.uint16, n) if loc_path.exists() else np.zeros(n, dtype=np.uint16)
+        for field in self.fields:
+            path = day_dir / f"{field}.f4"
+            if path.exists() and os.path.getsize(path) >= n * 4:
+                cols[field] = self._map(path, np.float32, n)
+            else:
+                cols[field] = np.full(n, np.nan, dtype=np.float32)
+        return cols
+
+    def query(self, start, end=None, location=None):
+        # columns for start..end (days, inclusive); a single unfiltered, time-ordered day is returned without copying
+        start_day, end_day = _as_day(start), _as_day(end or start)
+        parts = [c for c in (self.read_day(d) for d in self.days() if start_day <= d <= end_day) if c is not None]
+        if not parts:
+            cols = {"ts": np.empty(0, dtype=np.int64), "loc": np.empty(0, dtype=np.uint16)}
+            for field in self.fields:
+                cols[field] = np.empty(0, dtype=np.float32)
+            return cols
+        cols = parts[0] if len(parts) == 1 else {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+        if location is not None:
+            code = self._loc_codes.get(location)
+            if code is None:
+                mask = np.zeros(len(cols["ts"]), dtype=bool)
+            else:
+                mask = cols["loc"] == code
+            cols = {k: v[mask] for k, v in cols.items()}
+        ts = cols["ts"]
+        if len(ts) > 1 and not bool(np.all(ts[1:] >= ts[:-1])):
+            order = np.argsort(ts, kind="stable")
+            cols = {k: v[order] for k, v in cols.items()}
+        return cols
+
+    def to_frame(self, start, end=None, location=None, tz="Asia/Ho_Chi_Minh"):
+        import pandas as pd
+        cols = self.query(start, end, location=location)
+        df = pd.DataFrame({k: v for k, v in cols.items() if k not in ("ts", "loc")})
+        df.insert(0, self.time_key, pd.to_datetime(np.asarray(cols["ts"]), unit="ms", utc=True).tz_convert(tz))
+        return df
+
+    # -----------------------
+    # Import from JSON-lines segments
+    # -----------------------
+    def import_segments(self, segment_store, before_day=None):
+        # settled days only: today keeps receiving live appends, and yesterday's last samples may still be in the
+        # write-behind buffer (already in the segment, not yet in the columns) right after midnight
+        before_day = before_day or (date.today() - timedelta(days=1)).isoformat()
+        imported = 0
+        for day in segment_store.days():
+            marker = self.root / day / IMPORTED_MARKER
+            if day >= before_day or marker.exists():
+                continue
+            records = segment_store.read(day, day)
+            live = self.read_day(day)
+            if live is not None and len(live["ts"]):
+                # rows written live since the backend was enabled are already here: only the part of the day before
+                first = int(live["ts"].min())
+                records = [r for r in records if (_record_ms(r, self.time_key) or first) < first]
+            imported += self.append_many(records)
+            marker.parent.mkdir(exist_ok=True)
+            marker.write_text(datetime.now().isoformat(), encoding="utf-8")
+        return imported
+
+
+    # -----------------------
+    # Retention
+    # -----------------------
+    def expire(self, days, archive_dir=None, today=None):
+        # same call as SegmentStore.expire (retention job); the day directories are deleted, the JSON-lines
+        # segments they mirror are what gets archived
+        cutoff = ((today or date.today()) - timedelta(days=days)).isoformat()
+        removed = []
+        with self._lock:
+            for day in self.days():
+                if day >= cutoff:
+                    break
+                try:
+                    shutil.rmtree(self.root / day)
+                    removed.append(day)
+                except OSError as e:
+                    print(f"ColumnarStore expire error for {day}:", e)
+        return removed
+
+
+def _record_ms(record, time_key):
+    try:
+        return _epoch_ms(record.get(time_key))
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    if value is None or isinstance(value, bool):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+# -----------------------
+# Process-wide registry
+# -----------------------
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_columnar_store(root, time_key, fields, location_key="location", backfill_from=None):
+    key = str(Path(root).resolve())
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is not None:
+            return store
+        store = ColumnarStore(root, time_key, fields, location_key=location_key)
+        _stores[key] = store
+    if backfill_from is not None:
+        threading.Thread(target=store.import_segments, args=(backfill_from,), name=f"columnar-import-{store.root.name}", daemon=True).start()
+    return store
@@ -0,0 +1,116 @@
+# config_sync.py
+# Versioned delta publishing of the ESP32 configuration
+# - only the device-relevant fields (watering_slots, mode, moisture_thresholds) are published, one retained
+#   message per field on <prefix>/<field>: {"version": n, "value": ...}; <prefix>/version carries the latest version
+# - each save compares the config with the last values the broker acknowledged and publishes only changed fields
+# - retained messages mean a device that reconnects gets the current value of every field from the broker,
+#   nothing has to be resent by the web app
+# - acknowledged state is persisted (data/config_state.json) so deltas survive a server restart
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+DEVICE_FIELDS = ("watering_slots", "mode", "moisture_thresholds")
+
+
+class PublishResult:
+    def __init__(self, version, changed, handles):
+        self.version = version
+        self.changed = changed
+        self.handles = handles
+
+    @property
+    def acked(self):
+        return all(h.acked for h in self.handles)
+
+    @property
+    def failed(self):
+        return any(h.failed for h in self.handles)
+
+    @property
+    def payload_size(self):
+        return sum(h.payload_size for h in self.handles)
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        for h in self.handles:
+            h.wait(None if deadline is None else max(0.0, deadline - time.time()))
+        return self.acked
+
+
+class ConfigSync:
+    def __init__(self, state_path, publisher, prefix, fields=DEVICE_FIELDS):
+        self.state_path = Path(state_path)
+        self.publisher = publisher
+        self.prefix = prefix.rstrip("/")
+        self.fields = tuple(fields)
+        self._lock = threading.Lock()
+        state = {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f).get(self.prefix, {})
+        except (OSError, ValueError):
+            pass
+        self.version = state.get("version", 0)
+        # field -> {"version": n, "value": ...} as acknowledged by the broker
+        self.acked = state.get("acked", {})
+
+    def _save(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                all_state = json.load(f)
+        except (OSError, ValueError):
+            all_state = {}
+        all_state[self.prefix] = {"version": self.version, "acked": self.acked}
+        tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(all_state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def delta(self, config):
+        return {f: config.get(f) for f in self.fields if f in config and self.acked.get(f, {}).get("value") != config.get(f)}
+
+    def publish(self, config):
+        with self._lock:
+            changed = self.delta(config)
+            if not changed:
+                return PublishResult(self.version, {}, [])
+            self.version += 1
+            version = self.version
+            self._save()
+        handles = []
+        for field, value in changed.items():
+            payload = json.dumps({"version": version, "field": field, "value": value}, ensure_ascii=False)
+            h = self.publisher.publish(f"{self.prefix}/{field}", payload, qos=1, retain=True)
+            h.add_done_callback(lambda h, field=field, value=value: self._on_done(h, field, value, version))
+            handles.append(h)
+        payload = json.dumps({"version": version, "fields": sorted(changed)})
+        handles.append(self.publisher.publish(f"{self.prefix}/version", payload, qos=1, retain=True))
+        return PublishResult(version, changed, handles)
+
+    def _on_done(self, handle, field, value, version):
+        if not handle.acked:
+            return  # stays in the next delta
+        with self._lock:
+            if self.acked.get(field, {}).get("version", 0) < version:
+                self.acked[field] = {"version": version, "value": value}
+                self._save()
+
+
+# -----------------------
+# Registry: one ConfigSync per topic prefix (device or group of devices)
+# -----------------------
+_syncs = {}
+_syncs_lock = threading.Lock()
+
+
+def get_config_sync(state_path, publisher, prefix, fields=DEVICE_FIELDS):
+    with _syncs_lock:
+        sync = _syncs.get(prefix)
+        if sync is None:
+            sync = ConfigSync(state_path, publisher, prefix, fields=fields)
+            _syncs[prefix] = sync
+        return sync
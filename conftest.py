@@ -0,0 +1,11 @@
+# conftest.py
+# pytest: the modules live at the repository root (no package), tests/ imports them by name
+# - the root is put on sys.path explicitly, so the tests also run with --import-mode=importlib or from
+#   another working directory
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,114 @@
+# crop_catalog.py
+# Single crop catalog shared by all apps (crop_catalog.json, CROP_CATALOG_FILE overrides the path)
+# - per crop: display names, free-text aliases, harvest window, typical days to harvest, default moisture
+#   threshold and growth stages
+# - loaded once per process and compiled into lookup structures: stage breakpoint arrays (searchsorted /
+#   bisect), harvest windows and thresholds as plain dicts, and one regex over all aliases for free text,
+#   so lookups cost the same with 3 crops or a few hundred varieties
+
+import json
+import os
+import re
+import threading
+from datetime import timedelta
+from pathlib import Path
+
+from planting_table import compile_stages, stage_of
+
+CATALOG_FILE = Path(os.environ.get("CROP_CATALOG_FILE", Path(__file__).with_name("crop_catalog.json")))
+
+
+class CropSpec:
+    __slots__ = ("key", "names", "aliases", "harvest_min", "harvest_max", "typical_days", "threshold", "stages")
+
+    def __init__(self, entry):
+        self.key = entry["key"]
+        self.names = entry.get("names", {})
+        self.aliases = [a.lower() for a in entry.get("aliases", [])] + [self.key.lower()]
+        self.harvest_min, self.harvest_max = entry.get("harvest_days", (0, 0))
+        self.typical_days = entry.get("typical_days", (self.harvest_min + self.harvest_max) // 2)
+        self.threshold = entry.get("moisture_threshold")
+        self.stages = entry.get("stages", [])
+
+    def name(self, vi=True):
+        return self.names.get("vi" if vi else "en") or self.key
+
+
+class CropCatalog:
+    def __init__(self, data):
+        self.default_typical_days = data.get("default_typical_days", 60)
+        self.crops = {}
+        for entry in data.get("crops", []):
+            spec = CropSpec(entry)
+            self.crops[spec.key] = spec
+        # alias -> crop key; longest alias first so "rau cải" wins over "rau"
+        self._alias = {}
+        for spec in self.crops.values():
+            for alias in spec.aliases:
+                self._alias.setdefault(alias, spec.key)
+        pattern = "|".join(re.escape(a) for a in sorted(self._alias, key=len, reverse=True))
+        self._alias_re = re.compile(pattern) if pattern else None
+        self._stage_tables = {}
+        self._lock = threading.Lock()
+
+    # -----------------------
+    # Compiled views used by the apps
+    # -----------------------
+    def harvest_windows(self):
+        return {k: (c.harvest_min, c.harvest_max) for k, c in self.crops.items()}
+
+    def names(self, vi=True):
+        return {k: c.name(vi) for k, c in self.crops.items()}
+
+    def default_thresholds(self):
+        return {k: c.threshold for k, c in self.crops.items() if c.threshold is not None}
+
+    def stage_tables(self, vi=True):
+        # {crop: (breaks, labels)} for planting_table, compiled once per language
+        lang = "vi" if vi else "en"
+        with self._lock:
+            tables = self._stage_tables.get(lang)
+            if tables is None:
+                defs = {k: [(s.get("until"), s.get(lang) or s.get("vi")) for s in c.stages]
+                        for k, c in self.crops.items() if c.stages}
+                tables = self._stage_tables[lang] = compile_stages(defs)
+            return tables
+
+    # -----------------------
+    # Single lookups
+    # -----------------------
+    def stage(self, crop, days, vi=True):
+        return stage_of(self.stage_tables(vi), crop, days)
+
+    def match(self, text):
+        # crop for a free-text name ("bắp nếp", "Lúa OM18"...), exact key / alias first
+        if not text:
+            return None
+        text = text.strip().lower()
+        key = self._alias.get(text)
+        if key is None and self._alias_re is not None:
+            m = self._alias_re.search(text)
+            key = self._alias[m.group(0)] if m else None
+        return self.crops.get(key) if key else None
+
+    def estimate_harvest(self, text, plant_date):
+        # typical harvest date for a free-text crop name (default_typical_days when unknown)
+        spec = self.match(text)
+        days = spec.typical_days if spec is not None else self.default_typical_days
+        return plant_date + timedelta(days=days)
+
+
+# -----------------------
+# Process-wide singleton
+# -----------------------
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog(path=CATALOG_FILE):
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            with open(path, "r", encoding="utf-8") as f:
+                _catalog = CropCatalog(json.load(f))
+        return _catalog
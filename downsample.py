@@ -0,0 +1,85 @@
+# downsample.py
+# Reduce a time series to about the chart's pixel width before plotting
+# - lttb(): Largest-Triangle-Three-Buckets, keeps the points that shape the line (peaks, dips, steps)
+# - minmax(): first / min / max / last of every bucket, guarantees every extreme survives (e.g. a moisture dip
+#   that triggered irrigation); used when exact extremes matter more than line shape
+# - downsample_frame() applies either to several value columns of a DataFrame and keeps the union of the
+#   selected rows, so one column's spike is not lost because another column was flat
+# all functions return sorted row indices into the input, the original samples are plotted unchanged
+
+import numpy as np
+
+CHART_POINTS = 1200  # ~ figure width (12 in) x 100 dpi
+
+
+def lttb(x, y, threshold):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    out = np.empty(threshold, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    # buckets between the fixed first and last point
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # average of the next bucket (or the last point for the final bucket)
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        if nhi <= nlo:
+            nlo, nhi = n - 1, n
+        avg_x = x[nlo:nhi].mean()
+        avg_y = y[nlo:nhi].mean()
+        # point of this bucket forming the largest triangle with the previous pick and the next average
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def minmax(y, buckets):
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= buckets * 4 or buckets < 1:
+        return np.arange(n)
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    lo, hi = edges[:-1], edges[1:]
+    picks = [lo, hi - 1]
+    # argmin / argmax per bucket via reduceat on the bucket starts
+    starts = lo
+    mins = np.minimum.reduceat(y, starts)
+    maxs = np.maximum.reduceat(y, starts)
+    bucket_of = np.repeat(np.arange(buckets), hi - lo)
+    is_min = y == mins[bucket_of]
+    is_max = y == maxs[bucket_of]
+    # first occurrence of the min / max inside each bucket
+    for mask in (is_min, is_max):
+        idx = np.flatnonzero(mask)
+        first = np.unique(bucket_of[idx], return_index=True)[1]
+        picks.append(idx[first])
+    return np.unique(np.concatenate(picks))
+
+
+def downsample_frame(df, time_col, value_cols, max_points=CHART_POINTS, method="lttb"):
+    # rows of df (sorted by time_col) reduced to roughly max_points per value column
+    if df is None or len(df) <= max_points:
+        return df
+    t = df[time_col]
+    x = (t - t.iloc[0]).dt.total_seconds().to_numpy() if hasattr(t, "dt") else np.asarray(t, dtype=np.float64)
+    keep = []
+    for col in value_cols:
+        if col not in df.columns:
+            continue
+        y = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = np.flatnonzero(~np.isnan(y))
+        if len(valid) == 0:
+            continue
+        if method == "minmax":
+            idx = minmax(y[valid], max(1, max_points // 4))
+        else:
+            idx = lttb(x[valid], y[valid], max_points)
+        keep.append(valid[idx])
+    if not keep:
+        return df.iloc[:0]
+    return df.iloc[np.unique(np.concatenate(keep))]
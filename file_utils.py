@@ -0,0 +1,32 @@
+# file_utils.py
+# Small file helpers shared by the stores, the apps and api_server
+# - file_version(path): (mtime_ns, size) of a file, None when it does not exist; cheap cache / ETag key that
+#   changes whenever the file is rewritten
+# - read_json / write_json: small JSON documents shared between processes; writes go to a temporary file that
+#   replaces the old one, so a reader never sees half a document
+
+import json
+import os
+
+
+def file_version(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"), default=str)
+    os.replace(tmp, path)
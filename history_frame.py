@@ -0,0 +1,177 @@
+# history_frame.py
+# Process-wide, append-optimized in-memory history shared by every session
+# - columns live in fixed-size NumPy chunks: ts (int64 epoch ms), numeric fields (float64, NaN = missing) and
+#   text fields (object, None = missing); appending writes one row into the open chunk, a full chunk is sealed
+#   and never written again
+# - snapshot() captures (chunk, row count) pairs under the lock; the writer only ever writes past those counts,
+#   so a snapshot is an immutable view and readers never copy or lock the live history
+# - the frame is loaded once from the segment store when it is created (only the days the retention policy
+#   keeps), then ingestion appends to it directly: reruns no longer re-read / re-parse the history files
+
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+CHUNK_ROWS = 16384
+
+
+def _epoch_ms(value):
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def _to_float(value):
+    if value is None or isinstance(value, bool):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class _Chunk:
+    def __init__(self, numeric, text, rows):
+        self.cols = {"ts": np.zeros(rows, dtype=np.int64)}
+        for f in numeric:
+            self.cols[f] = np.full(rows, np.nan, dtype=np.float64)
+        for f in text:
+            self.cols[f] = np.full(rows, None, dtype=object)
+        self.capacity = rows
+        self.n = 0
+
+
+class HistorySnapshot:
+    def __init__(self, parts, fields, time_key):
+        self._parts = parts  # [(chunk, n)]
+        self.fields = fields
+        self.time_key = time_key
+
+    def __len__(self):
+        return sum(n for _, n in self._parts)
+
+    def _slices(self, start_row, end_row):
+        # chunk views covering global rows start_row..end_row (end exclusive)
+        out = []
+        base = 0
+        for chunk, n in self._parts:
+            lo, hi = max(start_row - base, 0), min(end_row - base, n)
+            if lo < hi:
+                out.append((chunk, lo, hi))
+            base += n
+        return out
+
+    def columns(self, start_row=0, end_row=None):
+        end_row = len(self) if end_row is None else end_row
+        slices = self._slices(start_row, end_row)
+        cols = {}
+        for name in ["ts"] + list(self.fields):
+            views = [chunk.cols[name][lo:hi] for chunk, lo, hi in slices] or [self._parts[0][0].cols[name][:0]]
+            # a single view is returned without copying; read-only so no session can modify shared rows
+            arr = views[0].view() if len(views) == 1 else np.concatenate(views)
+            arr.flags.writeable = False
+            cols[name] = arr
+        return cols
+
+    def tail(self, rows):
+        total = len(self)
+        return self.columns(max(total - rows, 0), total)
+
+    def to_frame(self, start_row=0, end_row=None, tz="Asia/Ho_Chi_Minh"):
+        import pandas as pd
+        cols = self.columns(start_row, end_row)
+        df = pd.DataFrame({k: v for k, v in cols.items() if k != "ts"})
+        df.insert(0, self.time_key, pd.to_datetime(np.asarray(cols["ts"]), unit="ms", utc=True).tz_convert(tz))
+        return df
+
+
+class HistoryFrame:
+    def __init__(self, time_key, numeric_fields, text_fields=(), chunk_rows=CHUNK_ROWS):
+        self.time_key = time_key
+        self.numeric_fields = list(numeric_fields)
+        self.text_fields = list(text_fields)
+        self.fields = self.numeric_fields + self.text_fields
+        self.chunk_rows = chunk_rows
+        self._sealed = []
+        self._open = self._new_chunk()
+        self._lock = threading.Lock()
+        self.appended = 0
+        self.skipped = 0
+
+    def _new_chunk(self):
+        return _Chunk(self.numeric_fields, self.text_fields, self.chunk_rows)
+
+    # -----------------------
+    # Write path (ingestion)
+    # -----------------------
+    def append(self, record):
+        return self.append_many([record])
+
+    def append_many(self, records):
+        written = 0
+        with self._lock:
+            for rec in records:
+                try:
+                    ms = _epoch_ms(rec.get(self.time_key))
+                except (TypeError, ValueError):
+                    self.skipped += 1
+                    continue
+                chunk = self._open
+                if chunk.n == chunk.capacity:
+                    self._sealed.append(chunk)
+                    chunk = self._open = self._new_chunk()
+                i = chunk.n
+                chunk.cols["ts"][i] = ms
+                for f in self.numeric_fields:
+                    chunk.cols[f][i] = _to_float(rec.get(f))
+                for f in self.text_fields:
+                    v = rec.get(f)
+                    chunk.cols[f][i] = None if v is None else str(v)
+                # publish the row only after all of its columns are written
+                chunk.n = i + 1
+                written += 1
+            self.appended += written
+        return written
+
+    def expire(self, days, archive_dir=None, today=None):
+        # drop whole sealed chunks older than `days` (same policy as the day segments, chunk granularity)
+        cutoff = datetime.combine(today or datetime.now().date(), datetime.min.time()).timestamp() * 1000 - days * 86400000
+        with self._lock:
+            keep = [c for c in self._sealed if c.cols["ts"][c.n - 1] >= cutoff]
+            dropped = len(self._sealed) - len(keep)
+            self._sealed = keep
+        return dropped
+
+    # -----------------------
+    # Read path
+    # -----------------------
+    def snapshot(self):
+        with self._lock:
+            parts = [(c, c.n) for c in self._sealed] + [(self._open, self._open.n)]
+        return HistorySnapshot(parts, self.fields, self.time_key)
+
+    def __len__(self):
+        with self._lock:
+            return sum(c.n for c in self._sealed) + self._open.n
+
+
+# -----------------------
+# Process-wide registry
+# -----------------------
+_frames = {}
+_frames_lock = threading.Lock()
+
+
+def get_history_frame(name, time_key, numeric_fields, text_fields=(), backfill_from=None, backfill_days=None):
+    # loaded from the store once per process, before any live append can reach it; backfill_days: retention
+    # window, older segments (not expired yet) are not read
+    with _frames_lock:
+        frame = _frames.get(name)
+        if frame is None:
+            frame = HistoryFrame(time_key, numeric_fields, text_fields)
+            if backfill_from is not None:
+                start = date.today() - timedelta(days=backfill_days) if backfill_days is not None else None
+                frame.append_many(backfill_from.read(start=start))
+            _frames[name] = frame
+        return frame
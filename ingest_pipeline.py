@@ -0,0 +1,259 @@
+# ingest_pipeline.py
+# asyncio ingestion pipeline: receive -> decode/validate -> persist
+# - the MQTT network thread only calls submit(), which appends to a bounded inbox and returns; decoding,
+#   validation and persisting run on one asyncio event loop in a background thread
+# - stages are connected by bounded asyncio queues; a full queue suspends the stage feeding it (backpressure),
+#   so a slow persist stage first fills the decoded queue, then the received queue, and finally the inbox
+# - load shedding happens only at the inbox: when it is full the oldest (default) or the newest message is
+#   dropped and counted, memory stays bounded during a burst (e.g. a whole field of ESP32s reconnecting)
+# - persist waits while `ready()` returns False (e.g. the write-behind buffer is above its high-water mark)
+# - every stage keeps counters and a 10 s throughput window, see stats()
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+RATE_WINDOW = 10  # seconds
+
+
+class StageMeter:
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.errors = 0
+        self.dropped = 0
+        self.busy_s = 0.0
+        self._buckets = deque(maxlen=RATE_WINDOW + 1)  # [second, count]
+
+    def tick(self, n=1):
+        self.processed += n
+        now = int(time.monotonic())
+        if self._buckets and self._buckets[-1][0] == now:
+            self._buckets[-1][1] += n
+        else:
+            self._buckets.append([now, n])
+
+    def rate(self):
+        # messages per second over the last RATE_WINDOW whole seconds
+        now = int(time.monotonic())
+        total = sum(n for sec, n in list(self._buckets) if now - RATE_WINDOW <= sec < now)
+        return total / RATE_WINDOW
+
+    def snapshot(self):
+        return {
+            "processed": self.processed,
+            "per_s": round(self.rate(), 1),
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "busy_s": round(self.busy_s, 3),
+        }
+
+
+class IngestPipeline:
+    def __init__(self, name, decode, persist, ready=None, inbox_size=10000, queue_size=1000,
+                 batch_size=200, shed="oldest", stall_sleep=0.05):
+        # decode(item) -> value to persist, or None to skip; raising ValueError rejects the message
+        # persist(value) is called on the event loop thread and must not block (e.g. WriteBehindBuffer.put)
+        if shed not in ("oldest", "newest"):
+            raise ValueError(f"unknown shed policy: {shed}")
+        self.name = name
+        self.decode = decode
+        self.persist = persist
+        self.ready = ready
+        self.inbox_size = inbox_size
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.shed = shed
+        self.stall_sleep = stall_sleep
+        self._options = {"inbox_size": inbox_size, "queue_size": queue_size, "batch_size": batch_size,
+                         "shed": shed, "stall_sleep": stall_sleep}
+        self.meters = {stage: StageMeter(stage) for stage in ("receive", "decode", "persist")}
+        self.stalls = 0
+        self.max_inbox = 0
+        self._inbox = deque()
+        self._inbox_lock = threading.Lock()
+        self._idle = False
+        self._closed = False
+        self._loop = asyncio.new_event_loop()
+        self._ready_ev = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"ingest-pipeline-{name}", daemon=True)
+        self._thread.start()
+        self._ready_ev.wait(timeout=5)
+
+    # -----------------------
+    # Producer side (MQTT network thread)
+    # -----------------------
+    def submit(self, item):
+        meter = self.meters["receive"]
+        with self._inbox_lock:
+            if self._closed:
+                return False
+            if len(self._inbox) >= self.inbox_size:
+                meter.dropped += 1
+                if self.shed == "newest":
+                    return False
+                self._inbox.popleft()
+            self._inbox.append(item)
+            depth = len(self._inbox)
+            if depth > self.max_inbox:
+                self.max_inbox = depth
+            wake = self._idle
+            self._idle = False
+        if wake:
+            # only an idle receive stage needs a wakeup, a busy one drains the inbox on its own
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return True
+
+    # -----------------------
+    # Stages (event loop thread)
+    # -----------------------
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._wake = asyncio.Event()
+        self._received = asyncio.Queue(maxsize=self.queue_size)
+        self._decoded = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [
+            self._loop.create_task(self._receive_stage()),
+            self._loop.create_task(self._decode_stage()),
+            self._loop.create_task(self._persist_stage()),
+        ]
+        self._ready_ev.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    async def _receive_stage(self):
+        meter = self.meters["receive"]
+        while True:
+            with self._inbox_lock:
+                item = self._inbox.popleft() if self._inbox else None
+                if item is None:
+                    self._idle = True
+            if item is None:
+                await self._wake.wait()
+                self._wake.clear()
+                continue
+            await self._received.put(item)
+            meter.tick()
+
+    async def _decode_stage(self):
+        meter = self.meters["decode"]
+        while True:
+            item = await self._received.get()
+            t0 = time.perf_counter()
+            try:
+                value = self.decode(item)
+            except Exception as e:
+                meter.errors += 1
+                if not isinstance(e, ValueError):
+                    print(f"IngestPipeline {self.name} decode error:", e)
+                self._received.task_done()
+                continue
+            meter.busy_s += time.perf_counter() - t0
+            self._received.task_done()
+            if value is None:
+                meter.dropped += 1
+                continue
+            await self._decoded.put(value)
+            meter.tick()
+
+    async def _persist_stage(self):
+        meter = self.meters["persist"]
+        while True:
+            batch = [await self._decoded.get()]
+            while len(batch) < self.batch_size and not self._decoded.empty():
+                batch.append(self._decoded.get_nowait())
+            while self.ready is not None and not self.ready():
+                self.stalls += 1
+                await asyncio.sleep(self.stall_sleep)
+            t0 = time.perf_counter()
+            done = 0
+            for value in batch:
+                try:
+                    self.persist(value)
+                    done += 1
+                except Exception as e:
+                    meter.errors += 1
+                    print(f"IngestPipeline {self.name} persist error:", e)
+                self._decoded.task_done()
+            meter.busy_s += time.perf_counter() - t0
+            meter.tick(done)
+
+    async def _drain(self):
+        while self._inbox:
+            await asyncio.sleep(self.stall_sleep)
+        await self._received.join()
+        await self._decoded.join()
+
+    async def _shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._loop.stop()
+
+    # -----------------------
+    # Lifecycle / metrics
+    # -----------------------
+    def close(self, timeout=5.0):
+        # stop accepting, persist what is already queued, then stop the loop
+        with self._inbox_lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            asyncio.run_coroutine_threadsafe(self._drain(), self._loop).result(timeout)
+        except Exception as e:
+            print(f"IngestPipeline {self.name} drain incomplete:", e)
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        self._thread.join(timeout=timeout)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def stats(self):
+        with self._inbox_lock:
+            inbox = len(self._inbox)
+        return {
+            "inbox": inbox,
+            "max_inbox": self.max_inbox,
+            "received_queue": self._received.qsize(),
+            "decoded_queue": self._decoded.qsize(),
+            "stalls": self.stalls,
+            "shed": self.meters["receive"].dropped,
+            "stages": {name: m.snapshot() for name, m in self.meters.items()},
+        }
+
+
+# -----------------------
+# Registry: one pipeline per name for the whole server process (closed by the owning IngestService; a closed
+# pipeline is replaced by a new one with the same callbacks and settings when it is asked for again)
+# -----------------------
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+
+def get_pipeline(name, decode, persist, ready=None, **kwargs):
+    with _pipelines_lock:
+        pipeline = _pipelines.get(name)
+        if pipeline is None or pipeline.closed:
+            pipeline = IngestPipeline(name, decode, persist, ready=ready, **kwargs)
+            _pipelines[name] = pipeline
+        else:
+            # a rerun's functions close over its own globals: the running stages call the newest ones
+            pipeline.decode, pipeline.persist = decode, persist
+            if ready is not None:
+                pipeline.ready = ready
+        return pipeline
+
+
+def reopen_pipeline(pipeline):
+    # the registered pipeline of the same name, a new one if `pipeline` was closed (IngestService.start())
+    with _pipelines_lock:
+        current = _pipelines.get(pipeline.name)
+        if current is None or current.closed:
+            current = IngestPipeline(pipeline.name, pipeline.decode, pipeline.persist, ready=pipeline.ready, **pipeline._options)
+            _pipelines[pipeline.name] = current
+        return current
@@ -0,0 +1,192 @@
+# ingest_service.py
+# Process-wide MQTT ingestion service
+# - Streamlit re-executes the page script on every interaction / autorefresh, but imported modules stay in
+#   sys.modules, so the registry below lives once per server process
+# - get_service() creates the MQTT client the first time and returns the same running service afterwards,
+#   reruns only attach to service.state instead of opening another broker connection; the handler / pipeline
+#   passed by a rerun replace the previous ones, so callbacks never keep a stale script's globals
+# - paho's network loop reconnects automatically; stop() / reconnect() give a clean manual path
+# - with a pipeline (ingest_pipeline.IngestPipeline) the network thread only hands messages to it, decoding
+#   and persisting run on the pipeline's event loop instead of inside the paho callback; stop() closes the
+#   pipeline (queued messages are persisted), start() after a stop gets a fresh one (reopen_pipeline)
+# - topics passed by a later get_service() call replace the subscriptions of the running client
+# - an optional write-behind buffer is flushed when the service stops, after the pipeline has drained
+
+import atexit
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from ingest_pipeline import reopen_pipeline
+
+
+class IngestService:
+    def __init__(self, name, broker, port, topics, handler, keepalive=60, buffer=None, pipeline=None):
+        self.name = name
+        self.broker = broker
+        self.port = port
+        self.topics = list(topics)
+        self.keepalive = keepalive
+        self.handler = handler
+        self.buffer = buffer
+        self.pipeline = pipeline
+        # shared state read by every rerun / session (latest sensor data, live series, ...)
+        self.state = {}
+        self.lock = threading.Lock()
+        self.connected = False
+        self.last_error = None
+        self.messages = 0
+        self.started_at = None
+        self._client = None
+
+    # -----------------------
+    # Lifecycle
+    # -----------------------
+    def start(self):
+        with self.lock:
+            if self._client is not None:
+                return
+            if self.pipeline is not None and self.pipeline.closed:
+                self.pipeline = reopen_pipeline(self.pipeline)
+            client = mqtt.Client(userdata=self)
+            client.on_connect = self._on_connect
+            client.on_disconnect = self._on_disconnect
+            client.on_message = self._on_message
+            client.reconnect_delay_set(min_delay=1, max_delay=60)
+            try:
+                client.connect_async(self.broker, self.port, self.keepalive)
+                client.loop_start()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"IngestService {self.name} start error:", e)
+                return
+            self._client = client
+            self.started_at = time.time()
+
+    def _stop_client(self):
+        with self.lock:
+            client, self._client = self._client, None
+        if client is not None:
+            try:
+                client.disconnect()
+                client.loop_stop()
+            except Exception as e:
+                print(f"IngestService {self.name} stop error:", e)
+        self.connected = False
+
+    def stop(self):
+        self._stop_client()
+        # samples accepted before the disconnect still reach disk
+        if self.pipeline is not None:
+            self.pipeline.close()
+        if self.buffer is not None:
+            self.buffer.flush()
+
+    def reconnect(self):
+        # drop the current connection and build a fresh client (e.g. after a broker change)
+        self._stop_client()
+        self.start()
+
+    def set_handler(self, handler):
+        self.handler = handler
+
+    def set_pipeline(self, pipeline):
+        self.pipeline = pipeline
+
+    def set_topics(self, topics):
+        # subscribe the new topics / unsubscribe the dropped ones now; _on_connect uses the list on reconnect
+        topics = list(topics)
+        with self.lock:
+            added = [t for t in topics if t not in self.topics]
+            removed = [t for t in self.topics if t not in topics]
+            self.topics = topics
+            client = self._client if self.connected else None
+        if client is not None:
+            for topic in added:
+                client.subscribe(topic)
+            for topic in removed:
+                client.unsubscribe(topic)
+        if added or removed:
+            print(f"IngestService {self.name}: topics {self.topics} (added {added}, removed {removed})")
+
+    # -----------------------
+    # paho callbacks (network loop thread)
+    # -----------------------
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.connected = True
+            self.last_error = None
+            print(f"IngestService {self.name}: MQTT connected")
+            # subscriptions are renewed on every (re)connect
+            for topic in self.topics:
+                client.subscribe(topic)
+        else:
+            self.connected = False
+            self.last_error = f"connect rc={rc}"
+            print(f"IngestService {self.name}: MQTT connect failed with code", rc)
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        if rc != 0:
+            self.last_error = f"disconnect rc={rc}"
+            print(f"IngestService {self.name}: unexpected disconnect, paho will reconnect (rc={rc})")
+
+    def _on_message(self, client, userdata, msg):
+        self.messages += 1
+        if self.pipeline is not None:
+            self.pipeline.submit(msg)
+            return
+        handler = self.handler
+        if handler is None:
+            return
+        try:
+            handler(client, self, msg)
+        except Exception as e:
+            print(f"IngestService {self.name} handler error:", e)
+
+
+# -----------------------
+# Registry: one service per name for the whole server process
+# -----------------------
+_services = {}
+_services_lock = threading.Lock()
+
+
+_atexit_registered = False
+
+
+def get_service(name, broker, port, topics, handler, keepalive=60, buffer=None, pipeline=None, autostart=True):
+    # autostart=False: the caller attaches its pipeline (set_pipeline) and calls start() itself, for callbacks
+    # that need service.state
+    global _atexit_registered
+    with _services_lock:
+        service = _services.get(name)
+        if service is None:
+            service = IngestService(name, broker, port, topics, handler, keepalive=keepalive, buffer=buffer, pipeline=pipeline)
+            _services[name] = service
+        else:
+            if list(topics) != service.topics:
+                service.set_topics(topics)
+            if handler is not None:
+                service.handler = handler
+            if pipeline is not None:
+                service.pipeline = pipeline
+            if buffer is not None:
+                service.buffer = buffer
+        if not _atexit_registered:
+            # registered on first use, after the buffers' close_all: atexit runs LIFO, so services (and their
+            # pipelines) stop before the write-behind buffers are closed
+            atexit.register(shutdown_all)
+            _atexit_registered = True
+    if autostart:
+        service.start()
+    return service
+
+
+def shutdown_all():
+    with _services_lock:
+        services = list(_services.values())
+        _services.clear()
+    for service in services:
+        service.stop()
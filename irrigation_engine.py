@@ -0,0 +1,461 @@
+# irrigation_engine.py
+# Headless irrigation decisions, independent of who has the page open
+# - one engine per server process (registry below) evaluates every zone on a fixed tick, and a single zone
+#   right after each new reading of that zone (notify() from the ingest pipeline, never blocks it)
+# - decision per zone: crop of the zone -> moisture threshold, latest moisture (latest_state.field(), stale
+#   readings are ignored), watering window and mode from the config; in auto mode a session is opened while the soil is
+#   dry inside the window and closed otherwise (irrigation_events start/end are idempotent, so events are
+#   written once however often a zone is evaluated)
+# - config / crop data are re-loaded only when their version changes
+# - the UI only reads status() and the event stream; hold() lets an operator stop a session without the
+#   engine reopening it before the current watering window ends; switching to manual mode closes the open
+#   session
+# - the decisions are also written to a status file (irrigation_status.json, at most every STATUS_SAVE_S and
+#   after every full pass) and holds can be requested through a second file (irrigation_holds.json), so a UI
+#   in another process reads / controls the engine with EngineView, exactly as with the embedded engine
+# - standalone process, no Streamlit involved (MQTT ingest -> latest state + sample stores -> engine):
+#     python irrigation_engine.py                              (web_tuoi_tieu layout in the current directory)
+#     IRRIGATION_DATA_DIR=/srv/farm IRRIGATION_STORAGE=sqlite python irrigation_engine.py
+#   MQTT_BROKER / MQTT_PORT pick the broker, IRRIGATION_TZ the time zone of the watering windows; the old
+#   single-device topics go to IRRIGATION_LEGACY_LOCATION, else the config's "legacy_location", else the only
+#   zone of crop_data; fleet topics are accepted for the zones of crop_data only. Start web_tuoi_tieu with
+#   IRRIGATION_ENGINE=external on the same data directory: it then runs neither its own MQTT client nor its
+#   own engine and shows this process' status (never both, each would ingest and decide on its own)
+
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+
+from file_utils import file_version, read_json, write_json
+
+TICK_S = 30.0
+DEFAULT_THRESHOLD = 65
+STATUS_SAVE_S = 2.0
+STATUS_FILE = "irrigation_status.json"
+HOLDS_FILE = "irrigation_holds.json"
+# old single-device topics (raw value payload) next to the per-device farm/<location>/<area>/<device>/sensor ones
+LEGACY_TOPIC_HUMIDITY = "esp32/soil_moisture"
+LEGACY_TOPIC_FLOW = "esp32/water_flow"
+
+
+def in_watering_window(schedule, now_time):
+    # schedule "HH:MM-HH:MM"; a window past midnight ("22:00-02:00") wraps around
+    try:
+        start_str, end_str = schedule.split("-")
+        start_t = datetime.strptime(start_str.strip(), "%H:%M").time()
+        end_t = datetime.strptime(end_str.strip(), "%H:%M").time()
+    except (AttributeError, ValueError):
+        return False
+    if start_t <= end_t:
+        return start_t <= now_time <= end_t
+    return now_time >= start_t or now_time <= end_t
+
+
+def window_start(schedule, now):
+    # start of the watering window `now` (aware datetime) is in, None outside the window
+    if not in_watering_window(schedule, now.time()):
+        return None
+    start_t = datetime.strptime(schedule.split("-")[0].strip(), "%H:%M").time()
+    start = now.replace(hour=start_t.hour, minute=start_t.minute, second=0, microsecond=0)
+    # a window past midnight that is open after midnight started the day before
+    return start - timedelta(days=1) if start > now else start
+
+
+def _parse_ts(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _Source:
+    # (version(), load()): load() runs again only when version() changes
+    def __init__(self, version, load):
+        self.version = version
+        self.load = load
+        self._seen = object()
+        self.value = None
+
+    def get(self):
+        v = self.version()
+        if v != self._seen or self.value is None:
+            self.value = self.load()
+            self._seen = v
+        return self.value
+
+
+class IrrigationEngine:
+    def __init__(self, name, latest, events, config_source, crop_source, thresholds, tz,
+                 moisture_field="sensor_hum", tick=TICK_S, default_threshold=DEFAULT_THRESHOLD,
+                 status_path=None, holds_path=None):
+        self.name = name
+        self.latest = latest
+        self.events = events
+        self.config = _Source(*config_source)
+        self.crops = _Source(*crop_source)
+        self.thresholds = dict(thresholds)
+        self.tz = tz
+        self.moisture_field = moisture_field
+        self.tick = tick
+        self.default_threshold = default_threshold
+        self._status = {}      # location -> last decision
+        self._held = {}        # location -> when an operator stopped it (valid until its window ends)
+        self._pending = set()  # locations with a new reading
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.evaluations = 0
+        self.errors = 0
+        self.status_path = status_path
+        self._saved_at = 0.0
+        # hold requests of a UI in another process (EngineView.hold), re-read when the file changes
+        self._requested = _Source(lambda: file_version(holds_path), lambda: read_json(holds_path, {})) if holds_path else None
+        if status_path:
+            for location, ts in (read_json(status_path, {}) or {}).get("held", {}).items():
+                held_at = _parse_ts(ts)
+                if held_at is not None:
+                    self._held[location] = held_at
+
+    # -----------------------
+    # Lifecycle
+    # -----------------------
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name=f"irrigation-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def notify(self, location):
+        # called for every new reading (ingest pipeline thread): O(1), evaluation happens on the engine thread
+        with self._lock:
+            self._pending.add(location or "")
+        self._wake.set()
+
+    def _run(self):
+        next_tick = 0.0
+        while not self._stop.is_set():
+            self._wake.wait(max(next_tick - time.monotonic(), 0))
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            if time.monotonic() >= next_tick:
+                next_tick = time.monotonic() + self.tick
+                pending = None  # full pass covers every zone
+            self.evaluate(pending)
+
+    # -----------------------
+    # Decisions
+    # -----------------------
+    def evaluate(self, locations=None):
+        try:
+            config = self.config.get() or {}
+            crop_data = self.crops.get() or {}
+        except Exception as e:
+            self.errors += 1
+            print(f"IrrigationEngine {self.name} input error:", e)
+            return
+        try:
+            requested = (self._requested.get() or {}) if self._requested is not None else {}
+        except Exception as e:
+            requested = {}
+            print(f"IrrigationEngine {self.name} hold requests error:", e)
+        zones = crop_data.keys() if locations is None else [loc for loc in locations if loc in crop_data]
+        for location in zones:
+            try:
+                self._evaluate_zone(location, crop_data[location], config, requested.get(location))
+            except Exception as e:
+                self.errors += 1
+                print(f"IrrigationEngine {self.name} error for {location}:", e)
+        if self.status_path and (locations is None or time.monotonic() - self._saved_at >= STATUS_SAVE_S):
+            self.save_status()
+
+    def _is_held(self, location, requested, schedule, now):
+        # an operator stop (this process or a hold request) counts until the window it was made in ends
+        start = window_start(schedule, now)
+        with self._lock:
+            held_at = self._held.get(location)
+        candidates = [t for t in (held_at, _parse_ts(requested)) if t is not None]
+        return start is not None and any(t >= start for t in candidates)
+
+    def _evaluate_zone(self, location, entry, config, requested=None):
+        now = datetime.now(self.tz)
+        ts = now.isoformat()
+        plots = (entry or {}).get("plots") or []
+        status = {"evaluated_at": ts, "moisture": None, "threshold": None, "crop": None}
+        if not plots:
+            status["decision"] = "no_crop"
+        else:
+            # the zone is watered for its first crop (same rule as the control page)
+            crop_key = plots[0].get("crop")
+            threshold = self.thresholds.get(crop_key, self.default_threshold)
+            # newest moisture of the zone, whichever device reported last (a flow-only meter does not count)
+            latest = self.latest.field(location, self.moisture_field)
+            moisture = latest["value"] if latest is not None and not latest["stale"] else None
+            status.update(crop=crop_key, threshold=threshold, moisture=moisture)
+            schedule = config.get("watering_schedule", "")
+            in_window = in_watering_window(schedule, now.time())
+            if config.get("mode", "auto") != "auto":
+                # the operator took over: the automatic session is not left open
+                self.events.end_session(location, ts=ts)
+                status["decision"] = "manual"
+            elif not in_window:
+                with self._lock:
+                    self._held.pop(location, None)
+                self.events.end_session(location, ts=ts)
+                status["decision"] = "outside_window"
+            elif moisture is None:
+                self.events.end_session(location, ts=ts)
+                status["decision"] = "no_data"
+            elif moisture < threshold:
+                if self._is_held(location, requested, schedule, now):
+                    self.events.end_session(location, ts=ts)
+                    status["decision"] = "held"
+                else:
+                    self.events.start_session(location, crop=crop_key, ts=ts)
+                    status["decision"] = "irrigating"
+            else:
+                self.events.end_session(location, ts=ts)
+                status["decision"] = "adequate"
+        with self._lock:
+            self._status[location] = status
+            self.evaluations += 1
+
+    def hold(self, location):
+        # operator stop: close the session now, no automatic restart until the watering window ends
+        now = datetime.now(self.tz)
+        with self._lock:
+            self._held[location] = now
+        return self.events.end_session(location, ts=now.isoformat())
+
+    # -----------------------
+    # Read side (UI)
+    # -----------------------
+    def status(self, location):
+        with self._lock:
+            status = self._status.get(location)
+            return dict(status) if status else None
+
+    def stats(self):
+        with self._lock:
+            return {"evaluations": self.evaluations, "errors": self.errors, "zones": len(self._status),
+                    "held": sorted(self._held), "running": self._thread is not None and self._thread.is_alive()}
+
+    def save_status(self):
+        with self._lock:
+            body = {"saved_at": datetime.now(self.tz).isoformat(), "zones": dict(self._status),
+                    "held": {loc: t.isoformat() for loc, t in self._held.items()}}
+            self._saved_at = time.monotonic()
+        try:
+            write_json(self.status_path, body)
+        except OSError as e:
+            print(f"IrrigationEngine {self.name} status save error:", e)
+
+
+# -----------------------
+# Engine in another process (UI side)
+# -----------------------
+_holds_lock = threading.Lock()
+
+
+class EngineView:
+    # status() / hold() of an engine running elsewhere (python irrigation_engine.py), through its files
+    def __init__(self, status_path, holds_path, tz):
+        self.status_path = status_path
+        self.holds_path = holds_path
+        self.tz = tz
+        self._status = _Source(lambda: file_version(status_path), lambda: read_json(status_path, {}) or {})
+
+    def status(self, location):
+        status = self._status.get().get("zones", {}).get(location)
+        return dict(status) if status else None
+
+    def hold(self, location):
+        # the engine closes the session and keeps it closed on its next evaluation of the zone
+        ts = datetime.now(self.tz).isoformat()
+        with _holds_lock:
+            holds = read_json(self.holds_path, {}) or {}
+            holds[location] = ts
+            write_json(self.holds_path, holds)
+        return ts
+
+    def stats(self):
+        data = self._status.get()
+        return {"saved_at": data.get("saved_at"), "zones": len(data.get("zones", {})), "held": sorted(data.get("held", {}))}
+
+
+# -----------------------
+# Process-wide registry
+# -----------------------
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_irrigation_engine(name, latest, events, config_source, crop_source, thresholds, tz, **kw):
+    with _engines_lock:
+        engine = _engines.get(name)
+        if engine is None:
+            engine = _engines[name] = IrrigationEngine(name, latest, events, config_source, crop_source, thresholds, tz, **kw)
+    engine.start()
+    return engine
+
+
+def stop_all():
+    with _engines_lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        engine.stop()
+
+
+atexit.register(stop_all)
+
+
+# -----------------------
+# Standalone process: python irrigation_engine.py
+# -----------------------
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def main():
+    import json
+    import os
+    import signal
+    from pathlib import Path
+    from zoneinfo import ZoneInfo
+
+    from crop_catalog import get_catalog
+    from file_utils import file_version
+    from ingest_pipeline import get_pipeline
+    from ingest_service import get_service
+    from irrigation_events import get_irrigation_events
+    from latest_state import get_latest_store
+    from sqlite_store import get_sqlite_backend
+    from timeseries_store import get_store
+    from topic_routing import get_router, wildcard
+    from write_buffer import get_buffer
+
+    data_dir = Path(os.environ.get("IRRIGATION_DATA_DIR", "."))
+    tz = ZoneInfo(os.environ.get("IRRIGATION_TZ", "Asia/Ho_Chi_Minh"))
+    sqlite_db = (get_sqlite_backend(data_dir / "irrigation.db")
+                 if os.environ.get("IRRIGATION_STORAGE", "json") == "sqlite" else None)
+
+    def document(name, default):
+        # (version, load) of one of the app's JSON documents, file or SQLite like the app itself
+        path = data_dir / name
+        if sqlite_db is not None:
+            return (lambda: sqlite_db.doc_version(name), lambda: sqlite_db.load_doc(name, default, import_from=path))
+
+        def load():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return default
+
+        return (lambda: file_version(path), load)
+
+    history_store = get_store(data_dir / "history_irrigation", time_key="timestamp",
+                              legacy_file=data_dir / "history_irrigation.json")
+    flow_store = get_store(data_dir / "flow_data", time_key="time", legacy_file=data_dir / "flow_data.json")
+    history_sink = sqlite_db.sink("history", "timestamp") if sqlite_db is not None else None
+    flow_sink = sqlite_db.sink("flow", "time") if sqlite_db is not None else None
+    events = get_irrigation_events(
+        data_dir / "irrigation_events", sessions_file=data_dir / "history_irrigation.json",
+        legacy_sessions=(lambda: sqlite_db.load_doc("history_irrigation.json", [])) if sqlite_db is not None else None)
+    latest = get_latest_store("irrigation_engine", data_dir / "latest_state.json")
+    buffer = get_buffer("irrigation_engine")
+    engine = get_irrigation_engine(
+        "irrigation_engine", latest, events,
+        document("config.json", {"watering_schedule": "06:00-08:00", "mode": "auto"}),
+        document("crop_data.json", {}),
+        get_catalog().default_thresholds(), tz,
+        status_path=data_dir / STATUS_FILE, holds_path=data_dir / HOLDS_FILE,
+    )
+
+    def legacy_zone():
+        # zone of the old single-device topics: env, config, or the only zone (the old one-farm setup)
+        zones = list(engine.crops.get() or {})
+        return (os.environ.get("IRRIGATION_LEGACY_LOCATION") or (engine.config.get() or {}).get("legacy_location")
+                or (zones[0] if len(zones) == 1 else ""))
+
+    legacy = {"location": legacy_zone()}
+    if not legacy["location"]:
+        print("irrigation engine: no zone for the old single-device topics, set IRRIGATION_LEGACY_LOCATION;"
+              " their readings are stored without a location and do not drive any zone")
+    router = get_router()
+    # fleet topics are routed for the zones of crop_data only (refreshed below while running)
+    router.set_locations(engine.crops.get() or {})
+
+    def decode(msg):
+        route = router.route(msg.topic)
+        if route is not None:
+            data = json.loads(msg.payload.decode("utf-8"))
+            if not isinstance(data, dict):
+                raise ValueError("sensor payload is not an object")
+            router.touch(route)
+            source = {"location": route.location, "area": route.area, "device": route.device}
+            hum, flow, pump = _number(data.get("soil_moisture")), _number(data.get("water_flow")), data.get("pump_status")
+        else:
+            source = {"location": legacy["location"]}
+            value = _number(msg.payload.decode("utf-8"))
+            hum = value if msg.topic == LEGACY_TOPIC_HUMIDITY else None
+            flow = value if msg.topic == LEGACY_TOPIC_FLOW else None
+            pump = None
+        if hum is None and flow is None:
+            return None
+        return datetime.now(tz).isoformat(), hum, flow, source, pump
+
+    def persist(value):
+        ts, hum, flow, source, pump = value
+        latest.update(source.get("location"), source.get("area"), source.get("device"),
+                      {"sensor_hum": hum, "flow": flow}, ts=ts, pump_status=pump)
+        if hum is not None:
+            record = {"timestamp": ts, "sensor_hum": hum, **source}
+            buffer.put(history_store, record)
+            if history_sink is not None:
+                buffer.put(history_sink, record)
+            engine.notify(source.get("location", ""))
+        if flow is not None:
+            record = {"time": ts, "flow": flow, **source}
+            buffer.put(flow_store, record)
+            if flow_sink is not None:
+                buffer.put(flow_sink, record)
+
+    pipeline = get_pipeline("irrigation_engine", decode, persist, ready=lambda: buffer.depth() < 15000)
+    service = get_service("irrigation_engine", os.environ.get("MQTT_BROKER", "broker.hivemq.com"),
+                          int(os.environ.get("MQTT_PORT", "1883")),
+                          [LEGACY_TOPIC_HUMIDITY, LEGACY_TOPIC_FLOW, wildcard("sensor")], None,
+                          buffer=buffer, pipeline=pipeline)
+    print(f"irrigation engine running on {data_dir.resolve()} (broker {service.broker}:{service.port})")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        while not stop.wait(engine.tick):
+            router.set_locations(engine.crops.get() or {})
+            legacy["location"] = legacy_zone()
+            print("irrigation engine:", engine.stats(), "buffer:", buffer.stats()["depth"])
+    except KeyboardInterrupt:
+        pass
+    # atexit stops the MQTT service / pipeline, then the buffers, the engine and the latest-state snapshot
+
+
+if __name__ == "__main__":
+    main()
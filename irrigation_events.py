@@ -0,0 +1,295 @@
+# irrigation_events.py
+# Irrigation event stream, separate from the sensor sample streams
+# - typed records in their own SegmentStore (one JSON-lines segment per day):
+#     {"type": "action",        "timestamp", "location", "area", "crop", "action"}
+#     {"type": "session_start", "timestamp", "session_id", "location", "crop"}
+#     {"type": "session_end",   "timestamp", "session_id", "location"}
+# - events are folded into per-location lists, plus an index of the open session per location: starting /
+#   stopping irrigation and listing a location's history cost O(events of that location), sensor samples are
+#   never read
+# - the in-memory views follow the segment files (bytes appended since the last fold, like ts_index / rollups),
+#   so another process reading the same directory (api_server) sees new events after refresh()
+# - page() answers the history tables one page at a time: location / date filtering uses bisect over the
+#   time-ordered per-location lists and only the requested slice is copied out; events folded out of order (a
+#   resumed import appending old events after live ones) are inserted at their place, so the lists stay sorted
+# - the old session file (history_irrigation.json, start_time / end_time records, or the same document from the
+#   SQLite backend) and action records mixed into the sample stream are imported once; imported actions are
+#   removed from the sample stream, and records already in the event stream are skipped, so an import
+#   interrupted before its marker is written does not duplicate anything when it runs again
+
+import heapq
+import json
+import os
+import threading
+import uuid
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from timeseries_store import get_store
+
+IMPORT_MARKER = ".events_imported"
+PAGE_ROWS = 50
+
+
+def _insort(recs, rec, field):
+    # append in time order; an older event (late / imported) goes to its place instead of the end
+    key = rec.get(field) or ""
+    if not recs or (recs[-1].get(field) or "") <= key:
+        recs.append(rec)
+    else:
+        recs.insert(bisect_right(recs, key, key=lambda r: r.get(field) or ""), rec)
+
+
+def _walk(recs, lo, hi, reverse):
+    return (recs[i] for i in (range(hi - 1, lo - 1, -1) if reverse else range(lo, hi)))
+
+
+class IrrigationEvents:
+    def __init__(self, root):
+        self.store = get_store(root, time_key="timestamp")
+        self.root = self.store.root
+        self._lock = threading.Lock()
+        self._sessions = {}  # location -> [session dict], in start order
+        self._open = {}      # location -> open session dict
+        self._by_id = {}     # session_id -> session dict
+        self._actions = {}   # location -> [action record]
+        self._offsets = {}   # day -> bytes of the segment already folded
+        self.refresh()
+
+    # -----------------------
+    # In-memory views
+    # -----------------------
+    def _apply(self, rec):
+        kind = rec.get("type")
+        loc = rec.get("location") or ""
+        if kind == "session_start":
+            session = {"session_id": rec.get("session_id"), "location": loc, "crop": rec.get("crop"),
+                       "start_time": rec.get("timestamp"), "end_time": None}
+            _insort(self._sessions.setdefault(loc, []), session, "start_time")
+            self._by_id[session["session_id"]] = session
+            current = self._open.get(loc)
+            if current is None or (current["start_time"] or "") <= (session["start_time"] or ""):
+                self._open[loc] = session
+        elif kind == "session_end":
+            session = self._by_id.get(rec.get("session_id"))
+            if session is not None and session["end_time"] is None:
+                session["end_time"] = rec.get("timestamp")
+                if self._open.get(session["location"]) is session:
+                    del self._open[session["location"]]
+        elif kind == "action":
+            _insort(self._actions.setdefault(loc, []), rec, "timestamp")
+
+    def _fold(self, day):
+        # called with self._lock held: apply the complete lines appended to the day segment since the last fold
+        path = self.store.segment_path(day)
+        done = self._offsets.get(day, 0)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size <= done:
+            return
+        with open(path, "rb") as f:
+            f.seek(done)
+            chunk = f.read(size - done)
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return
+        for line in chunk[:end].split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except ValueError:
+                continue
+        self._offsets[day] = done + end + 1
+
+    def refresh(self):
+        # new days and the tail of the newest known day; older segments are never appended to
+        with self._lock:
+            last = max(self._offsets, default="")
+            for day in self.store.days():
+                if day >= last:
+                    self._fold(day)
+
+    def _append(self, rec):
+        # called with self._lock held: disk first, the in-memory views are then folded from the segment
+        self.store.append(rec)
+        self._fold(rec["timestamp"][:10])
+        return rec
+
+    # -----------------------
+    # Sessions
+    # -----------------------
+    def open_session(self, location):
+        with self._lock:
+            session = self._open.get(location)
+            return dict(session) if session else None
+
+    def start_session(self, location, crop=None, ts=None):
+        # idempotent: an already open session for the location is returned unchanged
+        with self._lock:
+            session = self._open.get(location)
+            if session is not None:
+                return dict(session), False
+            self._append({"type": "session_start", "timestamp": ts or datetime.now().astimezone().isoformat(),
+                          "session_id": uuid.uuid4().hex, "location": location, "crop": crop})
+            return dict(self._open[location]), True
+
+    def end_session(self, location, ts=None):
+        with self._lock:
+            session = self._open.get(location)
+            if session is None:
+                return None
+            self._append({"type": "session_end", "timestamp": ts or datetime.now().astimezone().isoformat(),
+                          "session_id": session["session_id"], "location": location})
+            return dict(session)
+
+    def sessions(self, location, newest_first=True):
+        with self._lock:
+            out = [dict(s) for s in self._sessions.get(location, [])]
+        return out[::-1] if newest_first else out
+
+    # -----------------------
+    # Actions
+    # -----------------------
+    def add_action(self, record):
+        with self._lock:
+            return self._append(dict(record, type="action"))
+
+    def actions(self, location=None, newest_first=True):
+        with self._lock:
+            if location is None:
+                out = [r for recs in self._actions.values() for r in recs]
+            else:
+                out = list(self._actions.get(location, []))
+        out.sort(key=lambda r: r.get("timestamp") or "", reverse=newest_first)
+        return out
+
+    # -----------------------
+    # Paged queries (history tables)
+    # -----------------------
+    def page(self, kind="sessions", location=None, start=None, end=None, newest_first=True, offset=0, limit=PAGE_ROWS):
+        # -> (rows, total matching rows); start / end are ISO strings or dates, end exclusive
+        # per-location lists are in time order (_insort), also when an import resumed after live events
+        field = "start_time" if kind == "sessions" else "timestamp"
+        views = self._sessions if kind == "sessions" else self._actions
+        lo_key = str(start) if start is not None else None
+        hi_key = str(end) if end is not None else None
+        with self._lock:
+            lists = list(views.values()) if location is None else [views.get(location, [])]
+            ranges = []
+            for recs in lists:
+                lo = bisect_left(recs, lo_key, key=lambda r: r.get(field) or "") if lo_key else 0
+                hi = bisect_left(recs, hi_key, key=lambda r: r.get(field) or "") if hi_key else len(recs)
+                if lo < hi:
+                    ranges.append((recs, lo, hi))
+            total = sum(hi - lo for _, lo, hi in ranges)
+            if len(ranges) == 1:
+                recs, lo, hi = ranges[0]
+                if newest_first:
+                    a, b = max(hi - offset - limit, lo), hi - offset
+                    rows = recs[a:b][::-1] if b > a else []
+                else:
+                    rows = recs[lo + offset:min(lo + offset + limit, hi)]
+            else:
+                # several locations: lazy k-way merge, stops after offset + limit rows
+                its = [_walk(recs, lo, hi, newest_first) for recs, lo, hi in ranges]
+                merged = heapq.merge(*its, key=lambda r: r.get(field) or "", reverse=newest_first)
+                rows = [r for i, r in zip(range(offset + limit), merged) if i >= offset]
+            rows = [dict(r) for r in rows]
+        return rows, total
+
+    # -----------------------
+    # Retention
+    # -----------------------
+    def expire(self, days, archive_dir=None, today=None):
+        removed = self.store.expire(days, archive_dir=archive_dir, today=today)
+        if removed:
+            cutoff = ((today or date.today()) - timedelta(days=days)).isoformat()
+            with self._lock:
+                for day in removed:
+                    self._offsets.pop(day, None)
+                for loc, recs in self._actions.items():
+                    self._actions[loc] = [r for r in recs if (r.get("timestamp") or "")[:10] >= cutoff]
+                for loc, sessions in self._sessions.items():
+                    keep = []
+                    for s in sessions:
+                        if s["end_time"] is None or (s["start_time"] or "")[:10] >= cutoff:
+                            keep.append(s)
+                        else:
+                            self._by_id.pop(s["session_id"], None)
+                    self._sessions[loc] = keep
+        return removed
+
+    # -----------------------
+    # One-time import of the old layouts
+    # -----------------------
+    def import_legacy(self, sessions_file=None, sample_store=None, legacy_sessions=None):
+        # legacy_sessions: the old session list when it lives elsewhere than sessions_file (SQLite document)
+        marker = self.store.root / IMPORT_MARKER
+        if marker.exists():
+            return 0
+        with self._lock:
+            seen_sessions = {(s["location"], s["start_time"]) for ss in self._sessions.values() for s in ss}
+            seen_actions = {(r.get("location") or "", r.get("timestamp"), r.get("action"))
+                            for rs in self._actions.values() for r in rs}
+        imported = []
+        old = legacy_sessions
+        if old is None and sessions_file is not None and Path(sessions_file).exists():
+            try:
+                with open(sessions_file, "r", encoding="utf-8") as f:
+                    old = json.load(f)
+            except Exception as e:
+                print(f"IrrigationEvents import error for {sessions_file}:", e)
+                old = []
+        for r in old if isinstance(old, list) else []:
+            if not isinstance(r, dict) or not isinstance(r.get("start_time"), str):
+                continue
+            if ((r.get("location") or ""), r["start_time"]) in seen_sessions:
+                continue
+            sid = uuid.uuid4().hex
+            imported.append({"type": "session_start", "timestamp": r["start_time"], "session_id": sid,
+                             "location": r.get("location") or "", "crop": r.get("crop")})
+            if r.get("end_time"):
+                imported.append({"type": "session_end", "timestamp": r["end_time"], "session_id": sid,
+                                 "location": r.get("location") or ""})
+        if sample_store is not None:
+            for r in sample_store.read_all():
+                if r.get("action") is not None and ((r.get("location") or ""), r.get("timestamp"), r.get("action")) not in seen_actions:
+                    imported.append(dict(r, type="action"))
+        imported.sort(key=lambda r: r["timestamp"])
+        with self._lock:
+            self.store.append_many(imported)
+            for day in sorted({r["timestamp"][:10] for r in imported}):
+                self._fold(day)
+        if sample_store is not None:
+            # the actions now live here only: sample readers (history frame, rollups, charts) no longer see them
+            sample_store.discard(lambda r: r.get("action") is not None)
+        if legacy_sessions is None and sessions_file is not None and Path(sessions_file).exists():
+            # history_irrigation.json.migrated may already hold the sample import backup (timeseries_store)
+            os.replace(sessions_file, str(sessions_file) + ".sessions.migrated")
+        marker.write_text(datetime.now().isoformat(), encoding="utf-8")
+        return len(imported)
+
+
+# -----------------------
+# Process-wide registry
+# -----------------------
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def get_irrigation_events(root, sessions_file=None, sample_store=None, legacy_sessions=None):
+    # legacy_sessions: callable returning the old session list (SQLite backend), only called for the import
+    key = str(Path(root).resolve())
+    with _streams_lock:
+        events = _streams.get(key)
+        if events is None:
+            events = IrrigationEvents(root)
+            if not (events.root / IMPORT_MARKER).exists():
+                events.import_legacy(sessions_file=sessions_file, sample_store=sample_store,
+                                     legacy_sessions=legacy_sessions() if legacy_sessions is not None else None)
+            _streams[key] = events
+        return events
@@ -0,0 +1,222 @@
+# latest_state.py
+# Latest-value state per device: (location, area, device) -> last reading, its timestamp, pump status
+# - updated in place by the ingest pipeline (one dict update per message, readings of the same device are
+#   merged field by field, so humidity-only and flow-only messages complete each other)
+# - reads are O(1) whatever the history size: get() by device, location() = most recently updated device of
+#   a location (index kept on update), field() = newest value of one field in a location (index per
+#   (location, field), so a flow-only meter reporting after the moisture probe does not hide its reading),
+#   devices() for the per-location tables
+# - `stale` is computed at read time: no update for `stale_after` seconds
+# - a JSON snapshot is written in the background (at most every flush_interval seconds, only when something
+#   changed), so a restart starts from the last known state and other processes read it as is (api_server,
+#   LatestStore.from_snapshot() in a UI whose ingest runs elsewhere)
+
+import atexit
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+STALE_AFTER_S = 300
+FLUSH_INTERVAL_S = 2.0
+
+
+class DeviceState:
+    __slots__ = ("location", "area", "device", "reading", "ts", "pump_status", "updated_at", "field_at")
+
+    def __init__(self, location, area, device):
+        self.location = location
+        self.area = area
+        self.device = device
+        self.reading = {}
+        self.ts = None
+        self.pump_status = None
+        self.updated_at = 0.0
+        self.field_at = {}  # field -> (epoch, ISO timestamp) of its last value
+
+    def as_dict(self, stale_after, now=None):
+        now = time.time() if now is None else now
+        return {
+            "location": self.location,
+            "area": self.area,
+            "device": self.device,
+            "reading": dict(self.reading),
+            "timestamp": self.ts,
+            "pump_status": self.pump_status,
+            "updated_at": self.updated_at,
+            "field_at": {k: list(v) for k, v in self.field_at.items()},
+            "stale": now - self.updated_at > stale_after,
+        }
+
+
+class LatestStore:
+    def __init__(self, snapshot_path=None, stale_after=STALE_AFTER_S, flush_interval=FLUSH_INTERVAL_S):
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.stale_after = stale_after
+        self.flush_interval = flush_interval
+        self._states = {}       # (location, area, device) -> DeviceState
+        self._by_location = {}  # location -> DeviceState updated last
+        self._by_field = {}     # (location, field) -> DeviceState that reported the field last
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread = None
+        if self.snapshot_path is not None:
+            self._load()
+            self._thread = threading.Thread(target=self._run, name="latest-state", daemon=True)
+            self._thread.start()
+
+    # -----------------------
+    # Write path (ingestion)
+    # -----------------------
+    def update(self, location, area, device, reading, ts=None, pump_status=None):
+        key = (location or "", area or "", device or "")
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = DeviceState(*key)
+            now = time.time()
+            for k, v in reading.items():
+                if v is not None:
+                    state.reading[k] = v
+                    state.field_at[k] = (now, ts)
+                    self._by_field[(key[0], k)] = state
+            state.ts = ts or state.ts
+            if pump_status is not None:
+                state.pump_status = pump_status
+            state.updated_at = now
+            self._by_location[key[0]] = state
+            self._dirty = True
+
+    # -----------------------
+    # Read path
+    # -----------------------
+    def get(self, location, area="", device=""):
+        with self._lock:
+            state = self._states.get((location or "", area or "", device or ""))
+            return state.as_dict(self.stale_after) if state else None
+
+    def location(self, location):
+        with self._lock:
+            state = self._by_location.get(location or "")
+            return state.as_dict(self.stale_after) if state else None
+
+    def field(self, location, field):
+        # -> {"value", "timestamp", "location", "area", "device", "stale"} of the newest value of `field`
+        with self._lock:
+            state = self._by_field.get((location or "", field))
+            if state is None:
+                return None
+            at, ts = state.field_at[field]
+            return {"value": state.reading.get(field), "timestamp": ts, "location": state.location,
+                    "area": state.area, "device": state.device, "stale": time.time() - at > self.stale_after}
+
+    def devices(self, location=None):
+        now = time.time()
+        with self._lock:
+            states = [s for s in self._states.values() if location is None or s.location == location]
+            return [s.as_dict(self.stale_after, now) for s in states]
+
+    # -----------------------
+    # Snapshot
+    # -----------------------
+    @classmethod
+    def from_snapshot(cls, path, stale_after=STALE_AFTER_S):
+        # read-only view of another process' snapshot (no flush thread, never written back)
+        store = cls(stale_after=stale_after)
+        store._load(Path(path))
+        return store
+
+    def _load(self, path=None):
+        path = path or self.snapshot_path
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"LatestStore load error for {path}:", e)
+            return
+        for d in data.get("devices", []):
+            key = (d.get("location") or "", d.get("area") or "", d.get("device") or "")
+            state = self._states[key] = DeviceState(*key)
+            state.reading = d.get("reading") or {}
+            state.ts = d.get("timestamp")
+            state.pump_status = d.get("pump_status")
+            state.updated_at = d.get("updated_at") or 0.0
+            state.field_at = {k: tuple(v) for k, v in (d.get("field_at") or {}).items()}
+            prev = self._by_location.get(key[0])
+            if prev is None or state.updated_at >= prev.updated_at:
+                self._by_location[key[0]] = state
+            for k, (at, _) in state.field_at.items():
+                prev = self._by_field.get((key[0], k))
+                if prev is None or at >= prev.field_at[k][0]:
+                    self._by_field[(key[0], k)] = state
+
+    def flush(self):
+        if self.snapshot_path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            body = {"saved_at": time.time(), "stale_after": self.stale_after,
+                    "devices": [s.as_dict(self.stale_after) for s in self._states.values()]}
+        tmp = self.snapshot_path.with_name(self.snapshot_path.name + ".tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(body, f, ensure_ascii=False, separators=(",", ":"), default=str)
+            os.replace(tmp, self.snapshot_path)
+        except OSError as e:
+            print(f"LatestStore save error for {self.snapshot_path}:", e)
+            with self._lock:
+                self._dirty = True
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+def read_snapshot(path, stale_after=None):
+    # another process' view of the store (api_server); staleness recomputed against the current time
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stale_after = stale_after or data.get("stale_after", STALE_AFTER_S)
+    now = time.time()
+    for d in data.get("devices", []):
+        d["stale"] = now - (d.get("updated_at") or 0.0) > stale_after
+    return data
+
+
+# -----------------------
+# Process-wide registry
+# -----------------------
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_latest_store(name, snapshot_path=None, stale_after=STALE_AFTER_S):
+    with _stores_lock:
+        store = _stores.get(name)
+        if store is None:
+            store = _stores[name] = LatestStore(snapshot_path, stale_after=stale_after)
+        return store
+
+
+def close_all():
+    with _stores_lock:
+        stores = list(_stores.values())
+        _stores.clear()
+    for store in stores:
+        store.close()
+
+
+atexit.register(close_all)
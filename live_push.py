@@ -0,0 +1,252 @@
+# live_push.py
+# Push channel for the live widgets (sensor values, pump LED), fed by the ingest pipeline
+# - LiveHub keeps only the latest payload per channel (channel = location) with a global sequence number;
+#   publish() is O(1) and never blocks the pipeline
+# - a small threaded HTTP server streams server-sent events (GET /events?channel=..) to the browsers; each
+#   connection waits on the hub's condition and sends the channels that changed since its last sequence, so a
+#   slow client skips intermediate values instead of queueing them (coalescing)
+# - live_panel_html() renders the widgets as one HTML component that updates itself from the stream: new data
+#   changes a few DOM nodes in the open pages, the Streamlit script is not re-run
+# - payloads come from devices: live_payload() keeps only numeric fields, a known pump status and the
+#   timestamp before publish(), and every JSON value embedded in the page's <script> goes through
+#   _script_json() ("<", ">" and "&" escaped), so a payload cannot close the script tag
+# - server CPU follows the data rate (one publish per sample, one write per connected widget), not
+#   sessions x refresh interval
+# - every app passes its own port (never Streamlit's 8501 / 8502 fallback); a port that cannot be bound is
+#   reported in hub.error and retried on the next get_live_hub() call, the apps show the error instead of a
+#   panel that connects nowhere
+# - the stream needs the hub's random token (?token=..., embedded in the panel the app renders), so only
+#   pages served by the app can subscribe; LIVE_HOST sets the bind address (default all interfaces, e.g.
+#   127.0.0.1 behind a reverse proxy); public_url overrides the URL the browser connects to, otherwise the
+#   page's host name and the hub's port are used
+
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+LIVE_HOST = os.environ.get("LIVE_HOST", "0.0.0.0")
+KEEPALIVE_S = 15.0
+PUMP_STATES = ("ON", "OFF")
+
+
+def live_payload(data, fields, timestamp):
+    # whitelist of what reaches the browsers: numeric `fields`, pump_status ON / OFF, the timestamp
+    out = {"timestamp": timestamp}
+    for key in fields:
+        value = data.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[key] = value
+    pump = str(data.get("pump_status") or "").upper()
+    if pump in PUMP_STATES:
+        out["pump_status"] = pump
+    return out
+
+
+def _script_json(obj):
+    # JSON safe to embed inside <script>: no "</script>", "<!--" or entity can be formed from the data
+    return (json.dumps(obj, ensure_ascii=False, default=str)
+            .replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026"))
+
+
+class LiveHub:
+    def __init__(self, name):
+        self.name = name
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._latest = {}  # channel -> (seq, payload)
+        self.published = 0
+        self.clients = 0
+        self.port = None
+        self.public_url = ""
+        self.server = None
+        self.error = None
+        self.token = secrets.token_urlsafe(16)
+
+    def publish(self, channel, payload):
+        with self._cond:
+            self._seq += 1
+            self._latest[channel or ""] = (self._seq, payload)
+            self.published += 1
+            self._cond.notify_all()
+
+    def latest(self, channel):
+        with self._cond:
+            entry = self._latest.get(channel or "")
+            return entry[1] if entry else None
+
+    def wait(self, since, channels=None, timeout=KEEPALIVE_S):
+        # -> (seq, [(channel, payload)]) changed after `since`; empty list on timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                changed = [(ch, p) for ch, (s, p) in self._latest.items()
+                           if s > since and (channels is None or ch in channels)]
+                if changed:
+                    return self._seq, changed
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return self._seq, []
+                self._cond.wait(remaining)
+
+    def stats(self):
+        with self._cond:
+            return {"seq": self._seq, "published": self.published, "clients": self.clients, "channels": len(self._latest)}
+
+
+class _SseHandler(BaseHTTPRequestHandler):
+    hub = None  # set per server class
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/events":
+            self.send_error(404)
+            return
+        # keep_blank_values: "channel=" is the channel of the devices without a location
+        query = parse_qs(url.query, keep_blank_values=True)
+        token = (query.get("token") or [""])[0].encode("utf-8")
+        if not hmac.compare_digest(token, self.hub.token.encode("utf-8")):
+            self.send_error(403)
+            return
+        channels = set(query["channel"]) if "channel" in query else None
+        try:
+            since = int(self.headers.get("Last-Event-ID") or 0)
+        except ValueError:
+            since = 0
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        hub = self.hub
+        with hub._cond:
+            hub.clients += 1
+        try:
+            while True:
+                seq, changed = hub.wait(since, channels)
+                if changed:
+                    body = "".join(
+                        f"id: {seq}\nevent: {ch or '_'}\ndata: {json.dumps(p, ensure_ascii=False, default=str)}\n\n"
+                        for ch, p in changed
+                    )
+                    since = seq
+                else:
+                    body = ": keepalive\n\n"
+                self.wfile.write(body.encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        finally:
+            with hub._cond:
+                hub.clients -= 1
+
+
+def _serve(hub, host, port):
+    handler = type("SseHandler", (_SseHandler,), {"hub": hub})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        hub.error = f"cannot listen on {host}:{port}: {e}"
+        print(f"LiveHub {hub.name}: {hub.error}")
+        return None
+    hub.error = None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"live-{hub.name}", daemon=True).start()
+    return server
+
+
+def live_panel_html(hub, channels, fields, pump_label=None, spark_points=0, history=None):
+    # channels: locations to follow ("" = devices on the old topics without a location)
+    # fields: [(key, label, unit)]; pump_label: show the pump LED from payload["pump_status"]
+    # spark_points > 0 adds a small line of the last N values under each field
+    # the panel starts from `history` (recent payloads, oldest first) or the hub's latest payloads, then
+    # follows the stream; callers check hub.error first (no server, nothing to follow)
+    channels = [c or "" for c in channels]
+    if history:
+        initial = list(history)[-max(spark_points, 1):]
+    else:
+        initial = [p for p in (hub.latest(c) for c in channels) if p]
+        initial.sort(key=lambda p: str(p.get("timestamp") or ""))
+    url = hub.public_url or ""
+    rows = "".join(
+        f"<div class='f'><span class='l'>{label}</span> <b id='v_{key}'>–</b> {unit}"
+        + (f"<svg id='s_{key}' width='100%' height='36' preserveAspectRatio='none'><polyline fill='none' stroke='#2e7d32' stroke-width='2'/></svg>" if spark_points else "")
+        + "</div>"
+        for key, label, unit in fields
+    )
+    pump = (f"<div class='f'><span id='led' class='led'></span><b>{pump_label}: <span id='pump'>–</span></b></div>" if pump_label else "")
+    return f"""
+<style>
+  body {{ font-family: "Source Sans Pro", sans-serif; margin: 0; }}
+  .f {{ margin: 4px 0; font-size: 16px; }}
+  .l {{ color: #555; }}
+  .led {{ display:inline-block; width:14px; height:14px; border-radius:50%; margin-right:6px; background:#555555; vertical-align:middle; }}
+  #ts {{ color: #888; font-size: 12px; }}
+</style>
+<div>{rows}{pump}<div id="ts"></div></div>
+<script>
+(function() {{
+  var base = {_script_json(url)};
+  if (!base) {{
+    var host = "localhost";
+    try {{ host = window.parent.location.hostname || host; }} catch (e) {{ host = window.location.hostname || host; }}
+    base = window.location.protocol.replace("about:", "http:") + "//" + host + ":{hub.port}";
+  }}
+  var fields = {_script_json([k for k, _, _ in fields])};
+  var sparkN = {int(spark_points)}, series = {{}};
+  function spark(key, v) {{
+    var s = series[key] = (series[key] || []).concat([v]).slice(-sparkN);
+    var svg = document.getElementById("s_" + key); if (!svg || s.length < 2) return;
+    var lo = Math.min.apply(null, s), hi = Math.max.apply(null, s), w = svg.clientWidth || 300, span = (hi - lo) || 1;
+    svg.firstChild.setAttribute("points", s.map(function(y, i) {{
+      return (i * w / (sparkN - 1)).toFixed(1) + "," + (34 - (y - lo) * 32 / span).toFixed(1);
+    }}).join(" "));
+  }}
+  function show(d) {{
+    fields.forEach(function(k) {{
+      if (d[k] === undefined || d[k] === null) return;
+      document.getElementById("v_" + k).textContent = d[k];
+      if (sparkN) spark(k, Number(d[k]));
+    }});
+    if (d.pump_status !== undefined && document.getElementById("pump")) {{
+      document.getElementById("pump").textContent = d.pump_status;
+      document.getElementById("led").style.background = String(d.pump_status).toUpperCase() === "ON" ? "#00FF00" : "#555555";
+    }}
+    if (d.timestamp) document.getElementById("ts").textContent = d.timestamp;
+  }}
+  {_script_json(initial)}.forEach(show);
+  var channels = {_script_json(channels)};
+  var es = new EventSource(base + "/events?token=" + {_script_json(hub.token)} + "&" + channels.map(function(c) {{ return "channel=" + encodeURIComponent(c); }}).join("&"));
+  channels.forEach(function(c) {{
+    es.addEventListener(c || "_", function(e) {{ show(JSON.parse(e.data)); }});
+  }});
+}})();
+</script>
+"""
+
+
+# -----------------------
+# Process-wide registry (one hub + SSE server per app)
+# -----------------------
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def get_live_hub(name, port, host=LIVE_HOST, public_url=""):
+    with _hubs_lock:
+        hub = _hubs.get(name)
+        if hub is None:
+            hub = _hubs[name] = LiveHub(name)
+            hub.port = port
+            hub.public_url = public_url
+        if hub.server is None:
+            # first call, or the port was busy last time
+            hub.server = _serve(hub, host, hub.port)
+        return hub
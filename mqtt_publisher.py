@@ -0,0 +1,187 @@
+# mqtt_publisher.py
+# Long-lived MQTT publisher shared by all sessions
+# - one connected paho client per server process (loop_start thread, automatic reconnect)
+# - publish() only queues the message and returns a PublishHandle; QoS 1 messages issued while the broker is
+#   unreachable stay in paho's outbound queue and are sent after the reconnect
+# - the handle is marked "acked" when the broker's PUBACK arrives (on_publish), so the UI can report delivery
+
+import atexit
+import threading
+import time
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+
+class PublishHandle:
+    def __init__(self, topic, payload_size, qos):
+        self.topic = topic
+        self.payload_size = payload_size
+        self.qos = qos
+        self.mid = None
+        self.status = "queued"  # queued -> acked | failed
+        self.error = None
+        self.created_at = time.time()
+        self.acked_at = None
+        self._event = threading.Event()
+        self._callbacks = []
+
+    @property
+    def acked(self):
+        return self.status == "acked"
+
+    @property
+    def failed(self):
+        return self.status == "failed"
+
+    def wait(self, timeout=None):
+        # True once the broker acknowledged the message
+        self._event.wait(timeout)
+        return self.acked
+
+    def add_done_callback(self, fn):
+        # fn(handle) runs once the message is acked or failed (immediately if it already is)
+        self._callbacks.append(fn)
+        if self._event.is_set():
+            self._run_callbacks()
+
+    def _run_callbacks(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                print("PublishHandle callback error:", e)
+
+    def _ack(self):
+        self.status = "acked"
+        self.acked_at = time.time()
+        self._event.set()
+        self._run_callbacks()
+
+    def _fail(self, error):
+        self.status = "failed"
+        self.error = error
+        self._event.set()
+        self._run_callbacks()
+
+
+class MqttPublisher:
+    def __init__(self, name, broker, port, keepalive=60, max_queued=1000):
+        self.name = name
+        self.broker = broker
+        self.port = port
+        self.connected = False
+        self.last_error = None
+        self._pending = {}
+        # PUBACKs that arrived before publish() registered the handle
+        self._early_acks = set()
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=20)
+        self.published = 0
+        self.acked = 0
+        client = mqtt.Client()
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_publish = self._on_publish
+        client.reconnect_delay_set(min_delay=1, max_delay=60)
+        client.max_queued_messages_set(max_queued)
+        self._client = client
+        try:
+            client.connect_async(broker, port, keepalive)
+            client.loop_start()
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"MqttPublisher {name} start error:", e)
+
+    # -----------------------
+    # paho callbacks
+    # -----------------------
+    def _on_connect(self, client, userdata, flags, rc):
+        self.connected = rc == 0
+        self.last_error = None if rc == 0 else f"connect rc={rc}"
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        if rc != 0:
+            self.last_error = f"disconnect rc={rc}"
+
+    def _on_publish(self, client, userdata, mid):
+        with self._lock:
+            handle = self._pending.pop(mid, None)
+            if handle is None:
+                self._early_acks.add(mid)
+        if handle is not None:
+            self.acked += 1
+            handle._ack()
+
+    # -----------------------
+    # Public API
+    # -----------------------
+    def publish(self, topic, payload, qos=1, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        handle = PublishHandle(topic, len(payload), qos)
+        # not under self._lock: paho runs on_publish while holding its own outbound mutex
+        try:
+            info = self._client.publish(topic, payload, qos=qos, retain=retain)
+        except Exception as e:
+            handle._fail(str(e))
+            self.recent.appendleft(handle)
+            return handle
+        handle.mid = info.mid
+        queued_offline = info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0
+        if info.rc == mqtt.MQTT_ERR_SUCCESS or queued_offline:
+            with self._lock:
+                if info.mid in self._early_acks:
+                    self._early_acks.discard(info.mid)
+                    early = True
+                else:
+                    self._pending[info.mid] = handle
+                    early = False
+            if early:
+                self.acked += 1
+                handle._ack()
+        else:
+            handle._fail(mqtt.error_string(info.rc))
+        self.published += 1
+        self.recent.appendleft(handle)
+        return handle
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def stop(self):
+        try:
+            self._client.disconnect()
+            self._client.loop_stop()
+        except Exception as e:
+            print(f"MqttPublisher {self.name} stop error:", e)
+
+
+# -----------------------
+# Registry: one publisher per (broker, port) for the whole server process
+# -----------------------
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+
+def get_publisher(broker, port, name="publisher"):
+    with _publishers_lock:
+        pub = _publishers.get((broker, port))
+        if pub is None:
+            pub = MqttPublisher(name, broker, port)
+            _publishers[(broker, port)] = pub
+        return pub
+
+
+def stop_all():
+    with _publishers_lock:
+        pubs = list(_publishers.values())
+        _publishers.clear()
+    for pub in pubs:
+        pub.stop()
+
+
+atexit.register(stop_all)
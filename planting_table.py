@@ -0,0 +1,90 @@
+# planting_table.py
+# Batch computation of the "Plantings in area" table
+# - growth stages are compiled once into per-crop breakpoint arrays: stage i covers days <= breaks[i], the
+#   last label everything after; a whole column of days is labelled with one np.searchsorted per crop
+# - planting dates are parsed, and days planted / harvest windows derived, as whole columns (no per-row Python)
+# - tables are cached per (data version, location, area, day, language); the data version is the mtime of the
+#   crop data file, so a cached table is reused until crop_data is saved again
+
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+
+def compile_stages(stage_defs):
+    # {crop: [(max_days, label), ..., (None, label)]} -> {crop: (breaks int32 array, labels array)}
+    compiled = {}
+    for crop, stages in stage_defs.items():
+        breaks = np.array([d for d, _ in stages if d is not None], dtype=np.int32)
+        labels = np.array([label for _, label in stages], dtype=object)
+        compiled[crop] = (breaks, labels)
+    return compiled
+
+
+def stage_of(compiled, crop, days):
+    # single lookup (same rule as the batch version)
+    table = compiled.get(crop)
+    if table is None:
+        return None
+    breaks, labels = table
+    return labels[min(bisect_left(breaks.tolist(), days), len(labels) - 1)]
+
+
+def build_planting_table(plantings, crops, compiled_stages, crop_names, today=None):
+    today = today or date.today()
+    df = pd.DataFrame(plantings, columns=["crop", "planting_date"])
+    crop_keys = df["crop"].to_numpy(dtype=object)
+    # unparseable / missing dates count as planted today (same as the old row loop)
+    planted = pd.to_datetime(df["planting_date"], format="ISO8601", errors="coerce").fillna(pd.Timestamp(today))
+    planted = planted.dt.normalize()
+    days_planted = (pd.Timestamp(today) - planted).dt.days.to_numpy()
+
+    codes = {k: i for i, k in enumerate(crops)}
+    crop_codes = np.fromiter((codes.get(k, -1) for k in crop_keys), dtype=np.int32, count=len(crop_keys))
+    min_days = np.append(np.array([v[0] for v in crops.values()], dtype=np.int64), 0)[crop_codes]
+    max_days = np.append(np.array([v[1] for v in crops.values()], dtype=np.int64), 0)[crop_codes]
+
+    stages = np.full(len(df), None, dtype=object)
+    for crop, (breaks, labels) in compiled_stages.items():
+        mask = crop_keys == crop
+        if mask.any():
+            idx = np.minimum(np.searchsorted(breaks, days_planted[mask], side="left"), len(labels) - 1)
+            stages[mask] = labels[idx]
+
+    return pd.DataFrame({
+        "crop": [crop_names.get(k, k) for k in crop_keys],
+        "planting_date": planted.dt.strftime("%d/%m/%Y"),
+        "expected_harvest_from": (planted + pd.to_timedelta(min_days, unit="D")).dt.strftime("%d/%m/%Y"),
+        "expected_harvest_to": (planted + pd.to_timedelta(max_days, unit="D")).dt.strftime("%d/%m/%Y"),
+        "days_planted": days_planted,
+        "stage": stages,
+    })
+
+
+# -----------------------
+# Process-wide LRU of built tables
+# -----------------------
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+MAX_TABLES = 256
+
+
+def get_planting_table(key, plantings, crops, compiled_stages, crop_names, today=None):
+    # key must change whenever the plantings change (e.g. include file_utils.file_version(DATA_FILE))
+    today = today or date.today()
+    key = (key, today)
+    with _tables_lock:
+        df = _tables.get(key)
+        if df is not None:
+            _tables.move_to_end(key)
+            return df
+    df = build_planting_table(plantings, crops, compiled_stages, crop_names, today=today)
+    with _tables_lock:
+        _tables[key] = df
+        while len(_tables) > MAX_TABLES:
+            _tables.popitem(last=False)
+    return df
@@ -0,0 +1,103 @@
+# retention.py
+# Background retention / compaction job
+# - replaces the per-insert _trim_history_list: nothing is trimmed on the ingest path any more
+# - one daemon thread per server process wakes up every `interval` seconds and expires whole day segments
+#   per stream (sensor history, flow, irrigation actions), either dropping them or gzipping them to archive/
+# - expiring a day also removes what was derived from it (time index / rollup sidecars, see
+#   SegmentStore.add_expire_listener); JSON documents edited by the UI are never rewritten from here, the
+#   irrigation sessions they used to hold live in the event stream (irrigation_events.py)
+
+import threading
+import time
+
+# default policy per stream: days to keep, archive (gzip) instead of deleting
+DEFAULT_POLICY = {
+    "history": {"days": 365, "archive": False},
+    "flow": {"days": 365, "archive": False},
+    "irrigation": {"days": 730, "archive": True},
+}
+
+
+def merge_policy(overrides=None):
+    # overrides e.g. config["retention"] = {"flow": {"days": 90}}
+    policy = {k: dict(v) for k, v in DEFAULT_POLICY.items()}
+    for stream, value in (overrides or {}).items():
+        if isinstance(value, (int, float)):
+            value = {"days": int(value)}
+        if isinstance(value, dict):
+            policy.setdefault(stream, {"days": 365, "archive": False}).update(value)
+    return policy
+
+
+class RetentionJob:
+    def __init__(self, interval=3600):
+        self.interval = interval
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self.runs = 0
+        self.last_run = None
+        self.last_result = {}
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    # -----------------------
+    # Registration (idempotent, safe to call on every rerun)
+    # -----------------------
+    def add_store(self, name, store, days, archive=False):
+        archive_dir = store.root / "archive" if archive else None
+
+        def job():
+            return store.expire(days, archive_dir=archive_dir)
+
+        with self._lock:
+            self._jobs[name] = job
+
+    # -----------------------
+    # Execution
+    # -----------------------
+    def run_once(self):
+        with self._lock:
+            jobs = list(self._jobs.items())
+        result = {}
+        for name, job in jobs:
+            try:
+                result[name] = job()
+            except Exception as e:
+                result[name] = f"error: {e}"
+                print(f"RetentionJob {name} error:", e)
+        self.runs += 1
+        self.last_run = time.time()
+        self.last_result = result
+        return result
+
+    def trigger(self):
+        self._wake.set()
+
+    def _run(self):
+        # first pass shortly after start so registrations from the first rerun are included
+        self._wake.wait(timeout=5)
+        while not self._stopped:
+            self._wake.clear()
+            self.run_once()
+            self._wake.wait(timeout=self.interval)
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+
+# -----------------------
+# Process-wide singleton
+# -----------------------
+_job = None
+_job_lock = threading.Lock()
+
+
+def get_retention_job(interval=3600):
+    global _job
+    with _job_lock:
+        if _job is None:
+            _job = RetentionJob(interval=interval)
+        return _job
@@ -0,0 +1,262 @@
+# rollups.py
+# Pre-aggregated rollups (minute / hour / day) over the day segments of a SegmentStore
+# - buckets come from the ISO timestamp prefix (local wall clock as stored): minute = ts[:16], hour = ts[:13], day = ts[:10]
+# - each bucket keeps count / sum / min / max per field, so mean is exact and peaks are preserved
+# - a day is folded incrementally: only the bytes appended to its segment since the last fold are read,
+#   right after each store append (listener), so queries for today only touch the last few samples
+# - closed days are saved next to the segments (_rollup/<day>.json + <day>.hour.json) and never re-read from raw data;
+#   they are removed with their segment when retention expires the day, leftovers of segments that no longer
+#   exist when the index is opened
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from pathlib import Path
+
+RESOLUTION_DAYS = {"minute": 1440, "hour": 24, "day": 1}  # buckets per day
+
+
+def _fold(buckets, key, record, fields):
+    slot = None
+    for field in fields:
+        v = record.get(field)
+        if v is None or isinstance(v, bool):
+            continue
+        try:
+            v = float(v)
+        except (TypeError, ValueError):
+            continue
+        if slot is None:
+            slot = buckets.get(key)
+            if slot is None:
+                slot = buckets[key] = {}
+        agg = slot.get(field)
+        if agg is None:
+            slot[field] = [1, v, v, v]
+        else:
+            agg[0] += 1
+            agg[1] += v
+            if v < agg[2]:
+                agg[2] = v
+            if v > agg[3]:
+                agg[3] = v
+
+
+def _merge(dst, src):
+    for field, agg in src.items():
+        cur = dst.get(field)
+        if cur is None:
+            dst[field] = list(agg)
+        else:
+            cur[0] += agg[0]
+            cur[1] += agg[1]
+            cur[2] = min(cur[2], agg[2])
+            cur[3] = max(cur[3], agg[3])
+
+
+class _DayRollup:
+    def __init__(self):
+        self.offset = 0
+        self.minute = {}  # location -> {minute_key: {field: [n, sum, min, max]}}
+        self.hour = {}    # location -> {hour_key: {...}}
+
+
+class RollupIndex:
+    def __init__(self, store, fields, location_key="location", cache_days=64):
+        self.store = store
+        self.fields = list(fields)
+        self.location_key = location_key
+        self.cache_days = cache_days
+        self.dir = Path(store.root) / "_rollup"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._days = OrderedDict()
+        self._hours_only = OrderedDict()
+        self._lock = threading.Lock()
+        store.add_listener(self._on_append)
+        store.add_expire_listener(self._on_expire)
+        self._on_expire(sorted({n.split(".")[0] for n in os.listdir(self.dir) if n.endswith(".json")} - set(store.days())))
+
+    def _on_append(self, days):
+        for day in days:
+            self._day(day)
+
+    def _on_expire(self, days):
+        # the segments are gone (retention): drop their rollups from memory and disk
+        with self._lock:
+            for day in days:
+                self._days.pop(day, None)
+                self._hours_only.pop(day, None)
+                for name in (f"{day}.json", f"{day}.hour.json"):
+                    try:
+                        os.remove(self.dir / name)
+                    except OSError:
+                        pass
+
+    # -----------------------
+    # Folding raw segments
+    # -----------------------
+    def _load_sidecar(self, day):
+        try:
+            with open(self.dir / f"{day}.json", "r", encoding="utf-8") as f:
+                data = json.load(f)
+            r = _DayRollup()
+            r.offset = data.get("offset", 0)
+            r.minute = data.get("minute", {})
+            r.hour = data.get("hour", {})
+            return r
+        except (OSError, ValueError):
+            return None
+
+    def _save_sidecar(self, day, r):
+        tmp = self.dir / f"{day}.json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"offset": r.offset, "minute": r.minute, "hour": r.hour}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.dir / f"{day}.json")
+        tmp = self.dir / f"{day}.hour.json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"offset": r.offset, "hour": r.hour}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.dir / f"{day}.hour.json")
+
+    def _refresh(self, day, r):
+        path = self.store.segment_path(day)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return False
+        if size < r.offset:
+            # segment was replaced (e.g. restored from archive): fold it again from the start
+            r.offset, r.minute, r.hour = 0, {}, {}
+        if size <= r.offset:
+            return False
+        time_key = self.store.time_key
+        with open(path, "rb") as f:
+            f.seek(r.offset)
+            chunk = f.read(size - r.offset)
+        # only consume complete lines; a line being written right now is picked up next time
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return False
+        for line in chunk[:end].split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            ts = rec.get(time_key)
+            if not isinstance(ts, str) or len(ts) < 16:
+                continue
+            loc = rec.get(self.location_key) or ""
+            _fold(r.minute.setdefault(loc, {}), ts[:16], rec, self.fields)
+            _fold(r.hour.setdefault(loc, {}), ts[:13], rec, self.fields)
+        r.offset += end + 1
+        return True
+
+    def _day(self, day):
+        # minute-level rollup of one day, refreshed with whatever was appended since last time
+        with self._lock:
+            r = self._days.get(day)
+            if r is None:
+                r = self._load_sidecar(day) or _DayRollup()
+                self._days[day] = r
+            self._days.move_to_end(day)
+            changed = self._refresh(day, r)
+            if changed and day < date.today().isoformat():
+                self._save_sidecar(day, r)
+                self._hours_only.pop(day, None)
+            while len(self._days) > self.cache_days:
+                self._days.popitem(last=False)
+            return r
+
+    def _day_hours(self, day):
+        # hour-level rollup only; closed days come from the small .hour.json sidecar
+        if day >= date.today().isoformat() or day in self._days:
+            return self._day(day).hour
+        with self._lock:
+            hours = self._hours_only.get(day)
+            if hours is not None:
+                self._hours_only.move_to_end(day)
+                return hours
+        try:
+            with open(self.dir / f"{day}.hour.json", "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("offset", -1) == os.path.getsize(self.store.segment_path(day)):
+                with self._lock:
+                    self._hours_only[day] = data.get("hour", {})
+                    while len(self._hours_only) > self.cache_days * 8:
+                        self._hours_only.popitem(last=False)
+                return data.get("hour", {})
+        except (OSError, ValueError):
+            pass
+        return self._day(day).hour
+
+    # -----------------------
+    # Queries
+    # -----------------------
+    def pick_resolution(self, start, end, max_points=1500):
+        n_days = (end - start).days + 1
+        for res in ("minute", "hour", "day"):
+            if n_days * RESOLUTION_DAYS[res] <= max_points:
+                return res
+        return "day"
+
+    def query(self, start, end=None, location=None, resolution="auto", max_points=1500):
+        # start / end: date (inclusive). Returns one dict per bucket, sorted by time:
+        # {"time": "2025-01-31T06:05", "<field>_min", "<field>_max", "<field>_mean", "<field>_count", ...}
+        end = end or start
+        if resolution == "auto":
+            resolution = self.pick_resolution(start, end, max_points)
+        existing = set(self.store.days())
+        merged = {}
+        d = start
+        while d <= end:
+            day = d.isoformat()
+            d += timedelta(days=1)
+            if day not in existing:
+                continue
+            if resolution == "minute":
+                per_loc = self._day(day).minute
+            else:
+                per_loc = self._day_hours(day)
+            # merged under the lock: an append (listener, another thread) may be folding into the same dicts
+            with self._lock:
+                for loc, buckets in per_loc.items():
+                    if location is not None and loc != location:
+                        continue
+                    for key, slot in buckets.items():
+                        bkey = key if resolution != "day" else key[:10]
+                        _merge(merged.setdefault(bkey, {}), slot)
+        out = []
+        for key in sorted(merged):
+            # "2025-01-31T06" (hour bucket) is not valid ISO on its own
+            row = {"time": key + ":00" if len(key) == 13 else key}
+            for field in self.fields:
+                agg = merged[key].get(field)
+                if agg is None:
+                    continue
+                n, total, lo, hi = agg
+                row[f"{field}_count"] = n
+                row[f"{field}_mean"] = total / n
+                row[f"{field}_min"] = lo
+                row[f"{field}_max"] = hi
+            out.append(row)
+        return out
+
+
+# -----------------------
+# Process-wide registry (one rollup index per store)
+# -----------------------
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_rollups(store, fields, location_key="location"):
+    key = str(Path(store.root).resolve())
+    with _indexes_lock:
+        idx = _indexes.get(key)
+        if idx is None:
+            idx = RollupIndex(store, fields, location_key=location_key)
+            _indexes[key] = idx
+        return idx
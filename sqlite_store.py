@@ -0,0 +1,205 @@
+# sqlite_store.py
+# Optional SQLite backend (WAL) behind the apps' load_json / save_json helpers
+# - documents (config.json, crop_data.json, ...) are rows of a key/value table, written in one transaction:
+#   concurrent sessions never see a half-written file and the last writer no longer truncates a reader
+# - plantings are mirrored from crop_data on every save into an indexed table (location, area, crop); the
+#   planting tables of both apps read it through plantings() when this backend is active
+# - readings (stream, location, device, ts) is an indexed table: a ReadingSink can be handed to the
+#   write-behind buffer like any store (append_many), the history charts query it by location / time range,
+#   and it is trimmed by the retention job like the segment stores (ReadingSink.expire -> DELETE ... WHERE ts < ?)
+# - irrigation events are not mirrored: irrigation_events.py is their only store (typed stream with its own
+#   per-location index); latest values come from latest_state.py
+# - one connection per backend (check_same_thread=False), every statement runs under the backend lock: the
+#   Streamlit script threads and the write-behind flusher share it instead of each opening their own; WAL mode
+#   keeps other processes' readers and the writer from blocking each other
+
+import json
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    rev INTEGER NOT NULL DEFAULT 1,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY,
+    stream TEXT NOT NULL,
+    location TEXT NOT NULL DEFAULT '',
+    device TEXT NOT NULL DEFAULT '',
+    ts TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS readings_loc_dev_ts ON readings (stream, location, device, ts);
+CREATE INDEX IF NOT EXISTS readings_loc_ts ON readings (stream, location, ts);
+CREATE INDEX IF NOT EXISTS readings_ts ON readings (stream, ts);
+CREATE TABLE IF NOT EXISTS plantings (
+    id INTEGER PRIMARY KEY,
+    location TEXT NOT NULL,
+    area TEXT NOT NULL DEFAULT '',
+    crop TEXT NOT NULL,
+    planting_date TEXT
+);
+CREATE INDEX IF NOT EXISTS plantings_loc_area ON plantings (location, area, crop);
+"""
+
+
+def iter_plantings(crop_data):
+    # (location, area, crop, planting_date) from both crop_data layouts:
+    # {city: {"areas": {area: [..]}}} (web_phan_quyen) and {city: {"plots": [..]}} (web_tuoi_tieu)
+    for location, entry in (crop_data or {}).items():
+        if not isinstance(entry, dict):
+            continue
+        groups = list((entry.get("areas") or {}).items())
+        if entry.get("plots"):
+            groups.append(("", entry["plots"]))
+        for area, plots in groups:
+            for p in plots or []:
+                if isinstance(p, dict) and p.get("crop"):
+                    yield location, area, p["crop"], p.get("planting_date")
+
+
+class SqliteBackend:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=10000")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def _fetch(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    # -----------------------
+    # Documents (load_json / save_json)
+    # -----------------------
+    def load_doc(self, name, default=None, import_from=None):
+        rows = self._fetch("SELECT body FROM documents WHERE name = ?", (name,))
+        if rows:
+            return json.loads(rows[0][0])
+        # first use: import the existing JSON file once
+        if import_from is not None and Path(import_from).exists():
+            try:
+                with open(import_from, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"SqliteBackend import error for {import_from}:", e)
+                return default
+            self.save_doc(name, data)
+            return data
+        return default
+
+    def save_doc(self, name, data):
+        body = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            with self._db as conn:
+                conn.execute(
+                    "INSERT INTO documents (name, body, rev, updated_at) VALUES (?, ?, 1, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET body = excluded.body, rev = rev + 1, updated_at = excluded.updated_at",
+                    (name, body, time.time()),
+                )
+                if name == "crop_data.json":
+                    conn.execute("DELETE FROM plantings")
+                    conn.executemany(
+                        "INSERT INTO plantings (location, area, crop, planting_date) VALUES (?, ?, ?, ?)",
+                        list(iter_plantings(data)),
+                    )
+
+    def doc_version(self, name):
+        rows = self._fetch("SELECT rev, updated_at FROM documents WHERE name = ?", (name,))
+        return tuple(rows[0]) if rows else None
+
+    # -----------------------
+    # Readings
+    # -----------------------
+    def add_readings(self, stream, records, time_key="timestamp"):
+        rows = [
+            (stream, r.get("location") or "", r.get("device") or "", r[time_key], json.dumps(r, ensure_ascii=False))
+            for r in records if isinstance(r.get(time_key), str)
+        ]
+        with self._lock:
+            with self._db as conn:
+                conn.executemany("INSERT INTO readings (stream, location, device, ts, body) VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def readings(self, stream, location=None, device=None, start=None, end=None, limit=None):
+        sql = "SELECT body FROM readings WHERE stream = ?"
+        args = [stream]
+        for col, val in (("location", location), ("device", device)):
+            if val is not None:
+                sql += f" AND {col} = ?"
+                args.append(val)
+        if start is not None:
+            sql += " AND ts >= ?"
+            args.append(str(start))
+        if end is not None:
+            sql += " AND ts < ?"
+            args.append(str(end))
+        sql += " ORDER BY ts"
+        if limit:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        return [json.loads(b) for (b,) in self._fetch(sql, args)]
+
+    def expire_readings(self, stream, cutoff):
+        # retention: readings of `stream` older than cutoff (ISO date / timestamp, uses the (stream, ts) index)
+        with self._lock:
+            with self._db as conn:
+                return conn.execute("DELETE FROM readings WHERE stream = ? AND ts < ?", (stream, str(cutoff))).rowcount
+
+    def plantings(self, location, area=None):
+        sql = "SELECT location, area, crop, planting_date FROM plantings WHERE location = ?"
+        args = [location]
+        if area is not None:
+            sql += " AND area = ?"
+            args.append(area)
+        sql += " ORDER BY id"  # order of the crop_data document
+        return [dict(zip(("location", "area", "crop", "planting_date"), r)) for r in self._fetch(sql, args)]
+
+    def sink(self, stream, time_key="timestamp"):
+        return ReadingSink(self, stream, time_key)
+
+
+class ReadingSink:
+    # store-like adapter for WriteBehindBuffer.put(sink, record)
+    def __init__(self, backend, stream, time_key):
+        self.backend = backend
+        self.stream = stream
+        self.time_key = time_key
+
+    def append(self, record):
+        return self.append_many([record])
+
+    def append_many(self, records):
+        return self.backend.add_readings(self.stream, records, time_key=self.time_key)
+
+    def expire(self, days, archive_dir=None, today=None):
+        # same call as SegmentStore.expire (retention job); rows are deleted, there is nothing to archive
+        cutoff = ((today or date.today()) - timedelta(days=days)).isoformat()
+        return self.backend.expire_readings(self.stream, cutoff)
+
+
+# -----------------------
+# Process-wide registry
+# -----------------------
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_sqlite_backend(path):
+    key = str(Path(path).resolve())
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            backend = _backends[key] = SqliteBackend(path)
+        return backend
@@ -0,0 +1,66 @@
+# the apps are Streamlit scripts: the pipeline callbacks are compiled out of them and run with only the module
+# globals assigned before the ingest section (everything else is a stand-in), as on a rerun whose callbacks are
+# swapped into the shared pipeline before the rest of the script has run
+import ast
+import json
+from datetime import timezone
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _assigned(stmt):
+    if isinstance(stmt, (ast.FunctionDef, ast.ClassDef)):
+        return {stmt.name}
+    if isinstance(stmt, (ast.Import, ast.ImportFrom)):
+        return {(a.asname or a.name).split(".")[0] for a in stmt.names}
+    return {n.id for n in ast.walk(stmt) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store)}
+
+
+def _script_until(name, marker):
+    path = ROOT / name
+    source = path.read_text(encoding="utf-8")
+    tree = ast.parse(source)
+    stop = next(i for i, stmt in enumerate(tree.body) if marker in ast.get_source_segment(source, stmt))
+    ns = {"__name__": "app"}
+    for stmt in tree.body[:stop]:
+        for n in _assigned(stmt):
+            ns.setdefault(n, MagicMock(name=n))
+    for stmt in tree.body[:stop]:
+        constant = isinstance(stmt, ast.Assign) and isinstance(stmt.value, ast.Constant)
+        if isinstance(stmt, (ast.Import, ast.ImportFrom, ast.FunctionDef)) or constant:
+            try:
+                exec(compile(ast.Module([stmt], []), str(path), "exec"), ns)
+            except ImportError:
+                pass  # streamlit / pytz: stand-ins
+    ns["vn_tz"] = timezone.utc
+    return ns
+
+
+def _msg(topic, payload):
+    return SimpleNamespace(topic=topic, payload=payload.encode("utf-8"))
+
+
+def test_tuoi_tieu_callbacks_need_no_later_globals():
+    ns = _script_until("web_tuoi_tieu.py", "ingest = get_service(")
+    assert "ingest" not in ns and "irrigation_engine" not in ns
+    ns["router"].route.return_value = None
+    ns["LEGACY_LOCATION"] = "north"
+    value = ns["decode_message"](_msg(ns["mqtt_topic_humidity"], "41.5"))
+    state, engine, calls = {}, MagicMock(), []
+    ns["sample_buffer"].put.side_effect = lambda sink, rec: calls.append("put")
+    engine.notify.side_effect = lambda location: calls.append(("notify", location))
+    ns["persist_message"](state, engine, value)
+    assert [r["sensor_hum"] for r in state["live_soil_moisture"]] == [41.5]
+    # the sample is buffered before the engine is woken up
+    assert calls[0] == "put" and calls[-1] == ("notify", "north")
+
+
+def test_phan_quyen_callbacks_need_no_later_globals():
+    ns = _script_until("web_phan_quyen.py", "pipeline = get_pipeline(")
+    ns["router"].route.return_value = None
+    data = {"soil_moisture": 40, "soil_temp": 28.5, "water_flow": 2.0}
+    ns["persist_message"](ns["decode_message"](_msg("esp32/sensor/data", json.dumps(data))))
+    assert ns["sample_buffer"].put.call_count >= 2
@@ -0,0 +1,70 @@
+from datetime import date, datetime, timedelta
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from chart_cache import ChartCache, DataVersions
+from timeseries_store import SegmentStore
+from ts_index import TimeIndex
+
+
+def _figure():
+    fig, ax = plt.subplots(figsize=(2, 1))
+    ax.plot([0, 1], [0, 1])
+    return fig
+
+
+def test_render_only_on_miss():
+    cache = ChartCache()
+    calls = []
+
+    def render():
+        calls.append(1)
+        return _figure()
+
+    png = cache.get_or_render(("history", "north", 1), render)
+    assert png.startswith(b"\x89PNG")
+    assert cache.get_or_render(("history", "north", 1), render) == png
+    assert len(calls) == 1
+    cache.get_or_render(("history", "north", 2), render)
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_lru_byte_cap():
+    cache = ChartCache(max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    cache.get("a")  # most recently used
+    cache.put("c", b"1234")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234" and cache.get("c") == b"1234"
+    assert cache.stats()["bytes"] == 8 and cache.stats()["evictions"] == 1
+    cache.put("big", b"x" * 11)  # larger than the cap: never cached
+    assert cache.get("big") is None and cache.get("a") == b"1234"
+
+
+def test_version_covers_only_the_range():
+    versions = DataVersions()
+    versions.bump("history", ["2025-01-01", "2025-01-02"])
+    before = versions.version("history", start="2025-01-02")
+    versions.bump("history", ["2025-01-01"])  # past day outside the range
+    assert versions.version("history", start="2025-01-02") == before
+    versions.bump("history", ["2025-01-02"])
+    assert versions.version("history", start="2025-01-02") != before
+    assert versions.version("history", end=date(2025, 1, 1)) == 2
+
+
+def test_index_version_per_location(tmp_path):
+    store = SegmentStore(tmp_path / "history")
+    index = TimeIndex(store)
+    now = datetime.now().replace(microsecond=0)
+    store.append({"timestamp": now.isoformat(), "location": "north", "sensor_hum": 40})
+    north = index.version("north")
+    store.append({"timestamp": now.isoformat(), "location": "south", "sensor_hum": 50})
+    assert index.version("north") == north  # another location does not invalidate the chart
+    store.append({"timestamp": (now + timedelta(seconds=1)).isoformat(), "location": "north", "sensor_hum": 41})
+    assert index.version("north") != north
+    assert index.version("north", start=date.today() + timedelta(days=1)) == ()
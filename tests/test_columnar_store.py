@@ -0,0 +1,65 @@
+import numpy as np
+
+from columnar_store import IMPORTED_MARKER, ColumnarStore
+from timeseries_store import SegmentStore
+
+
+def _rec(ts, hum, location="north"):
+    return {"timestamp": ts, "sensor_hum": hum, "location": location}
+
+
+def test_torn_append_is_cut_back_on_open(tmp_path):
+    store = ColumnarStore(tmp_path / "cols", "timestamp", ["sensor_hum"])
+    store.append_many([_rec("2024-05-01T06:00:00+07:00", 40), _rec("2024-05-01T06:01:00+07:00", 41)])
+    day_dir = tmp_path / "cols" / "2024-05-01"
+    # crash after the value / location columns of a third row, before its timestamp
+    with open(day_dir / "sensor_hum.f4", "ab") as f:
+        f.write(np.float32(99).tobytes())
+    with open(day_dir / "loc.u2", "ab") as f:
+        f.write(np.uint16(0).tobytes())
+    with open(day_dir / "ts.i8", "ab") as f:
+        f.write(b"\x01\x02\x03")  # torn timestamp
+    store = ColumnarStore(tmp_path / "cols", "timestamp", ["sensor_hum"])
+    store.append_many([_rec("2024-05-01T06:02:00+07:00", 42)])
+    cols = store.read_day("2024-05-01")
+    assert len(cols["ts"]) == 3
+    assert cols["sensor_hum"].tolist() == [40, 41, 42]
+    assert (day_dir / "sensor_hum.f4").stat().st_size == 3 * 4
+
+
+def test_backfill_fills_the_part_of_a_day_before_live_rows(tmp_path):
+    segments = SegmentStore(tmp_path / "history")
+    day = [_rec(f"2024-05-01T{h:02d}:00:00+07:00", h) for h in range(6, 12)]
+    segments.append_many(day + [_rec("2024-05-02T06:00:00+07:00", 50)])
+    store = ColumnarStore(tmp_path / "cols", "timestamp", ["sensor_hum"])
+    # backend enabled at 09:00 on 2024-05-01: live rows from then on
+    store.append_many(day[3:])
+    assert store.import_segments(segments, before_day="2024-05-03") == 3 + 1
+    frame = store.query("2024-05-01")
+    assert frame["sensor_hum"].tolist() == [6, 7, 8, 9, 10, 11]
+    assert (tmp_path / "cols" / "2024-05-01" / IMPORTED_MARKER).exists()
+    # done once
+    assert store.import_segments(segments, before_day="2024-05-03") == 0
+
+
+def test_expire_drops_old_days(tmp_path):
+    from datetime import date
+
+    store = ColumnarStore(tmp_path / "cols", "timestamp", ["sensor_hum"])
+    store.append_many([_rec(f"2024-05-0{d}T06:00:00+07:00", d) for d in (1, 2, 3)])
+    assert store.expire(1, today=date(2024, 5, 3)) == ["2024-05-01"]
+    assert store.days() == ["2024-05-02", "2024-05-03"]
+    assert store.query("2024-05-01")["sensor_hum"].tolist() == []
+
+
+def test_backfill_leaves_yesterday_to_the_buffer(tmp_path):
+    from datetime import date, timedelta
+
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    segments = SegmentStore(tmp_path / "history")
+    segments.append_many([_rec(f"{yesterday}T23:59:58+07:00", 1)])
+    store = ColumnarStore(tmp_path / "cols", "timestamp", ["sensor_hum"])
+    # the same sample reaches the columns from the write-behind buffer a moment later
+    assert store.import_segments(segments) == 0
+    store.append_many([_rec(f"{yesterday}T23:59:58+07:00", 1)])
+    assert store.query(yesterday)["sensor_hum"].tolist() == [1]
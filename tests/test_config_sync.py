@@ -0,0 +1,57 @@
+import json
+
+from config_sync import ConfigSync
+from mqtt_publisher import PublishHandle
+
+CONFIG = {"watering_slots": ["06:00-08:00"], "mode": "auto", "moisture_thresholds": {"rice": 60}, "retention": {}}
+
+
+class _Publisher:
+    # records retained publishes; messages are acked by the test
+    def __init__(self):
+        self.sent = []
+
+    def publish(self, topic, payload, qos=1, retain=False):
+        self.sent.append((topic, json.loads(payload), qos, retain))
+        return PublishHandle(topic, len(payload), qos)
+
+    def ack_all(self, result):
+        for h in result.handles:
+            h._ack()
+
+
+def test_publishes_changed_fields_and_bumps_version(tmp_path):
+    pub = _Publisher()
+    sync = ConfigSync(tmp_path / "config_state.json", pub, "esp32/config")
+    first = sync.publish(CONFIG)
+    assert first.version == 1 and sorted(first.changed) == ["mode", "moisture_thresholds", "watering_slots"]
+    assert all(retain and qos == 1 for _, _, qos, retain in pub.sent)
+    assert pub.sent[-1] == ("esp32/config/version", {"version": 1, "fields": sorted(first.changed)}, 1, True)
+    pub.ack_all(first)
+    assert first.acked
+
+    pub.sent.clear()
+    assert sync.publish(CONFIG).handles == []  # nothing changed: nothing sent, version unchanged
+    assert pub.sent == [] and sync.version == 1
+
+    second = sync.publish(dict(CONFIG, mode="manual"))
+    assert second.version == 2 and second.changed == {"mode": "manual"}
+    assert [t for t, *_ in pub.sent] == ["esp32/config/mode", "esp32/config/version"]
+    assert pub.sent[0][1] == {"version": 2, "field": "mode", "value": "manual"}
+
+
+def test_unacked_field_is_resent_and_state_survives_restart(tmp_path):
+    pub = _Publisher()
+    state = tmp_path / "config_state.json"
+    sync = ConfigSync(state, pub, "esp32/config")
+    result = sync.publish(CONFIG)
+    for h in result.handles:
+        if h.topic != "esp32/config/mode":
+            h._ack()
+        else:
+            h._fail("timeout")
+    assert result.failed
+
+    restarted = ConfigSync(state, _Publisher(), "esp32/config")
+    assert restarted.version == 1
+    assert restarted.delta(CONFIG) == {"mode": "auto"}
@@ -0,0 +1,25 @@
+import json
+from datetime import date
+
+from crop_catalog import CATALOG_FILE, CropCatalog
+
+
+def _catalog():
+    with open(CATALOG_FILE, "r", encoding="utf-8") as f:
+        return CropCatalog(json.load(f))
+
+
+def test_harvest_estimate_matches_the_old_script():
+    # the old estimate_harvest: lúa 100, rau 30, bắp / ngô 90, chuối 300, anything else 60
+    catalog = _catalog()
+    planted = date(2024, 1, 1)
+    for text, days in [("Lúa OM18", 100), ("rau cải ngọt", 30), ("bắp nếp", 90), ("chuối", 300),
+                       ("ớt", 60), ("sầu riêng", 60)]:
+        assert (catalog.estimate_harvest(text, planted) - planted).days == days, text
+
+
+def test_every_crop_has_a_stage_for_every_day():
+    catalog = _catalog()
+    for key in catalog.crops:
+        for days in (0, 15, 60, 400):
+            assert catalog.stage(key, days), (key, days)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from downsample import downsample_frame, lttb, minmax
+
+
+def _series(n=10000):
+    x = np.arange(n, dtype=np.float64)
+    y = 50 + 5 * np.sin(x / 300)
+    y[2345] = 95.0  # spike
+    y[7777] = 3.0   # dip that triggered irrigation
+    return x, y
+
+
+def test_lttb_keeps_ends_and_extremes():
+    x, y = _series()
+    idx = lttb(x, y, 500)
+    assert len(idx) == 500
+    assert idx[0] == 0 and idx[-1] == len(x) - 1
+    assert np.all(np.diff(idx) > 0)
+    assert 2345 in idx and 7777 in idx
+    assert np.array_equal(lttb(x[:100], y[:100], 500), np.arange(100))  # already small enough
+
+
+def test_minmax_keeps_every_bucket_extreme():
+    _, y = _series()
+    idx = minmax(y, 100)
+    kept = set(idx.tolist())
+    for lo, hi in zip(np.linspace(0, len(y), 101).astype(int)[:-1], np.linspace(0, len(y), 101).astype(int)[1:]):
+        bucket = y[lo:hi]
+        assert lo + int(np.argmin(bucket)) in kept and lo + int(np.argmax(bucket)) in kept
+    assert len(idx) <= 400
+
+
+def test_frame_keeps_union_of_columns_and_skips_nan():
+    _, y = _series()
+    hum = y[:5000].copy()
+    hum[::2] = np.nan  # every other sample missing, the spike at 2345 is kept
+    temp = np.full(len(hum), 30.0)
+    temp[1234] = 45.0  # spike only in the other column
+    df = pd.DataFrame({"timestamp": pd.date_range("2025-01-01", periods=len(hum), freq="min"),
+                       "sensor_hum": hum, "sensor_temp": temp})
+    out = downsample_frame(df, "timestamp", ["sensor_hum", "sensor_temp"], max_points=400)
+    assert len(out) < len(df)
+    assert out["timestamp"].is_monotonic_increasing
+    assert 1234 in out.index and 2345 in out.index
+    small = df.iloc[:100]
+    assert downsample_frame(small, "timestamp", ["sensor_hum"], max_points=400) is small
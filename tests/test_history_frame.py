@@ -0,0 +1,41 @@
+from datetime import date, datetime, timedelta
+
+from history_frame import HistoryFrame, get_history_frame
+from timeseries_store import SegmentStore
+
+
+def _rows(day, n, start=0):
+    base = datetime.combine(day, datetime.min.time())
+    return [{"timestamp": (base + timedelta(minutes=start + i)).isoformat(), "sensor_hum": start + i, "location": "north"}
+            for i in range(n)]
+
+
+def test_snapshot_is_stable_while_appending():
+    frame = HistoryFrame("timestamp", ["sensor_hum"], ["location"], chunk_rows=4)
+    frame.append_many(_rows(date(2025, 1, 1), 6))
+    snap = frame.snapshot()
+    frame.append_many(_rows(date(2025, 1, 1), 5, start=6))
+    frame.append({"timestamp": "not a time", "sensor_hum": 1})
+    assert len(snap) == 6 and len(frame) == 11 and frame.skipped == 1
+    cols = snap.columns()
+    assert cols["sensor_hum"].tolist() == [0, 1, 2, 3, 4, 5]  # spans a sealed and the open chunk
+    assert not cols["sensor_hum"].flags.writeable
+    assert frame.snapshot().tail(3)["sensor_hum"].tolist() == [8, 9, 10]
+    df = snap.to_frame(4, 6)
+    assert df["sensor_hum"].tolist() == [4, 5] and list(df["location"]) == ["north", "north"]
+
+
+def test_expire_drops_old_sealed_chunks():
+    frame = HistoryFrame("timestamp", ["sensor_hum"], chunk_rows=4)
+    frame.append_many(_rows(date(2025, 1, 1), 4) + _rows(date(2025, 3, 1), 6))
+    assert frame.expire(30, today=date(2025, 3, 2)) == 1
+    assert frame.snapshot().columns()["sensor_hum"].tolist() == [0, 1, 2, 3, 4, 5]
+
+
+def test_backfill_reads_only_the_retention_window(tmp_path):
+    store = SegmentStore(tmp_path / "history")
+    today = date.today()
+    store.append_many(_rows(today - timedelta(days=400), 3) + _rows(today - timedelta(days=2), 2))
+    frame = get_history_frame(f"test_backfill_{tmp_path.name}", "timestamp", ["sensor_hum"], ["location"],
+                              backfill_from=store, backfill_days=365)
+    assert len(frame) == 2  # the 400 day old segment is still on disk but outside the retention window
@@ -0,0 +1,59 @@
+import ingest_pipeline
+import ingest_service
+from ingest_pipeline import get_pipeline
+from ingest_service import IngestService, get_service
+
+
+def test_rerun_callbacks_replace_the_previous_ones(monkeypatch):
+    monkeypatch.setattr(IngestService, "start", lambda self: None)
+    first = get_pipeline("test_rerun", lambda m: ("old", m), lambda v: None)
+    service = get_service("test_rerun", "localhost", 1883, [], lambda *a: "old", pipeline=first)
+    try:
+        decode, handler = (lambda m: ("new", m)), (lambda *a: "new")
+        pipeline = get_pipeline("test_rerun", decode, lambda v: None)
+        again = get_service("test_rerun", "localhost", 1883, [], handler, pipeline=pipeline)
+        assert again is service and pipeline is first
+        assert pipeline.decode is decode and service.handler is handler
+        assert service.pipeline is pipeline
+    finally:
+        ingest_service._services.pop("test_rerun", None)
+        ingest_pipeline._pipelines.pop("test_rerun", None)
+        first.close()
+
+
+def test_restart_after_stop_gets_an_open_pipeline():
+    import socket
+    import time
+    from types import SimpleNamespace
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]  # nothing listens there: the client keeps retrying in the background
+    seen = []
+    pipeline = get_pipeline("test_restart", lambda m: m.payload, seen.append)
+    service = get_service("test_restart", "127.0.0.1", port, ["a"], None, pipeline=pipeline)
+    try:
+        service.stop()
+        assert pipeline.closed
+        service.start()
+        assert service.pipeline is not pipeline and not service.pipeline.closed
+        assert get_pipeline("test_restart", lambda m: m.payload, seen.append) is service.pipeline
+        service._on_message(None, None, SimpleNamespace(topic="a", payload=b"x"))
+        deadline = time.monotonic() + 5
+        while not seen and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert seen == [b"x"]
+    finally:
+        ingest_service._services.pop("test_restart", None)
+        ingest_pipeline._pipelines.pop("test_restart", None)
+        service.stop()
+
+
+def test_later_topics_replace_the_subscriptions(monkeypatch):
+    monkeypatch.setattr(IngestService, "start", lambda self: None)
+    service = get_service("test_topics", "localhost", 1883, ["a", "b"], None)
+    try:
+        assert get_service("test_topics", "localhost", 1883, ["b", "c"], None) is service
+        assert service.topics == ["b", "c"]
+    finally:
+        ingest_service._services.pop("test_topics", None)
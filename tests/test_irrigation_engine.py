@@ -0,0 +1,140 @@
+from datetime import datetime, time as dtime, timedelta, timezone
+
+from irrigation_engine import EngineView, IrrigationEngine, in_watering_window, window_start
+from irrigation_events import IrrigationEvents
+from latest_state import LatestStore
+
+CROPS = {"north": {"plots": [{"crop": "rice"}]}}
+ALWAYS = {"mode": "auto", "watering_schedule": "06:00-18:00"}
+
+
+def noon_tz():
+    # a zone where it is about noon right now, so the schedule above is open whenever the tests run
+    now = datetime.now(timezone.utc)
+    minutes = (12 * 60 - (now.hour * 60 + now.minute)) % (24 * 60)
+    return timezone(timedelta(minutes=minutes if minutes < 12 * 60 else minutes - 24 * 60))
+
+
+def make_engine(tmp_path, config=ALWAYS, crops=CROPS):
+    latest = LatestStore()
+    events = IrrigationEvents(tmp_path / "events")
+    engine = IrrigationEngine("test", latest, events, (lambda: 1, lambda: dict(config)),
+                              (lambda: 1, lambda: dict(crops)), {"rice": 60}, noon_tz())
+    return engine, latest, events
+
+
+def test_watering_window_wraps_midnight():
+    assert in_watering_window("22:00-02:00", dtime(23, 30))
+    assert in_watering_window("22:00-02:00", dtime(1, 0))
+    assert not in_watering_window("22:00-02:00", dtime(12, 0))
+    assert not in_watering_window("bad", dtime(12, 0))
+
+
+def test_dry_soil_opens_one_session(tmp_path):
+    engine, latest, events = make_engine(tmp_path)
+    latest.update("north", "", "probe", {"sensor_hum": 40})
+    engine.evaluate()
+    engine.evaluate()
+    assert engine.status("north")["decision"] == "irrigating"
+    assert len(events.sessions("north")) == 1
+    assert events.open_session("north") is not None
+
+
+def test_wet_soil_closes_session(tmp_path):
+    engine, latest, events = make_engine(tmp_path)
+    latest.update("north", "", "probe", {"sensor_hum": 40})
+    engine.evaluate()
+    latest.update("north", "", "probe", {"sensor_hum": 80})
+    engine.evaluate()
+    assert engine.status("north")["decision"] == "adequate"
+    assert events.open_session("north") is None
+    assert len(events.sessions("north")) == 1
+
+
+def test_flow_only_device_does_not_hide_moisture(tmp_path):
+    engine, latest, events = make_engine(tmp_path)
+    latest.update("north", "", "probe", {"sensor_hum": 40})
+    engine.evaluate()
+    # a flow meter of the same zone reports after the probe: the probe's moisture still decides
+    latest.update("north", "", "meter", {"flow": 3.5})
+    engine.evaluate()
+    latest.update("north", "", "probe", {"sensor_hum": 41})
+    engine.evaluate()
+    status = engine.status("north")
+    assert status["decision"] == "irrigating"
+    assert status["moisture"] == 41
+    assert len(events.sessions("north")) == 1
+
+
+def test_stale_moisture_is_no_data(tmp_path):
+    engine, latest, events = make_engine(tmp_path)
+    latest.stale_after = -1
+    latest.update("north", "", "probe", {"sensor_hum": 40})
+    engine.evaluate()
+    assert engine.status("north")["decision"] == "no_data"
+    assert events.open_session("north") is None
+
+
+def test_hold_and_manual_mode(tmp_path):
+    engine, latest, events = make_engine(tmp_path)
+    latest.update("north", "", "probe", {"sensor_hum": 40})
+    engine.evaluate()
+    engine.hold("north")
+    engine.evaluate()
+    assert engine.status("north")["decision"] == "held"
+    assert events.open_session("north") is None
+
+    engine, latest, _ = make_engine(tmp_path / "manual", config=dict(ALWAYS, mode="manual"))
+    latest.update("north", "", "probe", {"sensor_hum": 40})
+    engine.evaluate()
+    assert engine.status("north")["decision"] == "manual"
+
+
+def test_zone_without_crop(tmp_path):
+    engine, _, _ = make_engine(tmp_path, crops={"south": {"plots": []}})
+    engine.evaluate()
+    assert engine.status("south")["decision"] == "no_crop"
+
+
+def test_window_start_of_a_window_past_midnight():
+    tz = timezone.utc
+    assert window_start("22:00-02:00", datetime(2024, 5, 2, 1, 0, tzinfo=tz)) == datetime(2024, 5, 1, 22, 0, tzinfo=tz)
+    assert window_start("22:00-02:00", datetime(2024, 5, 2, 23, 0, tzinfo=tz)) == datetime(2024, 5, 2, 22, 0, tzinfo=tz)
+    assert window_start("22:00-02:00", datetime(2024, 5, 2, 12, 0, tzinfo=tz)) is None
+
+
+def test_manual_mode_closes_the_auto_session(tmp_path):
+    config = dict(ALWAYS)
+    engine, latest, events = make_engine(tmp_path)
+    engine.config = type(engine.config)(lambda: config["mode"], lambda: dict(config))
+    latest.update("north", "", "probe", {"sensor_hum": 40})
+    engine.evaluate()
+    assert events.open_session("north") is not None
+    config["mode"] = "manual"
+    engine.evaluate()
+    assert engine.status("north")["decision"] == "manual"
+    assert events.open_session("north") is None
+
+
+def test_ui_in_another_process_reads_status_and_holds(tmp_path):
+    latest = LatestStore()
+    events = IrrigationEvents(tmp_path / "events")
+    status_path, holds_path = tmp_path / "irrigation_status.json", tmp_path / "irrigation_holds.json"
+    engine = IrrigationEngine("test", latest, events, (lambda: 1, lambda: dict(ALWAYS)), (lambda: 1, lambda: dict(CROPS)),
+                              {"rice": 60}, noon_tz(), status_path=status_path, holds_path=holds_path)
+    view = EngineView(status_path, holds_path, noon_tz())
+    assert view.status("north") is None
+    latest.update("north", "", "probe", {"sensor_hum": 40})
+    engine.evaluate()
+    assert view.status("north")["decision"] == "irrigating"
+    assert view.hold("north") is not None
+    engine.evaluate()
+    assert view.status("north")["decision"] == "held"
+    assert events.open_session("north") is None
+    # a restarted engine keeps the operator's stop
+    engine.hold("north")
+    engine.save_status()
+    again = IrrigationEngine("test", latest, events, (lambda: 1, lambda: dict(ALWAYS)), (lambda: 1, lambda: dict(CROPS)),
+                             {"rice": 60}, noon_tz(), status_path=status_path)
+    again.evaluate()
+    assert again.status("north")["decision"] == "held"
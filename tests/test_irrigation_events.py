@@ -0,0 +1,99 @@
+import json
+
+from irrigation_events import IMPORT_MARKER, IrrigationEvents
+from timeseries_store import SegmentStore
+
+OLD_SESSIONS = [
+    {"location": "north", "crop": "rice", "start_time": "2024-05-01T06:00:00", "end_time": "2024-05-01T06:20:00"},
+    {"location": "south", "crop": "corn", "start_time": "2024-05-02T06:00:00", "end_time": None},
+]
+
+
+def _samples(tmp_path):
+    store = SegmentStore(tmp_path / "history")
+    store.append_many([
+        {"timestamp": "2024-05-01T05:00:00", "location": "north", "sensor_hum": 40},
+        {"timestamp": "2024-05-01T06:00:00", "location": "north", "action": "Bật bơm", "crop": "rice"},
+        {"timestamp": "2024-05-01T07:00:00", "location": "north", "sensor_hum": 70},
+    ])
+    return store
+
+
+def test_import_sessions_from_document_and_actions_from_samples(tmp_path):
+    samples = _samples(tmp_path)
+    events = IrrigationEvents(tmp_path / "events")
+    assert events.import_legacy(sample_store=samples, legacy_sessions=OLD_SESSIONS) == 4
+    assert [s["start_time"] for s in events.sessions("north")] == ["2024-05-01T06:00:00"]
+    assert events.open_session("south")["crop"] == "corn"
+    assert [a["action"] for a in events.actions("north")] == ["Bật bơm"]
+    # the actions left the sample stream
+    assert [r.get("action") for r in samples.read_all()] == [None, None]
+    # runs once
+    assert events.import_legacy(sample_store=samples, legacy_sessions=OLD_SESSIONS) == 0
+
+
+def test_interrupted_import_does_not_duplicate(tmp_path):
+    sessions_file = tmp_path / "history_irrigation.json"
+    sessions_file.write_text(json.dumps(OLD_SESSIONS), encoding="utf-8")
+    events = IrrigationEvents(tmp_path / "events")
+    events.import_legacy(sessions_file=sessions_file)
+    assert not sessions_file.exists()
+    # crash before the marker: the file is back and the marker is missing
+    (events.root / IMPORT_MARKER).unlink()
+    sessions_file.write_text(json.dumps(OLD_SESSIONS), encoding="utf-8")
+    assert IrrigationEvents(tmp_path / "events").import_legacy(sessions_file=sessions_file) == 0
+    reopened = IrrigationEvents(tmp_path / "events")
+    assert len(reopened.sessions("north")) == 1 and len(reopened.sessions("south")) == 1
+
+
+def _actions(tmp_path, n):
+    events = IrrigationEvents(tmp_path / "events")
+    for i in range(n):
+        events.add_action({"timestamp": f"2024-05-01T06:{i:02d}:00", "location": "north" if i % 2 else "south",
+                           "action": f"a{i}"})
+    return events
+
+
+def test_page_bounds(tmp_path):
+    events = _actions(tmp_path, 7)
+    rows, total = events.page("actions", offset=0, limit=3)
+    assert total == 7 and [r["action"] for r in rows] == ["a6", "a5", "a4"]
+    rows, total = events.page("actions", offset=6, limit=3)
+    assert total == 7 and [r["action"] for r in rows] == ["a0"]
+    # a page past the end (stored page index that outlived the data) is empty, the total still tells the caller
+    assert events.page("actions", offset=30, limit=3) == ([], 7)
+    assert events.page("actions", location="north", newest_first=False, offset=3, limit=3) == ([], 3)
+    assert events.page("actions", location="mars") == ([], 0)
+    assert events.page("sessions") == ([], 0)
+
+
+def test_page_filters_by_location_and_range(tmp_path):
+    events = _actions(tmp_path, 6)
+    rows, total = events.page("actions", location="north", newest_first=False)
+    assert total == 3 and [r["action"] for r in rows] == ["a1", "a3", "a5"]
+    rows, total = events.page("actions", start="2024-05-01T06:02", end="2024-05-01T06:04", newest_first=False)
+    assert total == 2 and [r["action"] for r in rows] == ["a2", "a3"]
+
+
+def test_resumed_import_after_live_events_keeps_time_order(tmp_path):
+    # the import was interrupted, the app then recorded live events, and the next start resumes the import:
+    # the old sessions land after the live ones in the segment but must still page in time order
+    sessions_file = tmp_path / "history_irrigation.json"
+    sessions_file.write_text(json.dumps([
+        {"location": "north", "crop": "rice", "start_time": "2024-05-01T06:00:00", "end_time": "2024-05-01T06:20:00"},
+        {"location": "north", "crop": "rice", "start_time": "2024-05-02T06:00:00", "end_time": "2024-05-02T06:20:00"},
+    ]), encoding="utf-8")
+    events = IrrigationEvents(tmp_path / "events")
+    events.start_session("north", "rice", ts="2024-05-02T08:00:00")
+    events.end_session("north", ts="2024-05-02T08:30:00")
+    events.add_action({"timestamp": "2024-05-02T08:00:00", "location": "north", "action": "Bật bơm"})
+    events.import_legacy(sessions_file=sessions_file, sample_store=_samples(tmp_path))
+    expected = ["2024-05-01T06:00:00", "2024-05-02T06:00:00", "2024-05-02T08:00:00"]
+    for ev in (events, IrrigationEvents(tmp_path / "events")):  # live views and views folded from disk
+        rows, total = ev.page("sessions", "north", newest_first=False)
+        assert [r["start_time"] for r in rows] == expected and total == 3
+        rows, _ = ev.page("sessions", "north", start="2024-05-02", limit=1)
+        assert rows[0]["start_time"] == "2024-05-02T08:00:00"
+        rows, _ = ev.page("actions", "north", newest_first=False)
+        assert [r["timestamp"] for r in rows] == ["2024-05-01T06:00:00", "2024-05-02T08:00:00"]
+        assert ev.open_session("north") is None
@@ -0,0 +1,42 @@
+import time
+
+from latest_state import LatestStore, read_snapshot
+
+
+def test_field_merge_and_per_field_index():
+    store = LatestStore()
+    store.update("north", "A", "probe", {"sensor_hum": 41.0, "flow": None}, ts="2025-01-01T06:00:00", pump_status="OFF")
+    store.update("north", "A", "meter", {"flow": 2.5}, ts="2025-01-01T06:00:05")
+    store.update("north", "A", "probe", {"sensor_temp": 28.0}, ts="2025-01-01T06:00:10")
+    probe = store.get("north", "A", "probe")
+    assert probe["reading"] == {"sensor_hum": 41.0, "sensor_temp": 28.0}
+    assert probe["pump_status"] == "OFF" and probe["timestamp"] == "2025-01-01T06:00:10"
+    assert store.location("north")["device"] == "probe"
+    # the meter reported flow after the probe; a newer probe message does not hide it
+    assert store.field("north", "flow")["value"] == 2.5 and store.field("north", "flow")["device"] == "meter"
+    assert store.field("south", "flow") is None
+    assert {d["device"] for d in store.devices("north")} == {"probe", "meter"}
+
+
+def test_stale_after():
+    store = LatestStore(stale_after=0.05)
+    store.update("north", "", "", {"sensor_hum": 40})
+    assert not store.get("north")["stale"]
+    time.sleep(0.1)
+    assert store.get("north")["stale"] and store.field("north", "sensor_hum")["stale"]
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = tmp_path / "latest_state.json"
+    store = LatestStore(path, flush_interval=3600)
+    store.update("north", "A", "probe", {"sensor_hum": 41.0}, ts="2025-01-01T06:00:00")
+    store.update("north", "A", "meter", {"flow": 2.5}, ts="2025-01-01T06:00:05")
+    store.close()
+    view = LatestStore.from_snapshot(path)
+    assert view.field("north", "flow")["value"] == 2.5
+    assert view.location("north")["device"] == "meter"
+    view.flush()  # read-only view: nothing written back
+    assert [d["device"] for d in read_snapshot(path)["devices"]] == ["probe", "meter"]
+    restarted = LatestStore(path, flush_interval=3600)
+    assert restarted.get("north", "A", "probe")["reading"] == {"sensor_hum": 41.0}
+    restarted.close()
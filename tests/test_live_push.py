@@ -0,0 +1,77 @@
+import json
+import re
+import socket
+import urllib.error
+import urllib.request
+
+import pytest
+
+from live_push import LiveHub, get_live_hub, live_panel_html, live_payload
+
+
+def test_live_payload_whitelist():
+    data = {"soil_moisture": 41, "light": "</script><script>alert(1)</script>", "water_flow": True,
+            "pump_status": "on", "extra": "x"}
+    out = live_payload(data, ("soil_moisture", "light", "water_flow"), "2024-01-01T00:00:00")
+    assert out == {"timestamp": "2024-01-01T00:00:00", "soil_moisture": 41, "pump_status": "ON"}
+    assert "pump_status" not in live_payload({"pump_status": "</script>"}, (), "t")
+
+
+def test_panel_escapes_embedded_json():
+    hub = LiveHub("test")
+    hub.port = 1
+    evil = "</script><script>alert(1)</script>&"
+    hub.publish("north", {"timestamp": evil, "pump_status": evil})
+    html = live_panel_html(hub, ["north", evil], [("sensor_hum", "Moisture", "%")], pump_label="Pump")
+    script = html.split("<script>", 1)[1].rsplit("</script>", 1)[0]
+    assert "</script" not in script and "<script" not in script and evil not in script
+    # the escaped JSON still decodes to the original values
+    channels = re.search(r"var channels = (.*);", script).group(1)
+    assert json.loads(channels) == ["north", evil]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_stream_requires_the_token():
+    hub = get_live_hub("test-token", _free_port(), host="127.0.0.1")
+    assert hub.error is None
+    base = f"http://127.0.0.1:{hub.port}/events?channel=north"
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(base + "&token=wrong", timeout=5)
+    assert e.value.code == 403
+    hub.publish("north", {"sensor_hum": 40})
+    with urllib.request.urlopen(base + "&token=" + hub.token, timeout=5) as resp:
+        assert resp.readline().startswith(b"id: ")
+        assert resp.readline() == b"event: north\n"
+        assert json.loads(resp.readline()[len(b"data: "):]) == {"sensor_hum": 40}
+    assert hub.token in live_panel_html(hub, ["north"], [])
+
+
+def test_busy_port_is_reported():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        s.listen()
+        hub = get_live_hub("test-busy", s.getsockname()[1], host="127.0.0.1")
+        assert hub.server is None and "cannot listen" in hub.error
+
+
+def test_blank_channel_is_streamed():
+    # devices without a location publish on "", the panels subscribe with "channel="
+    hub = get_live_hub("test-blank", _free_port(), host="127.0.0.1")
+    hub.publish("", {"sensor_hum": 12})
+    url = f"http://127.0.0.1:{hub.port}/events?channel=Hanoi&channel=&token={hub.token}"
+    with urllib.request.urlopen(url, timeout=5) as resp:
+        assert resp.readline().startswith(b"id: ")
+        assert resp.readline() == b"event: _\n"
+        assert json.loads(resp.readline()[len(b"data: "):]) == {"sensor_hum": 12}
+
+
+def test_non_ascii_token_is_rejected():
+    hub = get_live_hub("test-token-utf8", _free_port(), host="127.0.0.1")
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(f"http://127.0.0.1:{hub.port}/events?token=%C3%A9", timeout=5)
+    assert e.value.code == 403
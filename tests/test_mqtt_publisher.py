@@ -0,0 +1,61 @@
+import paho.mqtt.client as mqtt
+
+from mqtt_publisher import MqttPublisher
+
+
+class _Info:
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+
+class _Client:
+    # stands in for the paho client: records publishes, answers with a fixed rc; ack_first simulates a PUBACK
+    # handled by the network thread before publish() returns
+    def __init__(self, publisher, rc=mqtt.MQTT_ERR_SUCCESS, ack_first=False):
+        self.publisher = publisher
+        self.rc = rc
+        self.ack_first = ack_first
+        self.sent = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.sent.append((topic, payload, qos, retain))
+        mid = len(self.sent)
+        if self.ack_first:
+            self.publisher._on_publish(self, None, mid)
+        return _Info(self.rc, mid)
+
+
+def _publisher(**client_args):
+    pub = MqttPublisher("test", "127.0.0.1", 1)  # nothing listens there: the real client never connects
+    pub.stop()
+    pub._client = _Client(pub, **client_args)
+    return pub
+
+
+def test_ack_marks_handle_and_runs_callbacks():
+    pub = _publisher()
+    done = []
+    handle = pub.publish("esp32/config/mode", "auto", retain=True)
+    handle.add_done_callback(lambda h: done.append(h.status))
+    assert handle.status == "queued" and pub.pending() == 1
+    pub._on_publish(None, None, handle.mid)
+    assert handle.wait(0) and done == ["acked"]
+    assert pub.pending() == 0 and pub.acked == 1
+    assert pub._client.sent == [("esp32/config/mode", b"auto", 1, True)]
+
+
+def test_ack_before_publish_returns():
+    pub = _publisher(ack_first=True)
+    handle = pub.publish("esp32/config/mode", "auto")
+    assert handle.acked and pub.pending() == 0
+
+
+def test_offline_qos1_stays_queued_qos0_fails():
+    pub = _publisher(rc=mqtt.MQTT_ERR_NO_CONN)
+    queued = pub.publish("esp32/config/mode", "auto", qos=1)
+    assert queued.status == "queued" and pub.pending() == 1  # sent by paho after the reconnect
+    lost = pub.publish("esp32/config/mode", "auto", qos=0)
+    assert lost.failed and lost.wait(0) is False
+    pub._on_publish(None, None, queued.mid)
+    assert queued.acked
@@ -0,0 +1,35 @@
+from datetime import date
+
+import pandas as pd
+
+from planting_table import build_planting_table, compile_stages, get_planting_table, stage_of
+
+CROPS = {"rice": (90, 120), "corn": (70, 90)}
+STAGES = compile_stages({
+    "rice": [(20, "seedling"), (60, "growing"), (None, "ripening")],
+    "corn": [(30, "young"), (None, "mature")],
+})
+NAMES = {"rice": "Rice", "corn": "Corn"}
+TODAY = date(2025, 6, 1)
+
+
+def test_batch_matches_single_lookup():
+    plantings = [("rice", "2025-05-22"), ("rice", "2025-05-12"), ("rice", "2025-01-01"),
+                 ("corn", "2025-05-02"), ("corn", "not a date"), ("bean", "2025-05-01")]
+    df = build_planting_table(plantings, CROPS, STAGES, NAMES, today=TODAY)
+    assert df["days_planted"].tolist() == [10, 20, 151, 30, 0, 31]
+    assert df["stage"].tolist()[:5] == ["seedling", "seedling", "ripening", "young", "young"]
+    assert pd.isna(df.loc[5, "stage"])  # crop without stages
+    for (crop, _), days, stage in list(zip(plantings, df["days_planted"], df["stage"]))[:5]:
+        assert stage_of(STAGES, crop, days) == stage
+    assert df["crop"].tolist()[:1] == ["Rice"] and df["crop"].tolist()[-1] == "bean"
+    assert df.loc[0, "expected_harvest_from"] == "20/08/2025" and df.loc[0, "expected_harvest_to"] == "19/09/2025"
+    assert df.loc[4, "planting_date"] == "01/06/2025"  # unparseable date counts as planted today
+
+
+def test_cached_per_key_and_day():
+    key = ("crop_data.json", 1, "north", "A", "en")
+    first = get_planting_table(key, [("rice", "2025-05-22")], CROPS, STAGES, NAMES, today=TODAY)
+    assert get_planting_table(key, [], CROPS, STAGES, NAMES, today=TODAY) is first
+    later = get_planting_table(key, [("rice", "2025-05-22")], CROPS, STAGES, NAMES, today=date(2025, 6, 2))
+    assert later["days_planted"].tolist() == [11]
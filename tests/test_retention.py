@@ -0,0 +1,45 @@
+import gzip
+import json
+from datetime import date, timedelta
+
+from retention import RetentionJob, merge_policy
+from timeseries_store import SegmentStore
+
+
+def test_merge_policy_overrides():
+    policy = merge_policy({"flow": {"days": 90}, "history": 30, "custom": {"archive": True}})
+    assert policy["flow"] == {"days": 90, "archive": False}
+    assert policy["history"]["days"] == 30
+    assert policy["irrigation"] == {"days": 730, "archive": True}
+    assert policy["custom"] == {"days": 365, "archive": True}
+
+
+class _Broken:
+    def expire(self, days, archive_dir=None):
+        raise OSError("disk gone")
+
+
+def test_run_once_expires_and_archives_old_days(tmp_path):
+    job = RetentionJob(interval=3600)
+    try:
+        old = (date.today() - timedelta(days=40)).isoformat()
+        recent = date.today().isoformat()
+        history = SegmentStore(tmp_path / "history")
+        flow = SegmentStore(tmp_path / "flow", time_key="time")
+        for store, key in ((history, "timestamp"), (flow, "time")):
+            store.append_many([{key: f"{old}T06:00:00", "v": 1}, {key: f"{recent}T06:00:00", "v": 2}])
+        job.add_store("history", history, 30)
+        job.add_store("flow", flow, 30, archive=True)
+        job.add_store("broken", _Broken(), 30)
+        job.add_store("history", history, 30)  # rerun: same name replaces the job
+
+        result = job.run_once()
+        assert result["history"] == [old] and result["flow"] == [old]
+        assert result["broken"].startswith("error:")  # one failing store does not stop the others
+        assert history.days() == [recent] and flow.days() == [recent]
+        with gzip.open(tmp_path / "flow" / "archive" / f"{old}.jsonl.gz", "rt", encoding="utf-8") as f:
+            assert json.loads(f.readline())["v"] == 1
+        assert job.run_once()["history"] == []
+        assert job.runs == 2
+    finally:
+        job.stop()
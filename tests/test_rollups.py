@@ -0,0 +1,88 @@
+import sys
+import threading
+from datetime import date, datetime, timedelta
+
+from rollups import RollupIndex
+from timeseries_store import SegmentStore
+
+
+def _records(day, n, location="north"):
+    start = datetime.combine(day, datetime.min.time())
+    return [{"timestamp": (start + timedelta(minutes=i)).isoformat(), "location": location, "sensor_hum": float(i % 100)}
+            for i in range(n)]
+
+
+def test_minute_hour_day_buckets(tmp_path):
+    store = SegmentStore(tmp_path / "history")
+    rollups = RollupIndex(store, ["sensor_hum"])
+    day = date.today()
+    store.append_many(_records(day, 120))
+    minute = rollups.query(day, resolution="minute")
+    assert len(minute) == 120
+    hour = rollups.query(day, resolution="hour")
+    assert [r["sensor_hum_count"] for r in hour] == [60, 60]
+    assert hour[0]["sensor_hum_min"] == 0 and hour[0]["sensor_hum_max"] == 59
+    (row,) = rollups.query(day, resolution="day")
+    assert row["sensor_hum_count"] == 120
+    assert rollups.query(day, location="south", resolution="day") == []
+
+
+def test_query_while_appending(tmp_path):
+    # appends fold into the same per-day dicts from another thread; queries must never see them change size
+    store = SegmentStore(tmp_path / "history")
+    rollups = RollupIndex(store, ["sensor_hum"])
+    day = date.today()
+    records = [dict(r, location=f"loc{i % 7}") for i, r in enumerate(_records(day, 1440))]
+    errors = []
+
+    def writer():
+        try:
+            for i in range(0, len(records), 8):
+                store.append_many(records[i:i + 8])
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+
+    switch = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # interleave the two threads as much as possible
+    try:
+        thread = threading.Thread(target=writer)
+        thread.start()
+        while thread.is_alive():
+            try:
+                rollups.query(day, resolution="minute")
+                rollups.query(day, resolution="hour")
+            except Exception as e:
+                errors.append(e)
+                break
+        thread.join()
+    finally:
+        sys.setswitchinterval(switch)
+    assert errors == []
+    assert sum(r["sensor_hum_count"] for r in rollups.query(day, resolution="hour")) == 1440
+
+
+def test_expire_removes_sidecars(tmp_path):
+    from ts_index import TimeIndex
+
+    store = SegmentStore(tmp_path / "history")
+    rollups = RollupIndex(store, ["sensor_hum"])
+    index = TimeIndex(store)
+    old, today = date.today() - timedelta(days=400), date.today()
+    store.append_many(_records(old, 3) + _records(today, 3))
+    assert len(index.query("north", old, old)) == 3
+    assert (tmp_path / "history" / "_rollup" / f"{old}.json").exists()
+    assert (tmp_path / "history" / "_index" / f"{old}.idx").exists()
+    assert store.expire(365) == [old.isoformat()]
+    assert sorted(p.name for p in (tmp_path / "history" / "_rollup").iterdir()) == []
+    assert [p.name for p in (tmp_path / "history" / "_index").iterdir()] == [f"{today}.idx"]
+    assert rollups.query(old, resolution="day") == [] and index.query("north", old, old) == []
+    assert len(rollups.query(today, resolution="minute")) == 3
+
+
+def test_orphan_sidecars_removed_on_open(tmp_path):
+    store = SegmentStore(tmp_path / "history")
+    (tmp_path / "history" / "_rollup").mkdir()
+    (tmp_path / "history" / "_rollup" / "2020-01-01.json").write_text("{}")
+    (tmp_path / "history" / "_rollup" / "2020-01-01.hour.json").write_text("{}")
+    RollupIndex(store, ["sensor_hum"])
+    assert list((tmp_path / "history" / "_rollup").iterdir()) == []
@@ -0,0 +1,57 @@
+import threading
+from datetime import date
+
+from sqlite_store import SqliteBackend
+
+
+def test_readings_by_location_and_retention(tmp_path):
+    db = SqliteBackend(tmp_path / "irrigation.db")
+    sink = db.sink("history", "timestamp")
+    sink.append_many([
+        {"timestamp": "2024-01-01T06:00:00+07:00", "location": "north", "sensor_hum": 40},
+        {"timestamp": "2024-03-01T06:00:00+07:00", "location": "north", "sensor_hum": 50},
+        {"timestamp": "2024-03-01T07:00:00+07:00", "location": "south", "sensor_hum": 60},
+    ])
+    assert [r["sensor_hum"] for r in db.readings("history", location="north")] == [40, 50]
+    assert [r["sensor_hum"] for r in db.readings("history", start="2024-02-01")] == [50, 60]
+    # the retention job calls expire() on the sink like on a segment store
+    assert sink.expire(30, today=date(2024, 3, 15)) == 1
+    assert [r["sensor_hum"] for r in db.readings("history")] == [50, 60]
+    assert db.readings("flow") == []
+
+
+def test_plantings_follow_crop_data(tmp_path):
+    db = SqliteBackend(tmp_path / "irrigation.db")
+    db.save_doc("crop_data.json", {
+        "north": {"areas": {"A": [{"crop": "rice", "planting_date": "2024-01-01"}, {"crop": "corn"}]}},
+        "south": {"plots": [{"crop": "bean", "planting_date": "2024-02-01"}]},
+    })
+    assert [p["crop"] for p in db.plantings("north", "A")] == ["rice", "corn"]
+    assert db.plantings("south", "") == [{"location": "south", "area": "", "crop": "bean", "planting_date": "2024-02-01"}]
+    db.save_doc("crop_data.json", {"south": {"plots": []}})
+    assert db.plantings("north") == [] and db.plantings("south") == []
+    assert db.load_doc("crop_data.json") == {"south": {"plots": []}}
+
+
+def test_threads_share_one_connection(tmp_path):
+    # the flusher and the script threads all go through the backend lock instead of one connection each
+    db = SqliteBackend(tmp_path / "irrigation.db")
+    sink = db.sink("flow", "time")
+    errors = []
+
+    def work(n):
+        try:
+            for i in range(20):
+                sink.append({"time": f"2024-03-01T06:{i:02d}:00", "location": f"loc{n}", "flow": i})
+                db.readings("flow", location=f"loc{n}", start="2024-03-01")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(db.readings("flow")) == 160
+    assert len(db.readings("flow", location="loc3", start="2024-03-01T06:10:00")) == 10
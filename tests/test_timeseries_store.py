@@ -0,0 +1,41 @@
+import json
+
+from timeseries_store import LEGACY_MARKER, SegmentStore
+
+
+def _records():
+    return [{"timestamp": f"2024-05-0{d}T06:0{m}:00+07:00", "sensor_hum": 40 + m} for d in (1, 2) for m in range(3)]
+
+
+def _write(path, data):
+    path.write_text(json.dumps(data), encoding="utf-8")
+
+
+def test_legacy_import_keeps_other_records_in_the_old_file(tmp_path):
+    legacy = tmp_path / "history_irrigation.json"
+    session = {"location": "north", "start_time": "2024-05-01 06:00:00"}
+    _write(legacy, _records() + [session])
+    store = SegmentStore(tmp_path / "history", legacy_file=legacy)
+    assert store.read() == _records()
+    assert json.loads(legacy.read_text(encoding="utf-8")) == [session]
+    assert (tmp_path / "history_irrigation.json.migrated").exists()
+    # the leftovers file is not imported again
+    assert SegmentStore(tmp_path / "history", legacy_file=legacy).read() == _records()
+
+
+def test_interrupted_legacy_import_resumes_without_duplicates(tmp_path):
+    legacy = tmp_path / "history_irrigation.json"
+    _write(tmp_path / "history_irrigation.json.migrated", _records())
+    # the previous attempt appended the first day, then stopped before the marker
+    SegmentStore(tmp_path / "history").append_many(_records()[:3])
+    store = SegmentStore(tmp_path / "history", legacy_file=legacy)
+    assert store.read() == _records()
+    assert (tmp_path / "history" / LEGACY_MARKER).exists()
+
+
+def test_interrupted_import_after_all_appends_adds_nothing(tmp_path):
+    legacy = tmp_path / "flow_data.json"
+    _write(tmp_path / "flow_data.json.migrated", _records() + _records()[:1])  # a repeated reading stays repeated
+    SegmentStore(tmp_path / "flow").append_many(_records())
+    store = SegmentStore(tmp_path / "flow", legacy_file=legacy)
+    assert store.read() == _records()[:3] + _records()[:1] + _records()[3:]
@@ -0,0 +1,34 @@
+from topic_routing import TopicRouter, device_topic
+
+
+def test_route_is_cached_and_bounded():
+    router = TopicRouter(max_routes=3)
+    first = router.route(device_topic("north", "a", "d0"))
+    assert router.route(device_topic("north", "a", "d0")) is first
+    for i in range(1, 5):
+        router.route(device_topic("north", "a", f"d{i}"))
+    assert len(router._routes) == 3 and len(router.device_keys()) == 3
+    assert ("north", "a", "d0") not in router.devices
+
+
+def test_non_matching_topics_are_not_cached():
+    router = TopicRouter()
+    for i in range(100):
+        assert router.route(f"garbage/{i}") is None
+    assert router.route("farm/north/a/d") is None  # one level short
+    assert router.route("farm/north/a/d/sensor") is not None
+    assert list(router._routes) == ["farm/north/a/d/sensor"]
+
+
+def test_unknown_locations_are_rejected():
+    router = TopicRouter()
+    router.set_locations(["TP. Hồ Chí Minh", "north"])
+    route = router.route(device_topic("TP. Hồ Chí Minh", "a", "d"))
+    assert route.location == "TP. Hồ Chí Minh"
+    assert router.route(device_topic("mars", "a", "d")) is None
+    assert router.rejected == 1 and router.device_keys("mars") == []
+    # a zone removed from the config loses its routes
+    router.route(device_topic("north", "a", "d"))
+    router.set_locations(["TP. Hồ Chí Minh"])
+    assert router.device_keys("north") == []
+    assert router.route(device_topic("north", "a", "d")) is None
@@ -0,0 +1,50 @@
+from datetime import date
+
+from timeseries_store import SegmentStore
+from ts_index import TimeIndex
+
+
+def _sample(minute, location="north"):
+    return {"timestamp": f"2025-01-01T06:{minute:02d}:00", "location": location, "sensor_hum": minute}
+
+
+def test_query_by_location_and_range(tmp_path):
+    store = SegmentStore(tmp_path / "history")
+    index = TimeIndex(store)
+    store.append_many([_sample(m, "north" if m % 2 else "south") for m in range(10)])
+    store.append(_sample(4, "north"))  # late sample
+    assert [r["sensor_hum"] for r in index.query("north")] == [1, 3, 4, 5, 7, 9]
+    got = index.query("north", start="2025-01-01T06:03:00", end="2025-01-01T06:05:00")
+    assert [r["sensor_hum"] for r in got] == [3, 4, 5]
+    assert index.query("north", start=date(2025, 1, 2)) == []
+    assert index.latest("south")["sensor_hum"] == 8
+    assert index.locations() == ["north", "south"]
+
+
+def test_torn_sidecar_is_cut_and_reindexed(tmp_path):
+    store = SegmentStore(tmp_path / "history")
+    TimeIndex(store)
+    store.append_many([_sample(m) for m in range(3)])
+    sidecar = tmp_path / "history" / "_index" / "2025-01-01.idx"
+    data = sidecar.read_bytes()
+    sidecar.write_bytes(data[:-3])  # crash while appending the last line
+
+    # restart: a new store / index over the same directory
+    store = SegmentStore(tmp_path / "history")
+    index = TimeIndex(store)
+    assert [r["sensor_hum"] for r in index.query("north")] == [0, 1, 2]
+    store.append(_sample(5))
+    assert sidecar.read_bytes().count(b"\n") == 4
+    assert all(len(line.split(b"\t")) == 4 for line in sidecar.read_bytes().splitlines())
+
+    store = SegmentStore(tmp_path / "history")
+    assert [r["sensor_hum"] for r in TimeIndex(store).query("north")] == [0, 1, 2, 5]
+
+
+def test_expired_days_drop_their_sidecar(tmp_path):
+    store = SegmentStore(tmp_path / "history")
+    index = TimeIndex(store)
+    store.append_many([_sample(1), {"timestamp": "2025-03-01T06:00:00", "location": "north", "sensor_hum": 9}])
+    store.expire(30, today=date(2025, 3, 1))
+    assert not (tmp_path / "history" / "_index" / "2025-01-01.idx").exists()
+    assert [r["sensor_hum"] for r in index.query("north")] == [9]
@@ -0,0 +1,105 @@
+# WeatherClient against a local stand-in for Open-Meteo (http.server on 127.0.0.1)
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from weather_client import WeatherClient
+
+
+class StubServer:
+    def __init__(self):
+        self.requests = []
+        self.delay = 0.0
+        self.version = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                stub.requests.append(query)
+                time.sleep(stub.delay)
+                lats, lons = query["latitude"][0].split(","), query["longitude"][0].split(",")
+                items = [{"latitude": float(a), "longitude": float(b), "version": stub.version} for a, b in zip(lats, lons)]
+                body = json.dumps(items if len(items) > 1 else items[0]).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1/forecast"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+def _wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return cond()
+
+
+def test_fresh_entry_is_served_from_cache_until_ttl(stub):
+    client = WeatherClient(base_url=stub.url, ttl=0.3)
+    assert client.get(10.0, 106.0, {"current": "temperature_2m"})["version"] == 0
+    assert client.get(10.0, 106.0, {"current": "temperature_2m"})["version"] == 0
+    assert len(stub.requests) == 1 and client.hits == 1
+    time.sleep(0.35)
+    client.get(10.0, 106.0, {"current": "temperature_2m"})
+    assert _wait_for(lambda: len(stub.requests) == 2)
+
+
+def test_concurrent_cold_gets_share_one_request(stub):
+    stub.delay = 0.3
+    client = WeatherClient(base_url=stub.url)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.get(10.0, 106.0))) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(stub.requests) == 1
+    assert len(results) == 10 and all(r["version"] == 0 for r in results)
+
+
+def test_stale_value_is_returned_while_the_refresh_runs(stub):
+    client = WeatherClient(base_url=stub.url, ttl=0.1)
+    assert client.get(10.0, 106.0)["version"] == 0
+    time.sleep(0.15)
+    stub.delay, stub.version = 0.5, 1
+    t0 = time.monotonic()
+    assert client.get(10.0, 106.0)["version"] == 0  # stale, without waiting for the server
+    assert time.monotonic() - t0 < 0.3 and client.stale_hits == 1
+    assert _wait_for(lambda: client.get(10.0, 106.0)["version"] == 1)
+    assert len(stub.requests) == 2
+
+
+def test_prefetch_batch_serves_the_first_get(stub):
+    stub.delay = 0.2
+    client = WeatherClient(base_url=stub.url)
+    coords = [(10.0, 106.0), (21.0, 105.8), (16.05, 108.2)]
+    client.prefetch(coords, {"current": "temperature_2m"})
+    # cold start: the page asks right away, the batch already in flight answers it
+    data = client.get(21.0, 105.8, {"current": "temperature_2m"})
+    assert data["latitude"] == 21.0
+    assert len(stub.requests) == 1
+    assert stub.requests[0]["latitude"] == ["10.0000,16.0500,21.0000"]
+    assert all(client.get(lat, lon, {"current": "temperature_2m"}) for lat, lon in coords)
+    time.sleep(0.3)
+    assert len(stub.requests) == 1 and client.prefetch_runs == 1
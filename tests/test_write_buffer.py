@@ -0,0 +1,48 @@
+from write_buffer import WriteBehindBuffer
+
+
+class FlakyStore:
+    def __init__(self, failures):
+        self.failures = failures
+        self.records = []
+
+    def append_many(self, records):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        self.records.extend(records)
+        return len(records)
+
+
+def make_buffer(**kw):
+    # batch / interval large enough that only explicit flush() calls write
+    return WriteBehindBuffer("test", batch_size=10 ** 6, flush_interval=3600, **kw)
+
+
+def test_failed_flush_keeps_records_for_the_next_one():
+    buf = make_buffer()
+    store, ok = FlakyStore(failures=1), FlakyStore(failures=0)
+    for i in range(3):
+        buf.put(store, {"i": i})
+        buf.put(ok, {"i": i})
+    assert buf.flush() == 3
+    assert buf.stats()["flush_errors"] == 1 and buf.depth() == 3
+    buf.put(store, {"i": 3})
+    assert buf.flush() == 4
+    assert [r["i"] for r in store.records] == [0, 1, 2, 3]
+    assert buf.depth() == 0
+    buf.close()
+
+
+def test_requeue_stays_bounded():
+    buf = make_buffer(max_items=4)
+    store = FlakyStore(failures=1)
+    for i in range(3):
+        buf.put(store, {"i": i})
+    buf.flush()
+    for i in range(3, 6):
+        buf.put(store, {"i": i})
+    assert buf.depth() == 4 and buf.stats()["dropped"] == 2
+    buf.flush()
+    assert [r["i"] for r in store.records] == [2, 3, 4, 5]
+    buf.close()
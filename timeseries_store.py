@@ -0,0 +1,275 @@
+# timeseries_store.py
+# Append-only segmented time-series store for sensor / flow history
+# - Each stream (history, flow, ...) is a directory with one JSON-lines segment per day: <root>/YYYY-MM-DD.jsonl
+# - append() only writes new lines to the segment of that day -> O(1), never re-reads the whole history
+# - read() returns the same list of dicts the old JSON array files contained
+# - Old JSON array files (history_irrigation.json, flow_data.json) are imported once on first open; the import
+#   resumes without duplicates if the process stops half way
+# - Retention works on whole segments (see retention.py), records are never re-parsed to expire them
+
+import gzip
+import json
+import os
+import shutil
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+SEGMENT_SUFFIX = ".jsonl"
+LEGACY_MARKER = ".legacy_imported"
+
+
+def _day_key(value):
+    # ISO-8601 string "2025-01-31T06:00:00+07:00" -> "2025-01-31" (no full datetime parse on the hot path)
+    if isinstance(value, str) and len(value) >= 10 and value[4] == "-" and value[7] == "-":
+        return value[:10]
+    return None
+
+
+def _as_day(value):
+    if value is None:
+        return None
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()[:10]
+    return str(value)[:10]
+
+
+class SegmentStore:
+    def __init__(self, root, time_key="timestamp", legacy_file=None):
+        self.root = Path(root)
+        self.time_key = time_key
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # callbacks fn(days) run after each successful append (rollups, indexes, ...)
+        self._listeners = []
+        # callbacks fn(days) run after expire() removed day segments (their sidecars go too)
+        self._expire_listeners = []
+        if legacy_file is not None:
+            self._import_legacy(Path(legacy_file))
+
+    # -----------------------
+    # Segments
+    # -----------------------
+    def segment_path(self, day):
+        return self.root / f"{day}{SEGMENT_SUFFIX}"
+
+    def days(self):
+        out = []
+        for name in os.listdir(self.root):
+            if name.endswith(SEGMENT_SUFFIX) and _day_key(name):
+                out.append(name[:-len(SEGMENT_SUFFIX)])
+        out.sort()
+        return out
+
+    # -----------------------
+    # Write path
+    # -----------------------
+    def append(self, record):
+        return self.append_many([record])
+
+    def append_many(self, records):
+        groups = {}
+        for rec in records:
+            day = _day_key(rec.get(self.time_key))
+            if day is None:
+                print(f"SegmentStore {self.root.name}: record without '{self.time_key}' skipped:", rec)
+                continue
+            groups.setdefault(day, []).append(json.dumps(rec, ensure_ascii=False, separators=(",", ":")))
+        if not groups:
+            return 0
+        written = 0
+        with self._lock:
+            for day, lines in groups.items():
+                with open(self.segment_path(day), "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                written += len(lines)
+        for fn in list(self._listeners):
+            try:
+                fn(sorted(groups))
+            except Exception as e:
+                print(f"SegmentStore {self.root.name} listener error:", e)
+        return written
+
+    def discard(self, predicate):
+        # one-off migrations only: rewrite the segments holding records that match predicate(record) without
+        # them (tmp file + replace); listeners see the shorter segments and rebuild those days
+        changed = []
+        removed = 0
+        with self._lock:
+            for day in self.days():
+                path = self.segment_path(day)
+                keep = []
+                dropped = 0
+                with open(path, "rb") as f:
+                    for line in f:
+                        try:
+                            if line.strip() and predicate(json.loads(line)):
+                                dropped += 1
+                                continue
+                        except ValueError:
+                            pass
+                        keep.append(line if line.endswith(b"\n") else line + b"\n")
+                if not dropped:
+                    continue
+                tmp = path.with_name(path.name + ".tmp")
+                with open(tmp, "wb") as f:
+                    f.writelines(keep)
+                os.replace(tmp, path)
+                changed.append(day)
+                removed += dropped
+        if changed:
+            for fn in list(self._listeners):
+                try:
+                    fn(changed)
+                except Exception as e:
+                    print(f"SegmentStore {self.root.name} listener error:", e)
+        return removed
+
+    def add_listener(self, fn):
+        if fn not in self._listeners:
+            self._listeners.append(fn)
+
+    def add_expire_listener(self, fn):
+        if fn not in self._expire_listeners:
+            self._expire_listeners.append(fn)
+
+    def expire(self, days, archive_dir=None, today=None):
+        # drop (or gzip into archive_dir) every whole day segment older than `days`; decided by file name only
+        cutoff = ((today or date.today()) - timedelta(days=days)).isoformat()
+        expired = [day for day in self.days() if day < cutoff]
+        if not expired:
+            return []
+        if archive_dir is not None:
+            Path(archive_dir).mkdir(parents=True, exist_ok=True)
+        done = []
+        with self._lock:
+            for day in expired:
+                src = self.segment_path(day)
+                try:
+                    if archive_dir is not None:
+                        dst = Path(archive_dir) / f"{day}{SEGMENT_SUFFIX}.gz"
+                        with open(src, "rb") as f_in, gzip.open(dst, "ab") as f_out:
+                            shutil.copyfileobj(f_in, f_out)
+                    os.remove(src)
+                    done.append(day)
+                except OSError as e:
+                    print(f"SegmentStore expire error for {day}:", e)
+        if done:
+            for fn in list(self._expire_listeners):
+                try:
+                    fn(done)
+                except Exception as e:
+                    print(f"SegmentStore {self.root.name} expire listener error:", e)
+        return done
+
+    # -----------------------
+    # Read path
+    # -----------------------
+    def _read_segment(self, day):
+        out = []
+        try:
+            with open(self.segment_path(day), "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        out.append(json.loads(line))
+                    except ValueError:
+                        # a torn last line after a crash should not hide the rest of the day
+                        pass
+        except FileNotFoundError:
+            pass
+        return out
+
+    def read(self, start=None, end=None):
+        # start / end: date, datetime or "YYYY-MM-DD" (inclusive); only matching segments are opened
+        start_day, end_day = _as_day(start), _as_day(end)
+        out = []
+        for day in self.days():
+            if start_day and day < start_day:
+                continue
+            if end_day and day > end_day:
+                break
+            out.extend(self._read_segment(day))
+        return out
+
+    def read_all(self):
+        return self.read()
+
+    # -----------------------
+    # Migration from the old whole-file JSON array
+    # -----------------------
+    def _import_legacy(self, legacy_path):
+        # the original is renamed to *.migrated first (backup and source of the import), then its records are
+        # appended and the marker written; after a crash in between, the next open resumes from *.migrated and
+        # skips the records already in the segments, so nothing is imported twice
+        marker = self.root / LEGACY_MARKER
+        backup = legacy_path.with_name(legacy_path.name + ".migrated")
+        if marker.exists():
+            return
+        resume = backup.exists()
+        source = backup if resume else legacy_path
+        if not source.exists():
+            return
+        try:
+            with open(source, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"SegmentStore legacy import error for {source}:", e)
+            return
+        if not isinstance(data, list):
+            return
+        placed = [r for r in data if isinstance(r, dict) and _day_key(r.get(self.time_key))]
+        leftovers = [r for r in data if not (isinstance(r, dict) and _day_key(r.get(self.time_key)))]
+        if not resume:
+            os.replace(legacy_path, backup)
+        # records that do not belong to this stream stay in the old file (already there when resuming)
+        if leftovers and not legacy_path.exists():
+            tmp = legacy_path.with_name(legacy_path.name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(leftovers, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, legacy_path)
+        if resume:
+            placed = self._not_stored(placed)
+        self.append_many(placed)
+        marker.write_text(datetime.now().isoformat(), encoding="utf-8")
+        print(f"SegmentStore imported {len(placed)} records from {source}")
+
+    def _not_stored(self, records):
+        # records not yet in their day segment; counted, so readings repeated in the old file stay repeated
+        by_day = {}
+        for rec in records:
+            by_day.setdefault(_day_key(rec.get(self.time_key)), []).append(rec)
+        out = []
+        for day, recs in by_day.items():
+            stored = Counter(_record_key(r) for r in self._read_segment(day))
+            for rec in recs:
+                key = _record_key(rec)
+                if stored[key]:
+                    stored[key] -= 1
+                else:
+                    out.append(rec)
+        return out
+
+
+def _record_key(record):
+    return json.dumps(record, ensure_ascii=False, sort_keys=True, default=str)
+
+
+# -----------------------
+# Process-wide registry (one store per directory, shared by all Streamlit reruns)
+# -----------------------
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(root, time_key="timestamp", legacy_file=None):
+    key = str(Path(root).resolve())
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = SegmentStore(root, time_key=time_key, legacy_file=legacy_file)
+            _stores[key] = store
+        return store
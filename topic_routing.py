@@ -0,0 +1,119 @@
+# topic_routing.py
+# Per-device MQTT topic scheme for ESP32 fleets
+# - devices publish to farm/<location>/<area>/<device>/<kind> (kind = sensor, status, ...)
+# - the server subscribes once with a wildcard (farm/+/+/+/sensor) instead of one topic per device
+# - route() parses a topic the first time it is seen and caches the DeviceRoute by topic string, so every
+#   following message is one dict lookup, no per-message scanning or splitting
+# - the cache is an LRU bounded by max_routes (the per-device index follows evictions); topics outside the
+#   scheme are never cached
+# - set_locations() restricts routing to known zones (app locations / crop_data): a topic naming any other
+#   location gets no route, so arbitrary publishers cannot grow the router, the latest-state store or the
+#   live channels; the topic level is matched as topic_segment(name) and the route carries the real name
+
+import threading
+import time
+from collections import OrderedDict
+
+TOPIC_ROOT = "farm"
+MAX_ROUTES = 20000
+
+
+def topic_segment(name):
+    # MQTT topic levels cannot contain "/" and wildcards must not appear in published topics
+    return str(name).replace("/", "-").replace("+", "-").replace("#", "-").strip()
+
+
+def device_topic(location, area, device, kind="sensor", root=TOPIC_ROOT):
+    return "/".join([root, topic_segment(location), topic_segment(area), topic_segment(device), kind])
+
+
+def wildcard(kind="sensor", root=TOPIC_ROOT):
+    return f"{root}/+/+/+/{kind}"
+
+
+class DeviceRoute:
+    __slots__ = ("location", "area", "device", "kind", "key", "state")
+
+    def __init__(self, location, area, device, kind):
+        self.location = location
+        self.area = area
+        self.device = device
+        self.kind = kind
+        self.key = (location, area, device)
+        # per-device scratch state (message count, last seen, ...)
+        self.state = {"messages": 0, "last_seen": None}
+
+
+class TopicRouter:
+    def __init__(self, root=TOPIC_ROOT, max_routes=MAX_ROUTES):
+        self.root = root
+        self.max_routes = max_routes
+        self._routes = OrderedDict()  # topic string -> DeviceRoute, least recently used first
+        self.devices = {}             # (location, area, device) -> {kind: DeviceRoute}
+        self._locations = None        # topic level -> location name; None = every location
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def set_locations(self, names):
+        # called on every rerun with the current zones; routes of zones that disappeared are dropped
+        locations = {topic_segment(n): n for n in names}
+        with self._lock:
+            if locations == self._locations:
+                return
+            self._locations = locations
+            allowed = set(locations.values())
+            for topic in [t for t, r in self._routes.items() if r.location not in allowed]:
+                self._forget(topic)
+
+    def _forget(self, topic):
+        # called with self._lock held
+        r = self._routes.pop(topic)
+        kinds = self.devices.get(r.key)
+        if kinds is not None and kinds.get(r.kind) is r:
+            del kinds[r.kind]
+            if not kinds:
+                del self.devices[r.key]
+
+    def route(self, topic):
+        with self._lock:
+            r = self._routes.get(topic)
+            if r is not None:
+                self._routes.move_to_end(topic)
+                return r
+            parts = topic.split("/")
+            if len(parts) != 5 or parts[0] != self.root or not all(parts[1:]):
+                return None
+            location = parts[1] if self._locations is None else self._locations.get(parts[1])
+            if location is None:
+                self.rejected += 1
+                return None
+            r = DeviceRoute(location, parts[2], parts[3], parts[4])
+            self._routes[topic] = r
+            self.devices.setdefault(r.key, {})[r.kind] = r
+            while len(self._routes) > self.max_routes:
+                self._forget(next(iter(self._routes)))
+            return r
+
+    def touch(self, route):
+        route.state["messages"] += 1
+        route.state["last_seen"] = time.time()
+
+    def device_keys(self, location=None):
+        with self._lock:
+            keys = list(self.devices)
+        return [k for k in keys if location is None or k[0] == location]
+
+
+# -----------------------
+# Process-wide registry
+# -----------------------
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(root=TOPIC_ROOT):
+    with _routers_lock:
+        router = _routers.get(root)
+        if router is None:
+            router = _routers[root] = TopicRouter(root)
+        return router
@@ -0,0 +1,260 @@
+# ts_index.py
+# Persistent (location, time) -> record offset index over the day segments of a SegmentStore
+# - one append-only sidecar per day segment: _index/<day>.idx, one "location<TAB>time<TAB>offset<TAB>length" line per record
+# - the index follows the segment by byte offset (store listener + check before every query),
+#   so it always covers exactly what has been appended, also after a crash or a restart
+# - sidecars go with their segment: removed when retention expires the day (expire listener), and leftovers of
+#   segments that no longer exist are removed when the index is opened
+# - query(location, start, end) bisects the sorted times of that location and reads only the matching byte ranges
+# - version(location, start, end) changes only when that location got records in the range (chart cache keys);
+#   it follows the segment files, so it also sees samples written by another process
+
+import bisect
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+
+def _time_key(value):
+    # local wall clock, second precision: "2025-01-31T06:05:00"
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    return str(value)[:19] if value is not None else None
+
+
+class _DayIndex:
+    def __init__(self):
+        self.covered = 0
+        self.locs = {}  # location -> (times, offsets, lengths), sorted by time
+
+    def add(self, loc, key, offset, length):
+        times, offsets, lengths = self.locs.setdefault(loc, ([], [], []))
+        if not times or key >= times[-1]:
+            times.append(key)
+            offsets.append(offset)
+            lengths.append(length)
+        else:
+            # late sample: keep the per-location lists sorted by time
+            i = bisect.bisect_right(times, key)
+            times.insert(i, key)
+            offsets.insert(i, offset)
+            lengths.insert(i, length)
+        end = offset + length
+        if end > self.covered:
+            self.covered = end
+
+
+class TimeIndex:
+    def __init__(self, store, location_key="location", cache_days=64):
+        self.store = store
+        self.location_key = location_key
+        self.cache_days = cache_days
+        self.dir = Path(store.root) / "_index"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._days = OrderedDict()
+        self._lock = threading.Lock()
+        store.add_listener(self._on_append)
+        store.add_expire_listener(self._on_expire)
+        self._on_expire(sorted({n[:-len(".idx")] for n in os.listdir(self.dir) if n.endswith(".idx")} - set(store.days())))
+
+    def _on_append(self, days):
+        for day in days:
+            self._day(day)
+
+    def _on_expire(self, days):
+        # the segments are gone (retention): drop their index from memory and disk
+        with self._lock:
+            for day in days:
+                self._days.pop(day, None)
+                try:
+                    os.remove(self._idx_path(day))
+                except OSError:
+                    pass
+
+    # -----------------------
+    # Maintenance
+    # -----------------------
+    def _idx_path(self, day):
+        return self.dir / f"{day}.idx"
+
+    def _load(self, day):
+        # trusts complete lines that continue the covered range; a torn tail (crash while appending) is cut off
+        # the sidecar and its records are indexed again from the segment by the next refresh
+        ix = _DayIndex()
+        path = self._idx_path(day)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return ix
+        good = 0
+        for line in data.split(b"\n")[:-1]:
+            parts = line.decode("utf-8", "replace").split("\t")
+            try:
+                offset, length = int(parts[2]), int(parts[3])
+            except (IndexError, ValueError):
+                break
+            if len(parts) != 4 or offset != ix.covered:
+                break
+            ix.add(parts[0], parts[1], offset, length)
+            good += len(line) + 1
+        if good < len(data):
+            with open(path, "r+b") as f:
+                f.truncate(good)
+        return ix
+
+    def _refresh(self, day, ix):
+        path = self.store.segment_path(day)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size < ix.covered:
+            # segment was replaced: rebuild the index of this day from scratch
+            ix.covered, ix.locs = 0, {}
+            try:
+                os.remove(self._idx_path(day))
+            except OSError:
+                pass
+        if size <= ix.covered:
+            return
+        time_key = self.store.time_key
+        with open(path, "rb") as f:
+            f.seek(ix.covered)
+            chunk = f.read(size - ix.covered)
+        pos = ix.covered
+        new_lines = []
+        start = 0
+        while True:
+            nl = chunk.find(b"\n", start)
+            if nl < 0:
+                break  # incomplete last line, indexed on the next refresh
+            raw = chunk[start:nl]
+            length = nl + 1 - start
+            offset = pos + start
+            start = nl + 1
+            loc, key = "", ""
+            if raw.strip():
+                try:
+                    rec = json.loads(raw)
+                    loc = str(rec.get(self.location_key) or "").replace("\t", " ")
+                    key = _time_key(rec.get(time_key)) or ""
+                except ValueError:
+                    pass
+            ix.add(loc, key, offset, length)
+            new_lines.append(f"{loc}\t{key}\t{offset}\t{length}\n")
+        if new_lines:
+            with open(self._idx_path(day), "a", encoding="utf-8") as f:
+                f.write("".join(new_lines))
+
+    def _day(self, day):
+        with self._lock:
+            ix = self._days.get(day)
+            if ix is None:
+                ix = self._load(day)
+                self._days[day] = ix
+            self._days.move_to_end(day)
+            self._refresh(day, ix)
+            while len(self._days) > self.cache_days:
+                self._days.popitem(last=False)
+            return ix
+
+    # -----------------------
+    # Queries
+    # -----------------------
+    def _read_ranges(self, day, offsets, lengths):
+        if not offsets:
+            return []
+        lo = min(offsets)
+        hi = max(o + n for o, n in zip(offsets, lengths))
+        with open(self.store.segment_path(day), "rb") as f:
+            f.seek(lo)
+            span = f.read(hi - lo)
+        out = []
+        for o, n in zip(offsets, lengths):
+            raw = span[o - lo:o - lo + n]
+            try:
+                out.append(json.loads(raw))
+            except ValueError:
+                pass
+        return out
+
+    def query(self, location, start=None, end=None):
+        # records of `location` with start <= time <= end (date / datetime / ISO string, inclusive), oldest first
+        start_key, end_key = _time_key(start), _time_key(end)
+        if isinstance(end, date) and not isinstance(end, datetime):
+            end_key = end.isoformat() + "T23:59:59"
+        location = location or ""
+        out = []
+        for day in self.store.days():
+            if start_key and day < start_key[:10]:
+                continue
+            if end_key and day > end_key[:10]:
+                break
+            ix = self._day(day)
+            entry = ix.locs.get(location)
+            if not entry:
+                continue
+            times, offsets, lengths = entry
+            i = bisect.bisect_left(times, start_key) if start_key else 0
+            j = bisect.bisect_right(times, end_key) if end_key else len(times)
+            if i < j:
+                out.extend(self._read_ranges(day, offsets[i:j], lengths[i:j]))
+        return out
+
+    def version(self, location, start=None, end=None):
+        # (day, records, newest time) per day of `location` in start..end: changes only when this location got data
+        start_day, end_day = _time_key(start), _time_key(end)
+        location = location or ""
+        out = []
+        for day in self.store.days():
+            if start_day and day < start_day[:10]:
+                continue
+            if end_day and day > end_day[:10]:
+                break
+            entry = self._day(day).locs.get(location)
+            if entry and entry[0]:
+                out.append((day, len(entry[0]), entry[0][-1]))
+        return tuple(out)
+
+    def latest(self, location):
+        # newest record of `location`, looking at the most recent days first
+        location = location or ""
+        for day in reversed(self.store.days()):
+            entry = self._day(day).locs.get(location)
+            if entry and entry[0]:
+                recs = self._read_ranges(day, entry[1][-1:], entry[2][-1:])
+                if recs:
+                    return recs[0]
+        return None
+
+    def locations(self, start=None, end=None):
+        start_day, end_day = _time_key(start), _time_key(end)
+        out = set()
+        for day in self.store.days():
+            if start_day and day < start_day[:10]:
+                continue
+            if end_day and day > end_day[:10]:
+                break
+            out.update(k for k, v in self._day(day).locs.items() if v[0])
+        return sorted(out)
+
+
+# -----------------------
+# Process-wide registry (one index per store)
+# -----------------------
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_time_index(store, location_key="location"):
+    key = str(Path(store.root).resolve())
+    with _indexes_lock:
+        idx = _indexes.get(key)
+        if idx is None:
+            idx = TimeIndex(store, location_key=location_key)
+            _indexes[key] = idx
+        return idx
@@ -0,0 +1,240 @@
+# weather_client.py
+# Shared Open-Meteo client with TTL cache, single-flight requests and stale-while-revalidate
+# - one cache entry per (lat, lon, query params); entries are fresh for `ttl` seconds and may be served stale up to `stale_ttl`
+# - a stale entry is returned immediately and refreshed in a background thread, page renders do not wait for the network
+# - concurrent identical requests share one HTTP call (single flight); failures keep the last good data
+# - prefetch() registers locations that a background thread refreshes on a schedule, many coordinates per
+#   HTTP request (Open-Meteo accepts comma-separated latitude / longitude lists), so switching city is a cache hit;
+#   the locations of a batch count as in flight, a cold get() for one of them waits for the batch instead of
+#   sending its own request
+# - OPEN_METEO_URL can point the client at another server (e.g. a local stand-in)
+
+import os
+import threading
+import time
+
+import requests
+
+OPEN_METEO_URL = os.environ.get("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast")
+
+
+def cache_key(lat, lon, params):
+    return (round(float(lat), 4), round(float(lon), 4), tuple(sorted((params or {}).items())))
+
+
+class _Entry:
+    def __init__(self):
+        self.data = None
+        self.fetched_at = 0.0
+        self.error = None
+        self.error_at = 0.0
+
+
+class WeatherClient:
+    def __init__(self, base_url=OPEN_METEO_URL, ttl=600, stale_ttl=6 * 3600, timeout=10, cold_wait=3.0, retry_after=30, batch_size=100):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.cold_wait = cold_wait
+        self.retry_after = retry_after
+        self._session = requests.Session()
+        self._entries = {}
+        self._inflight = {}
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        # prefetch: params key -> (params, {(lat, lon), ...})
+        self._prefetch = {}
+        self._claimed = {}  # key -> in-flight event registered by prefetch(), released by fetch_many
+        self._prefetch_wake = threading.Event()
+        self._prefetch_thread = None
+        self.prefetch_runs = 0
+        # counters
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.errors = 0
+
+    # -----------------------
+    # Fetching (single flight per key)
+    # -----------------------
+    def _fetch(self, key, lat, lon, params):
+        entry = self._entries.setdefault(key, _Entry())
+        try:
+            query = dict(params or {})
+            query["latitude"] = lat
+            query["longitude"] = lon
+            self.fetches += 1
+            res = self._session.get(self.base_url, params=query, timeout=self.timeout)
+            res.raise_for_status()
+            entry.data = res.json()
+            entry.fetched_at = time.time()
+            entry.error = None
+        except Exception as e:
+            self.errors += 1
+            entry.error = str(e)
+            entry.error_at = time.time()
+            print("WeatherClient fetch error:", e)
+        finally:
+            with self._lock:
+                done = self._inflight.pop(key, None)
+            if done is not None:
+                done.set()
+
+    def _start_fetch(self, key, lat, lon, params):
+        # returns the event of the request in flight for this key, starting one if needed
+        with self._lock:
+            ev = self._inflight.get(key)
+            if ev is not None:
+                return ev
+            entry = self._entries.get(key)
+            if entry is not None and entry.error and time.time() - entry.error_at < self.retry_after:
+                return None
+            ev = self._inflight[key] = threading.Event()
+        threading.Thread(target=self._fetch, args=(key, lat, lon, params), name="weather-fetch", daemon=True).start()
+        return ev
+
+    # -----------------------
+    # Public API
+    # -----------------------
+    def get(self, lat, lon, params=None, max_wait=None):
+        # cached JSON response (or None); waits at most `max_wait` (default cold_wait) seconds, only when nothing is cached
+        key = cache_key(lat, lon, params)
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None and entry.data is not None:
+            age = now - entry.fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                return entry.data
+            if age < self.stale_ttl:
+                self.stale_hits += 1
+                self._start_fetch(key, lat, lon, params)
+                return entry.data
+        self.misses += 1
+        ev = self._start_fetch(key, lat, lon, params)
+        if ev is not None:
+            ev.wait(self.cold_wait if max_wait is None else max_wait)
+        entry = self._entries.get(key)
+        return entry.data if entry is not None else None
+
+    def put(self, lat, lon, params, data, fetched_at=None):
+        # store a response obtained elsewhere (e.g. a batched request for many locations)
+        key = cache_key(lat, lon, params)
+        with self._lock:
+            entry = self._entries.setdefault(key, _Entry())
+        entry.data = data
+        entry.fetched_at = fetched_at or time.time()
+        entry.error = None
+
+    # -----------------------
+    # Batch prefetch for many locations
+    # -----------------------
+    def fetch_many(self, coords, params=None):
+        # one HTTP request per `batch_size` locations; results go straight into the cache
+        coords = [(float(lat), float(lon)) for lat, lon in coords]
+        stored = 0
+        for i in range(0, len(coords), self.batch_size):
+            chunk = coords[i:i + self.batch_size]
+            # single flight with get(): keys already in flight keep their own request, except those claimed by
+            # prefetch() for this batch
+            with self._lock:
+                events = {}
+                for lat, lon in chunk:
+                    key = cache_key(lat, lon, params)
+                    ev = self._inflight.get(key)
+                    if ev is None:
+                        events[key] = self._inflight[key] = threading.Event()
+                    elif self._claimed.get(key) is ev:
+                        events[key] = self._claimed.pop(key)
+            try:
+                stored += self._fetch_chunk(chunk, params)
+            finally:
+                with self._lock:
+                    for key, ev in events.items():
+                        if self._inflight.get(key) is ev:
+                            del self._inflight[key]
+                for ev in events.values():
+                    ev.set()
+        return stored
+
+    def _fetch_chunk(self, chunk, params):
+        query = dict(params or {})
+        query["latitude"] = ",".join(f"{lat:.4f}" for lat, _ in chunk)
+        query["longitude"] = ",".join(f"{lon:.4f}" for _, lon in chunk)
+        try:
+            self.fetches += 1
+            res = self._session.get(self.base_url, params=query, timeout=self.timeout)
+            res.raise_for_status()
+            data = res.json()
+        except Exception as e:
+            self.errors += 1
+            print("WeatherClient batch fetch error:", e)
+            return 0
+        # a single location comes back as an object, several as a list in request order
+        if isinstance(data, dict):
+            data = [data]
+        now = time.time()
+        for (lat, lon), item in zip(chunk, data):
+            self.put(lat, lon, params, item, fetched_at=now)
+        return min(len(chunk), len(data))
+
+    def prefetch(self, coords, params=None, interval=None):
+        # keep these locations warm: refreshed every `interval` seconds (default 80% of ttl) by one thread
+        pkey = cache_key(0, 0, params)[2]
+        with self._lock:
+            group = self._prefetch.setdefault(pkey, (dict(params or {}), set()))
+            new = {(round(float(lat), 4), round(float(lon), 4)) for lat, lon in coords} - group[1]
+            group[1].update(new)
+            # new locations count as in flight before prefetch() returns: a get() right after waits for the
+            # batch (fetch_many takes these events over) instead of sending its own request
+            for lat, lon in new:
+                key = cache_key(lat, lon, params)
+                if key not in self._inflight:
+                    self._claimed[key] = self._inflight[key] = threading.Event()
+            started = self._prefetch_thread is None
+            if started:
+                self._prefetch_interval = interval or self.ttl * 0.8
+                self._prefetch_thread = threading.Thread(target=self._prefetch_loop, name="weather-prefetch", daemon=True)
+                self._prefetch_thread.start()
+        if new and not started:
+            # a new thread fetches everything on its first pass anyway
+            self._prefetch_wake.set()
+
+    def _prefetch_loop(self):
+        while True:
+            self._prefetch_wake.clear()
+            with self._lock:
+                groups = [(params, sorted(coords)) for params, coords in self._prefetch.values()]
+            for params, coords in groups:
+                self.fetch_many(coords, params)
+            self.prefetch_runs += 1
+            self._prefetch_wake.wait(timeout=self._prefetch_interval)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "prefetch_locations": sum(len(c) for _, c in self._prefetch.values()),
+            "prefetch_runs": self.prefetch_runs,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "fetches": self.fetches,
+            "errors": self.errors,
+        }
+
+
+# -----------------------
+# Process-wide singleton
+# -----------------------
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_weather_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = WeatherClient()
+        return _client
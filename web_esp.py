@@ -1,6 +1,7 @@
 # web_esp.py
 import streamlit as st
-import requests
+from weather_client import get_weather_client
+from crop_catalog import get_catalog
 from datetime import datetime, timedelta, date
 import random
 from PIL import Image
@@ -38,12 +39,7 @@ def run_streamlit():
     selected_city = st.selectbox("📍 Chọn địa điểm:", list(locations.keys()))
     latitude, longitude = locations[selected_city]
 
-    crops = {
-        "Ngô": (75, 100), 
-        "Chuối": (270, 365),
-        "Rau cải": (30, 45),
-        "Ớt": (70, 90), 
-    }
+    crops = get_catalog().harvest_windows()
     selected_crop = st.selectbox("🌱 Chọn loại nông sản:", list(crops.keys()))
     planting_date = st.date_input("📅 Chọn ngày gieo trồng:")
     min_days, max_days = crops[selected_crop]
@@ -51,8 +47,14 @@ def run_streamlit():
     harvest_max = planting_date + timedelta(days=max_days)
     st.success(f"🌾 Dự kiến thu hoạch từ **{harvest_min.strftime('%d/%m/%Y')}** đến **{harvest_max.strftime('%d/%m/%Y')}**")
 
-    weather_url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,relative_humidity_2m,precipitation,precipitation_probability&timezone=auto"
-    weather_data = requests.get(weather_url).json()
+    weather_params = {
+        "current": "temperature_2m,relative_humidity_2m,precipitation,precipitation_probability",
+        "hourly": "temperature_2m,relative_humidity_2m,precipitation_probability",
+        "timezone": "auto",
+    }
+    weather_client = get_weather_client()
+    weather_client.prefetch(locations.values(), weather_params)
+    weather_data = weather_client.get(latitude, longitude, weather_params) or {}
     current_weather = weather_data.get("current", {})
 
     st.subheader("🌦️ Thời tiết hiện tại tại " + selected_city)
@@ -5,17 +5,34 @@
 # - All persistent data (crop areas, config, history) are saved to disk so reopening app restores previous state
 
 import streamlit as st
+import streamlit.components.v1 as components
 from datetime import datetime, timedelta, date, time
-import threading
 from PIL import Image
-import requests
 import json
 import os
-from streamlit_autorefresh import st_autorefresh
 import pytz
 import pandas as pd
-import paho.mqtt.client as mqtt
 from pathlib import Path
+from timeseries_store import get_store
+from ingest_service import get_service
+from ingest_pipeline import get_pipeline
+from write_buffer import get_buffer
+from retention import get_retention_job, merge_policy
+from rollups import get_rollups
+from weather_client import get_weather_client
+from mqtt_publisher import get_publisher
+from config_sync import get_config_sync
+from topic_routing import get_router, wildcard
+from downsample import downsample_frame
+from chart_cache import get_chart_cache, get_data_versions
+from history_frame import get_history_frame
+from file_utils import file_version
+from planting_table import get_planting_table
+from crop_catalog import get_catalog
+from sqlite_store import get_sqlite_backend
+from irrigation_events import get_irrigation_events
+from live_push import get_live_hub, live_panel_html, live_payload
+from latest_state import get_latest_store
 
 # -----------------------
 # Paths & Files
@@ -25,9 +42,10 @@ DATA_DIR = BASE_DIR / "data"
 DATA_DIR.mkdir(exist_ok=True)
 
 DATA_FILE = DATA_DIR / "crop_data.json"
-HISTORY_FILE = DATA_DIR / "history_irrigation.json"   # lưu lịch sử sensor + tưới
-FLOW_FILE = DATA_DIR / "flow_data.json"
+HISTORY_FILE = DATA_DIR / "history_irrigation.json"   # file cũ, được chuyển sang data/history_irrigation/*.jsonl
+FLOW_FILE = DATA_DIR / "flow_data.json"              # file cũ, được chuyển sang data/flow_data/*.jsonl
 CONFIG_FILE = DATA_DIR / "config.json"
+CONFIG_STATE_FILE = DATA_DIR / "config_state.json"  # last config version acknowledged by the broker
 
 # -----------------------
 # Timezone
@@ -37,17 +55,23 @@ vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
 # -----------------------
 # MQTT & sensor state
 # -----------------------
-sensor_data = None  # biến toàn cục lưu dữ liệu sensor nhận được
-
 MQTT_BROKER = "broker.hivemq.com"
 MQTT_PORT = 1883
-MQTT_TOPIC_SENSOR = "esp32/sensor/data"
-MQTT_TOPIC_CONFIG = "esp32/config/update"  # topic to publish configuration updates to ESP32
+MQTT_TOPIC_SENSOR = "esp32/sensor/data"  # legacy single-device topic (no location)
+MQTT_TOPIC_FLEET = wildcard("sensor")     # farm/<location>/<area>/<device>/sensor
+MQTT_CONFIG_PREFIX = "esp32/config"  # retained per-field config: esp32/config/<field> = {"version", "value"}
+
+# optional SQLite backend (WAL): IRRIGATION_STORAGE=sqlite keeps the JSON documents, readings and plantings
+# in data/irrigation.db; existing JSON files are imported on first load
+STORAGE_BACKEND = os.environ.get("IRRIGATION_STORAGE", "json")
+sqlite_db = get_sqlite_backend(DATA_DIR / "irrigation.db") if STORAGE_BACKEND == "sqlite" else None
 
 # -----------------------
 # Helpers: load/save JSON
 # -----------------------
 def load_json(path, default=None):
+    if sqlite_db is not None:
+        return sqlite_db.load_doc(Path(path).name, default, import_from=path)
     try:
         if isinstance(path, Path):
             path = str(path)
@@ -61,6 +85,9 @@ def load_json(path, default=None):
 
 def save_json(path, data):
     try:
+        if sqlite_db is not None:
+            sqlite_db.save_doc(Path(path).name, data)
+            return True
         if isinstance(path, Path):
             path = str(path)
         with open(path, 'w', encoding='utf-8') as f:
@@ -70,144 +97,231 @@ def save_json(path, data):
         print(f"save_json error for {path}:", e)
         return False
 
+
+def data_version(path):
+    # changes on every save_json(path, ...), used as cache key for data derived from the document
+    if sqlite_db is not None:
+        return sqlite_db.doc_version(Path(path).name)
+    return file_version(path)
+
 # -----------------------
-# MQTT send config
+# MQTT send config (shared long-lived publisher, QoS 1, versioned retained deltas)
 # -----------------------
+CONFIG_ACK_TIMEOUT = 3.0  # seconds the save button waits for the broker PUBACK
+
+
 def send_config_to_esp32(config_data):
-    try:
-        client = mqtt.Client()
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        payload = json.dumps(config_data)
-        client.publish(MQTT_TOPIC_CONFIG, payload)
-        client.disconnect()
-        return True
-    except Exception as e:
-        st.error(f"Lỗi gửi cấu hình MQTT: {e}")
-        return False
+    # publishes only the fields changed since the last acknowledged version; returns a PublishResult
+    publisher = get_publisher(MQTT_BROKER, MQTT_PORT)
+    sync = get_config_sync(CONFIG_STATE_FILE, publisher, MQTT_CONFIG_PREFIX)
+    result = sync.publish(config_data)
+    result.wait(CONFIG_ACK_TIMEOUT)
+    return result
 
 # -----------------------
 # MQTT callbacks
 # -----------------------
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        print("MQTT connected successfully")
-        client.subscribe(MQTT_TOPIC_SENSOR)
-    else:
-        print("MQTT connect failed with code", rc)
-
-
-def on_message(client, userdata, msg):
-    global sensor_data
-    try:
-        payload = msg.payload.decode("utf-8")
-        data = json.loads(payload)
-        # expected payload example:
-        # {"soil_moisture":45, "soil_temp":28.5, "light":400, "water_flow":2.3, "pump_status":"ON"}
-        sensor_data = data
-        print(f"Received sensor data: {sensor_data}")
-        # store history records when message arrives
-        _handle_incoming_sensor_data(data)
-    except Exception as e:
-        print("Error parsing MQTT message:", e)
-
-
-def mqtt_thread():
-    client = mqtt.Client()
-    client.on_connect = on_connect
-    client.on_message = on_message
-    try:
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        client.loop_forever()
-    except Exception as e:
-        print("MQTT thread error:", e)
-
-# start MQTT listener
-threading.Thread(target=mqtt_thread, daemon=True).start()
-
-# -----------------------
-# Historical storage helpers (trim to 365 days)
-# -----------------------
-def _trim_history_list(lst, time_key, days=365):
-    cutoff = datetime.now(vn_tz) - timedelta(days=days)
-    out = []
-    for r in lst:
-        try:
-            t = datetime.fromisoformat(r.get(time_key))
-            # if naive datetime, assume local tz
-            if t.tzinfo is None:
-                t = t
-            if t >= cutoff:
-                out.append(r)
-        except Exception:
-            # keep if cannot parse
-            out.append(r)
-    return out
-
+# locations (zones) of the farm; fleet topics naming any other location are not routed
+locations = {
+    "TP. Hồ Chí Minh": (10.762622, 106.660172),
+    "Hà Nội": (21.028511, 105.804817),
+    "Cần Thơ": (10.045161, 105.746857),
+    "Đà Nẵng": (16.054407, 108.202167),
+    "Bình Dương": (11.3254, 106.4770),
+    "Đồng Nai": (10.9453, 106.8133),
+}
+router = get_router()
+router.set_locations(locations)
+
+
+SENSOR_FIELDS = ("soil_moisture", "soil_temp", "light", "water_flow")
+
+
+def decode_message(msg):
+    # decode / validate stage of the ingest pipeline (runs on the pipeline's event loop, not in paho's thread)
+    # expected payload example:
+    # {"soil_moisture":45, "soil_temp":28.5, "light":400, "water_flow":2.3, "pump_status":"ON"}
+    data = json.loads(msg.payload.decode("utf-8"))
+    if not isinstance(data, dict):
+        raise ValueError("sensor payload is not an object")
+    for field in SENSOR_FIELDS:
+        value = data.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError(f"{field} is not numeric")
+    # device identity comes from the topic (cached route, one dict lookup per message)
+    route = router.route(msg.topic)
+    source = None
+    if route is not None:
+        router.touch(route)
+        route.state["last"] = data
+        source = {"location": route.location, "area": route.area, "device": route.device}
+    return data, source
+
+
+def persist_message(value):
+    # persist stage: latest value for the UI + history records into the write-behind buffer
+    data, source = value
+    now_iso = datetime.now(vn_tz).isoformat()
+    # latest value per (location, area, device), updated in place; the legacy topic is device ("", "", "")
+    source = source or {}
+    latest_state.update(source.get("location"), source.get("area"), source.get("device"),
+                        {f: data.get(f) for f in SENSOR_FIELDS}, ts=now_iso, pump_status=data.get("pump_status"))
+    # push to the open pages' live panels (no rerun); channel = location, "" for the legacy topic;
+    # only the numeric fields and a known pump status leave the server
+    live_hub.publish(source.get("location", ""), live_payload(data, SENSOR_FIELDS, now_iso))
+    _handle_incoming_sensor_data(data, source or None)
 
-def add_history_record(sensor_hum, sensor_temp):
+# -----------------------
+# Load persistent data (crop info + config)
+# -----------------------
+catalog = get_catalog()  # crop durations, stages, default thresholds
+crop_data = load_json(DATA_FILE, {}) or {}
+router.set_locations([*locations, *crop_data])
+config = load_json(CONFIG_FILE, None)
+if config is None:
+    config = {
+        "watering_slots": [{"start": "06:00", "end": "08:00"}],
+        "mode": "auto",
+        "moisture_thresholds": catalog.default_thresholds()
+    }
+else:
+    # ensure keys exist
+    config.setdefault('watering_slots', [{"start": "06:00", "end": "08:00"}])
+    config.setdefault('mode', 'auto')
+    config.setdefault('moisture_thresholds', catalog.default_thresholds())
+
+# retention per stream (config["retention"] may override days / archive), applied by a background job (below);
+# loaded before the storage so the history frame only backfills the retained days
+retention_policy = merge_policy(config.get("retention"))
+
+# -----------------------
+# Historical storage (append-only day segments; retention runs in the background, see below)
+# -----------------------
+# samples wait at most this many seconds in memory before being written (durability window)
+HISTORY_FLUSH_SECONDS = 2.0
+HISTORY_FLUSH_BATCH = 200
+
+history_store = get_store(DATA_DIR / "history_irrigation", time_key="timestamp", legacy_file=HISTORY_FILE)
+flow_store = get_store(DATA_DIR / "flow_data", time_key="time", legacy_file=FLOW_FILE)
+# min / max / mean / count per minute, hour and day, updated after every flush
+history_rollups = get_rollups(history_store, ["sensor_hum", "sensor_temp"])
+flow_rollups = get_rollups(flow_store, ["flow"])
+# rendered chart PNGs, invalidated per day by the flushes of each store
+chart_cache = get_chart_cache()
+data_versions = get_data_versions()
+data_versions.watch("history", history_store)
+data_versions.watch("flow", flow_store)
+sample_buffer = get_buffer("web_phan_quyen", batch_size=HISTORY_FLUSH_BATCH, flush_interval=HISTORY_FLUSH_SECONDS)
+# irrigation events (actions, sessions) have their own typed stream; action records that used to be mixed into
+# the sample stream are moved there once (before the history frame below is loaded from the samples)
+irrigation_events = get_irrigation_events(DATA_DIR / "irrigation_events", sample_store=history_store)
+HISTORY_PAGE_ROWS = 50  # irrigation history table page size
+# in-memory history (chunked NumPy columns) shared by all sessions: loaded from the segments once per process,
+# then appended to by ingestion; pages read immutable snapshots instead of re-reading the files
+history_frame = get_history_frame("web_phan_quyen_history", "timestamp", ["sensor_hum", "sensor_temp"],
+                                  ["action", "area", "crop", "location", "device"], backfill_from=history_store,
+                                  backfill_days=retention_policy["history"]["days"])
+HISTORY_TABLE_ROWS = 500
+# readings mirrored into the indexed SQLite table (location, device, ts) through the same buffer
+history_sink = sqlite_db.sink("history", "timestamp") if sqlite_db is not None else None
+flow_sink = sqlite_db.sink("flow", "time") if sqlite_db is not None else None
+
+# optional columnar backend (int64 epoch ms + float32 columns, memory-mapped) used for raw day charts:
+# IRRIGATION_HISTORY_BACKEND=columnar; JSON-lines segments stay the source for tables and rollups
+HISTORY_BACKEND = os.environ.get("IRRIGATION_HISTORY_BACKEND", "jsonl")
+history_columns = None
+flow_columns = None
+if HISTORY_BACKEND == "columnar":
+    from columnar_store import get_columnar_store
+    history_columns = get_columnar_store(DATA_DIR / "columns" / "history", "timestamp", ["sensor_hum", "sensor_temp"], backfill_from=history_store)
+    flow_columns = get_columnar_store(DATA_DIR / "columns" / "flow", "time", ["flow"], backfill_from=flow_store)
+
+
+def add_history_record(sensor_hum, sensor_temp, source=None):
     now_iso = datetime.now(vn_tz).isoformat()
     new_record = {
         "timestamp": now_iso,
         "sensor_hum": sensor_hum,
         "sensor_temp": sensor_temp
     }
-    history = load_json(HISTORY_FILE, []) or []
-    history.append(new_record)
-    history = _trim_history_list(history, 'timestamp', days=365)
-    save_json(HISTORY_FILE, history)
+    if source:
+        new_record.update(source)
+    history_frame.append(new_record)
+    sample_buffer.put(history_store, new_record)
+    if sqlite_db is not None:
+        sample_buffer.put(history_sink, new_record)
+    if history_columns is not None:
+        sample_buffer.put(history_columns, new_record)
 
 
-def add_flow_record(flow_val):
+def add_flow_record(flow_val, source=None):
     now_iso = datetime.now(vn_tz).isoformat()
     new_record = {
         "time": now_iso,
         "flow": flow_val
     }
-    flow = load_json(FLOW_FILE, []) or []
-    flow.append(new_record)
-    flow = _trim_history_list(flow, 'time', days=365)
-    save_json(FLOW_FILE, flow)
-
-# record irrigation events (descriptive). Keep 1 year as well
-def add_irrigation_action(action, area=None, crop=None):
+    if source:
+        new_record.update(source)
+    sample_buffer.put(flow_store, new_record)
+    if sqlite_db is not None:
+        sample_buffer.put(flow_sink, new_record)
+    if flow_columns is not None:
+        sample_buffer.put(flow_columns, new_record)
+
+# record irrigation events (descriptive), stored in the irrigation event stream (not with the sensor samples)
+def add_irrigation_action(action, area=None, crop=None, location=None):
     now_iso = datetime.now(vn_tz).isoformat()
     rec = {
         "timestamp": now_iso,
         "action": action,
         "area": area,
-        "crop": crop
+        "crop": crop,
+        "location": location
     }
-    history = load_json(HISTORY_FILE, []) or []
-    history.append(rec)
-    history = _trim_history_list(history, 'timestamp', days=365)
-    save_json(HISTORY_FILE, history)
+    irrigation_events.add_action(rec)
 
-# Handle incoming sensor data: save to history/flow and trim to 365 days
-def _handle_incoming_sensor_data(data):
+# Handle incoming sensor data: queue history/flow records for the write-behind buffer
+def _handle_incoming_sensor_data(data, source=None):
     try:
         if 'soil_moisture' in data and 'soil_temp' in data:
-            add_history_record(data.get('soil_moisture'), data.get('soil_temp'))
+            add_history_record(data.get('soil_moisture'), data.get('soil_temp'), source)
         if 'water_flow' in data:
-            add_flow_record(data.get('water_flow'))
+            add_flow_record(data.get('water_flow'), source)
     except Exception as e:
         print("_handle_incoming_sensor_data error:", e)
 
-# -----------------------
-# Load persistent data (crop info + config)
-# -----------------------
-crop_data = load_json(DATA_FILE, {}) or {}
-config = load_json(CONFIG_FILE, None)
-if config is None:
-    config = {
-        "watering_slots": [{"start": "06:00", "end": "08:00"}],
-        "mode": "auto",
-        "moisture_thresholds": {"Ngô": 65, "Chuối": 70, "Ớt": 65}
-    }
-else:
-    # ensure keys exist
-    config.setdefault('watering_slots', [{"start": "06:00", "end": "08:00"}])
-    config.setdefault('mode', 'auto')
-    config.setdefault('moisture_thresholds', {"Ngô":65, "Chuối":70, "Ớt":65})
+# live sensor values / pump LED are pushed to the browsers over server-sent events (see live_push.py)
+# own port (not Streamlit's 8501 / fallback 8502, not web_tuoi_tieu's); WEB_PHAN_QUYEN_LIVE_URL when proxied
+LIVE_PORT = int(os.environ.get("WEB_PHAN_QUYEN_LIVE_PORT", "8610"))
+live_hub = get_live_hub("web_phan_quyen", LIVE_PORT, public_url=os.environ.get("WEB_PHAN_QUYEN_LIVE_URL", ""))
+# last reading / pump status / staleness per device, O(1) reads; snapshot shared with api_server
+latest_state = get_latest_store("web_phan_quyen", DATA_DIR / "latest_state.json")
+
+# receive -> decode/validate -> persist on an asyncio pipeline with bounded queues; persisting pauses while the
+# write-behind buffer is above its high-water mark, and the oldest messages are shed if the inbox fills up
+INGEST_HIGH_WATER = 15000
+pipeline = get_pipeline("web_phan_quyen", decode_message, persist_message,
+                        ready=lambda: sample_buffer.depth() < INGEST_HIGH_WATER)
+
+# start MQTT listener once per server process; reruns only attach to its shared state
+ingest = get_service("web_phan_quyen", MQTT_BROKER, MQTT_PORT, [MQTT_TOPIC_SENSOR, MQTT_TOPIC_FLEET], None,
+                     buffer=sample_buffer, pipeline=pipeline)
+
+# retention jobs for every stream (policy loaded with the config above)
+retention_job = get_retention_job()
+# irrigation actions and sessions live in their own event stream, expired by the irrigation policy
+retention_job.add_store("history", history_store, retention_policy["history"]["days"], retention_policy["history"]["archive"])
+retention_job.add_store("flow", flow_store, retention_policy["flow"]["days"], retention_policy["flow"]["archive"])
+retention_job.add_store("history_frame", history_frame, retention_policy["history"]["days"])
+retention_job.add_store("irrigation_events", irrigation_events, retention_policy["irrigation"]["days"], retention_policy["irrigation"]["archive"])
+if sqlite_db is not None:
+    # the indexed readings table follows the same policy (DELETE of the expired rows)
+    retention_job.add_store("history_sqlite", history_sink, retention_policy["history"]["days"])
+    retention_job.add_store("flow_sqlite", flow_sink, retention_policy["flow"]["days"])
+if history_columns is not None:
+    # the columnar copies drop whole day directories with the same policy
+    retention_job.add_store("history_columns", history_columns, retention_policy["history"]["days"])
+    retention_job.add_store("flow_columns", flow_columns, retention_policy["flow"]["days"])
 
 # ensure structure in crop_data
 for city in []:
@@ -217,7 +331,8 @@ for city in []:
 # Streamlit UI initial
 # -----------------------
 st.set_page_config(page_title="Smart Irrigation WebApp", layout="wide")
-st_autorefresh(interval=60 * 1000, key="init_refresh")
+# no periodic full-page rerun: the live sensor panel is updated by push (live_hub), the rest of the page
+# re-renders on interaction
 
 st.markdown("""
     <style>
@@ -262,16 +377,15 @@ if user_type == _("Người điều khiển", "Control Administrator"):
         st.stop()
     else:
         st.sidebar.success(_("✅ Xác thực thành công.", "✅ Authentication successful."))
+        with st.sidebar.expander(_("📥 Trạng thái ghi dữ liệu", "📥 Ingestion status")):
+            st.json({"pipeline": pipeline.stats(), "buffer": sample_buffer.stats(), "chart_cache": chart_cache.stats()})
+        with st.sidebar.expander(_("📤 Trạng thái gửi cấu hình", "📤 Config delivery status")):
+            config_publisher = get_publisher(MQTT_BROKER, MQTT_PORT)
+            st.write(_("Kết nối broker", "Broker connected") + f": {config_publisher.connected} | " + _("Đang chờ xác nhận", "Awaiting ack") + f": {config_publisher.pending()}")
+            for h in list(config_publisher.recent)[:5]:
+                st.caption(f"{datetime.fromtimestamp(h.created_at, vn_tz).strftime('%H:%M:%S')} {h.topic} ({h.payload_size} B): {h.status}")
 
 # Locations & crops
-locations = {
-    "TP. Hồ Chí Minh": (10.762622, 106.660172),
-    "Hà Nội": (21.028511, 105.804817),
-    "Cần Thơ": (10.045161, 105.746857),
-    "Đà Nẵng": (16.054407, 108.202167),
-    "Bình Dương": (11.3254, 106.4770),
-    "Đồng Nai": (10.9453, 106.8133),
-}
 location_names = {k: k for k in locations.keys()}  # simple mapping
 location_display_names = list(location_names.values())
 
@@ -286,12 +400,9 @@ selected_city_display = st.selectbox(" ", location_display_names, index=location
 selected_city = selected_city_display
 latitude, longitude = locations[selected_city]
 
-crops = {
-    "Ngô": (75, 100),
-    "Chuối": (270, 365),
-    "Ớt": (70, 90),
-}
-crop_names = {"Ngô": _("Ngô", "Corn"), "Chuối": _("Chuối", "Banana"), "Ớt": _("Ớt", "Chili pepper")}
+# danh mục cây trồng dùng chung (crop_catalog.json), nạp một lần cho cả tiến trình
+crops = catalog.harvest_windows()
+crop_names = catalog.names(vi)
 
 # ensure crop_data structure for selected city
 if selected_city not in crop_data or not isinstance(crop_data[selected_city], dict):
@@ -307,21 +418,15 @@ areas = crop_data[selected_city]["areas"]
 st.header(_("🌱 Quản lý cây trồng", "🌱 Crop Management"))
 
 # helper stage function
-def giai_doan_cay(crop, days):
-    if crop == "Chuối":
-        if days <= 14: return _("🌱 Mới trồng", "🌱 Newly planted")
-        elif days <= 180: return _("🌿 Phát triển", "🌿 Growing")
-        elif days <= 330: return _("🌼 Ra hoa", "🌼 Flowering")
-        else: return _("🍌 Đã thu hoạch", "🍌 Harvested")
-    elif crop == "Ngô":
-        if days <= 25: return _("🌱 Mới trồng", "🌱 Newly planted")
-        elif days <= 70: return _("🌿 Thụ phấn", "🌿 Pollination")
-        elif days <= 100: return _("🌼 Trái phát triển", "🌼 Kernel growth")
-        else: return _("🌽 Đã thu hoạch", "🌽 Harvested")
-    elif crop == "Ớt":
-        if days <= 20: return _("🌱 Mới trồng", "🌱 Newly planted")
-        elif days <= 500: return _("🌼 Ra hoa", "🌼 Flowering")
-        else: return _("🌶️ Đã thu hoạch", "🌶️ Harvested")
+# giai đoạn sinh trưởng: mốc ngày đã biên dịch sẵn từ danh mục cây trồng
+stage_tables = catalog.stage_tables(vi)
+
+def planting_table(area_name):
+    # bảng tính theo cột, dùng lại cho tới khi crop_data được lưu lại
+    key = (data_version(DATA_FILE), selected_city, area_name, lang)
+    # SQLite backend: rows of the indexed plantings table (location, area) instead of the crop_data document
+    plantings = sqlite_db.plantings(selected_city, area_name) if sqlite_db is not None else areas[area_name]
+    return get_planting_table(key, plantings, crops, stage_tables, crop_names)
 
 if user_type == _("Người điều khiển", "Control Administrator"):
     st.subheader(_("🌿 Quản lý khu vực trồng cây", "🌿 Manage Planting Areas"))
@@ -358,33 +463,13 @@ if user_type == _("Người điều khiển", "Control Administrator"):
     # hiển thị cây trong selected_area
     if selected_area in areas and areas[selected_area]:
         st.subheader(_("Thông tin cây trồng trong khu vực", "Plantings in area"))
-        rows = []
-        for p in areas[selected_area]:
-            crop_k = p["crop"]
-            pd_iso = p.get("planting_date", date.today().isoformat())
-            try:
-                pd_date = date.fromisoformat(pd_iso)
-            except:
-                pd_date = date.today()
-            min_d, max_d = crops.get(crop_k, (0,0))
-            harvest_min = pd_date + timedelta(days=min_d)
-            harvest_max = pd_date + timedelta(days=max_d)
-            days_planted = (date.today() - pd_date).days
-            rows.append({
-                "crop": crop_names.get(crop_k, crop_k),
-                "planting_date": pd_date.strftime("%d/%m/%Y"),
-                "expected_harvest_from": harvest_min.strftime("%d/%m/%Y"),
-                "expected_harvest_to": harvest_max.strftime("%d/%m/%Y"),
-                "days_planted": days_planted,
-                "stage": giai_doan_cay(crop_k, days_planted)
-            })
-        df_plots = pd.DataFrame(rows)
+        df_plots = planting_table(selected_area)
         st.dataframe(df_plots)
     else:
         st.info(_("Khu vực này chưa có cây trồng.", "No crops planted in this area yet."))
 
     # ---- Phần cấu hình ngưỡng độ ẩm cho từng loại cây (chỉ controller) ----
-    moisture_thresholds = config.get("moisture_thresholds", {"Ngô":65, "Chuối":70, "Ớt":65})
+    moisture_thresholds = config.get("moisture_thresholds", catalog.default_thresholds())
     st.markdown(f"<label style='font-size:18px; font-weight:700;'>{_('Đặt ngưỡng độ ẩm cho các loại cây (0-100%)', 'Set moisture thresholds for crops (0-100%)')}</label>", unsafe_allow_html=True)
     cols = st.columns(len(moisture_thresholds))
     i = 0
@@ -401,27 +486,7 @@ elif user_type == _("Người giám sát", " Monitoring Officer"):
     if areas:
         selected_area = st.selectbox(_("Chọn khu vực để xem", "Select area to view"), list(areas.keys()))
         if selected_area in areas and areas[selected_area]:
-            rows = []
-            for p in areas[selected_area]:
-                crop_k = p["crop"]
-                pd_iso = p.get("planting_date", date.today().isoformat())
-                try:
-                    pd_date = date.fromisoformat(pd_iso)
-                except:
-                    pd_date = date.today()
-                min_d, max_d = crops.get(crop_k, (0,0))
-                harvest_min = pd_date + timedelta(days=min_d)
-                harvest_max = pd_date + timedelta(days=max_d)
-                days_planted = (date.today() - pd_date).days
-                rows.append({
-                    "crop": crop_names.get(crop_k, crop_k),
-                    "planting_date": pd_date.strftime("%d/%m/%Y"),
-                    "expected_harvest_from": harvest_min.strftime("%d/%m/%Y"),
-                    "expected_harvest_to": harvest_max.strftime("%d/%m/%Y"),
-                    "days_planted": days_planted,
-                    "stage": giai_doan_cay(crop_k, days_planted)
-                })
-            df_plots = pd.DataFrame(rows)
+            df_plots = planting_table(selected_area)
             st.dataframe(df_plots)
         else:
             st.info(_("Khu vực này chưa có cây trồng.", "No crops planted in this area yet."))
@@ -465,12 +530,17 @@ if user_type == _("Người điều khiển", "Control Administrator"):
         config['last_city'] = selected_city
 
         saved = save_json(CONFIG_FILE, config)
-        ok = send_config_to_esp32(config)
+        result = send_config_to_esp32(config)
         if saved:
-            if ok:
-                st.success(_("Đã lưu cấu hình và gửi tới ESP32.", "Configuration saved and sent to ESP32."))
+            if not result.changed:
+                st.success(_("Đã lưu cấu hình. ESP32 đã có phiên bản mới nhất", "Configuration saved. ESP32 already has the latest version") + f" (v{result.version}).")
+            elif result.acked:
+                st.success(_("Đã lưu cấu hình và gửi tới ESP32 (broker đã xác nhận)", "Configuration saved and sent to ESP32 (acknowledged by broker)") + f": v{result.version}, {', '.join(result.changed)} ({result.payload_size} B).")
+            elif not result.failed:
+                st.info(_("Cấu hình đã lưu, đang chờ gửi tới broker (sẽ tự gửi khi kết nối lại).", "Configuration saved, waiting for broker acknowledgment (sent automatically after reconnect).") + f" v{result.version}")
             else:
-                st.warning(_("Cấu hình đã lưu cục bộ nhưng gửi tới ESP32 thất bại.", "Configuration saved locally but failed to send to ESP32."))
+                errors = ", ".join(h.error for h in result.handles if h.failed)
+                st.warning(_("Cấu hình đã lưu cục bộ nhưng gửi tới ESP32 thất bại.", "Configuration saved locally but failed to send to ESP32.") + f" ({errors})")
         else:
             st.error(_("Lưu cấu hình thất bại.", "Failed to save configuration."))
 
@@ -482,17 +552,19 @@ else:
     st.markdown(_("🔄 Chế độ hoạt động hiện tại:", "🔄 Current operation mode:") + f" **{config.get('mode','auto').capitalize()}**")
 
 # -----------------------
-# Weather (unchanged)
+# Weather (shared cached client: no HTTP call on most reruns)
 # -----------------------
 st.subheader(_("🌦️ Thời tiết hiện tại", "🌦️ Current Weather"))
-weather_url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,relative_humidity_2m,precipitation,precipitation_probability&timezone=auto"
-try:
-    response = requests.get(weather_url, timeout=10)
-    response.raise_for_status()
-    weather_data = response.json()
-    current_weather = weather_data.get("current", {})
-except Exception as e:
-    current_weather = {"temperature_2m": "N/A", "relative_humidity_2m": "N/A", "precipitation": "N/A", "precipitation_probability": "N/A"}
+WEATHER_PARAMS = {
+    "current": "temperature_2m,relative_humidity_2m,precipitation,precipitation_probability",
+    "hourly": "temperature_2m,relative_humidity_2m,precipitation_probability",
+    "timezone": "auto",
+}
+weather_client = get_weather_client()
+# all configured locations are refreshed together in the background, switching city is a cache hit
+weather_client.prefetch(locations.values(), WEATHER_PARAMS)
+weather_data = weather_client.get(latitude, longitude, WEATHER_PARAMS)
+current_weather = (weather_data or {}).get("current") or {"temperature_2m": "N/A", "relative_humidity_2m": "N/A", "precipitation": "N/A", "precipitation_probability": "N/A"}
 
 col1, col2, col3 = st.columns(3)
 col1.markdown(big_label("🌡️ Nhiệt độ", "🌡️ Temperature"), unsafe_allow_html=True)
@@ -509,26 +581,36 @@ col3.metric("", f"{current_weather.get('precipitation_probability', 'N/A')} %")
 # -----------------------
 st.subheader(_("📡 Dữ liệu cảm biến thực tế (ESP32)", "📡 Real sensor data (ESP32)"))
 
-pump_status = "UNKNOWN"
-soil_moisture = None
-
-if sensor_data:
-    soil_moisture = sensor_data.get("soil_moisture")
-    soil_temp = sensor_data.get("soil_temp")
-    light_level = sensor_data.get("light")
-    water_flow = sensor_data.get("water_flow")
-    pump_status = sensor_data.get("pump_status", "OFF")
-
-    st.write(f"- {_('Độ ẩm đất hiện tại', 'Current soil moisture')}: {soil_moisture} %")
-    st.write(f"- {_('Nhiệt độ đất', 'Soil temperature')}: {soil_temp} °C")
-    st.write(f"- {_('Cường độ ánh sáng', 'Light intensity')}: {light_level} lux")
-    st.write(f"- {_('Lưu lượng nước', 'Water flow')}: {water_flow} L/min")
+# device of this location updated last (devices on the legacy topic have no location)
+current_state = latest_state.location(selected_city) or latest_state.location("")
+# moisture from the device that reported it last, not from whichever device reported anything last
+moisture_state = latest_state.field(selected_city, "soil_moisture") or latest_state.field("", "soil_moisture")
+soil_moisture = moisture_state["value"] if moisture_state else None
 
-    # LED pump status
-    led_color = "#00FF00" if str(pump_status).upper() == "ON" else "#555555"
-    st.markdown(f"<div style='display:flex; align-items:center;'><div class='led' style='background-color:{led_color};'></div><strong>{_('Trạng thái bơm', 'Pump status')}: {pump_status}</strong></div>", unsafe_allow_html=True)
-else:
+if current_state is None:
     st.info(_("Chưa có dữ liệu cảm biến thực tế từ ESP32.", "No real sensor data from ESP32 yet."))
+elif current_state["stale"]:
+    st.warning(_("⚠️ Dữ liệu cảm biến đã cũ (lần cuối: {})", "⚠️ Sensor data is stale (last update: {})").format(current_state["timestamp"]))
+# values + pump LED update in place from the push channel; devices on the legacy topic have no location
+if live_hub.error:
+    st.error(_("Bảng trực tiếp không khả dụng: {}", "Live panel unavailable: {}").format(live_hub.error))
+else:
+    components.html(live_panel_html(
+        live_hub, [selected_city, ""],
+        [("soil_moisture", _("Độ ẩm đất hiện tại", "Current soil moisture"), "%"),
+         ("soil_temp", _("Nhiệt độ đất", "Soil temperature"), "°C"),
+         ("light", _("Cường độ ánh sáng", "Light intensity"), "lux"),
+         ("water_flow", _("Lưu lượng nước", "Water flow"), "L/min")],
+        pump_label=_("Trạng thái bơm", "Pump status"),
+    ), height=170)
+
+location_devices = latest_state.devices(selected_city)
+if len(location_devices) > 1:
+    st.dataframe(pd.DataFrame([
+        {"area": d["area"], "device": d["device"], **d["reading"], "pump_status": d["pump_status"],
+         "timestamp": d["timestamp"], "stale": d["stale"]}
+        for d in location_devices
+    ]))
 
 # -----------------------
 # Irrigation control note (web only sends config)
@@ -547,82 +629,161 @@ if config.get('mode','auto') == 'manual':
     st.info(_("🔧 Chế độ thủ công - ESP32 sẽ chờ cấu hình 'manual' và người điều khiển có thể thay đổi ngưỡng/khung giờ từ web.", "🔧 Manual mode - ESP32 will use mode 'manual' and controller may update thresholds/schedule from web."))
 
 # -----------------------
-# Historical charts (read from saved HISTORY_FILE / FLOW_FILE -> already trimmed to 1 year)
+# Historical charts (pre-aggregated rollups: a few hundred points whatever the raw sample rate)
 # -----------------------
 st.header(_("📊 Biểu đồ lịch sử độ ẩm, nhiệt độ, lưu lượng nước", "📊 Historical Charts"))
 
 st.markdown(f"<label style='font-size:18px; font-weight:700;'>{_('Chọn ngày để xem dữ liệu', 'Select date for chart')}</label>", unsafe_allow_html=True)
 chart_date = st.date_input(" ", value=date.today(), key="chart_date", label_visibility="collapsed")
+chart_ranges = {_("1 ngày", "1 day"): 1, _("7 ngày", "7 days"): 7, _("30 ngày", "30 days"): 30, _("90 ngày", "90 days"): 90, _("365 ngày", "365 days"): 365}
+chart_range = st.radio(_("Khoảng thời gian (kết thúc tại ngày đã chọn)", "Range (ending at selected date)"), list(chart_ranges.keys()), horizontal=True, key="chart_range")
+chart_start = chart_date - timedelta(days=chart_ranges[chart_range] - 1)
+
+def columns_as_points(df_raw, time_col, fields):
+    # raw samples in the same shape as rollup points (mean = min = max = value)
+    out = pd.DataFrame({"time": df_raw[time_col]})
+    for f in fields:
+        out[f"{f}_mean"] = out[f"{f}_min"] = out[f"{f}_max"] = df_raw[f]
+    return out
 
-history_data = load_json(HISTORY_FILE, []) or []
-flow_data = load_json(FLOW_FILE, []) or []
-
-if len(history_data) == 0 or len(flow_data) == 0:
-    st.info(_("📋 Chưa có dữ liệu lịch sử để hiển thị.", "📋 No historical data to display."))
-else:
-    df_hist_all = pd.DataFrame(history_data)
-    if 'timestamp' in df_hist_all.columns:
-        df_hist_all['timestamp'] = pd.to_datetime(df_hist_all['timestamp'], errors='coerce')
-        df_hist_all = df_hist_all.dropna(subset=['timestamp'])
-        df_hist_all['date'] = df_hist_all['timestamp'].dt.date
-        df_day = df_hist_all[df_hist_all['date'] == chart_date]
+def render_history_chart(df_day):
+    import matplotlib.pyplot as plt
+    df_day = df_day.copy()
+    df_day['time'] = pd.to_datetime(df_day['time'])
+    fig, ax1 = plt.subplots(figsize=(12, 5))
+    ax1.plot(df_day['time'], df_day['sensor_hum_mean'], label=_("Độ ẩm đất", "Soil Humidity"))
+    # dải min-max giữ lại đỉnh / đáy trong mỗi bucket
+    ax1.fill_between(df_day['time'], df_day['sensor_hum_min'], df_day['sensor_hum_max'], alpha=0.2)
+    ax1.set_xlabel(_("Thời gian", "Time"))
+    ax1.set_ylabel(_("Độ ẩm đất (%)", "Soil Humidity (%)"))
+    ax2 = ax1.twinx()
+    if 'sensor_temp_mean' in df_day.columns:
+        ax2.plot(df_day['time'], df_day['sensor_temp_mean'], color='tab:orange', label=_("Nhiệt độ", "Temperature"))
+    ax2.set_ylabel(_("Nhiệt độ (°C)", "Temperature (°C)"))
+    ax1.legend(loc='upper left')
+    ax2.legend(loc='upper right')
+    plt.title(_("Lịch sử độ ẩm đất và nhiệt độ", "Soil Humidity and Temperature History"))
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    return fig
+
+def render_flow_chart(df_flow_day):
+    import matplotlib.pyplot as plt
+    df_flow_day = df_flow_day.copy()
+    df_flow_day['time'] = pd.to_datetime(df_flow_day['time'])
+    fig2, ax3 = plt.subplots(figsize=(12, 3))
+    ax3.plot(df_flow_day['time'], df_flow_day['flow_mean'], label=_("Lưu lượng nước (L/min)", "Water Flow (L/min)"))
+    ax3.fill_between(df_flow_day['time'], df_flow_day['flow_min'], df_flow_day['flow_max'], alpha=0.2)
+    ax3.set_xlabel(_("Thời gian", "Time"))
+    ax3.set_ylabel(_("Lưu lượng nước (L/min)", "Water Flow (L/min)"))
+    ax3.legend()
+    plt.title(_("Lịch sử lưu lượng nước", "Water Flow History"))
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    return fig2
+
+def load_chart_frames():
+    if history_columns is not None and chart_ranges[chart_range] == 1:
+        # one day from the columnar backend: memory-mapped slice, LTTB-reduced to about the chart width
+        df_raw = downsample_frame(history_columns.to_frame(chart_date), "timestamp", ["sensor_hum", "sensor_temp"])
+        df_flow_raw = downsample_frame(flow_columns.to_frame(chart_date), "time", ["flow"])
+        df_day = columns_as_points(df_raw, "timestamp", ["sensor_hum", "sensor_temp"])
+        df_flow_day = columns_as_points(df_flow_raw, "time", ["flow"])
     else:
+        df_day = pd.DataFrame(history_rollups.query(chart_start, chart_date))
+        df_flow_day = pd.DataFrame(flow_rollups.query(chart_start, chart_date))
+    if not df_day.empty and 'sensor_hum_mean' not in df_day.columns:
         df_day = pd.DataFrame()
-
-    df_flow_all = pd.DataFrame(flow_data)
-    if 'time' in df_flow_all.columns:
-        df_flow_all['time'] = pd.to_datetime(df_flow_all['time'], errors='coerce')
-        df_flow_all = df_flow_all.dropna(subset=['time'])
-        df_flow_all['date'] = df_flow_all['time'].dt.date
-        df_flow_day = df_flow_all[df_flow_all['date'] == chart_date]
-    else:
-        df_flow_day = pd.DataFrame()
-
-    if df_day.empty and df_flow_day.empty:
-        st.info(_("📋 Không có dữ liệu trong ngày này.", "📋 No data for selected date."))
-    else:
-        import matplotlib.pyplot as plt
-        if not df_day.empty:
-            fig, ax1 = plt.subplots(figsize=(12, 5))
-            ax1.plot(pd.to_datetime(df_day['timestamp']), df_day['sensor_hum'], label=_("Độ ẩm đất", "Soil Humidity"))
-            ax1.set_xlabel(_("Thời gian", "Time"))
-            ax1.set_ylabel(_("Độ ẩm đất (%)", "Soil Humidity (%)"))
-            ax2 = ax1.twinx()
-            ax2.plot(pd.to_datetime(df_day['timestamp']), df_day['sensor_temp'], label=_("Nhiệt độ", "Temperature"))
-            ax2.set_ylabel(_("Nhiệt độ (°C)", "Temperature (°C)"))
-            ax1.legend(loc='upper left')
-            ax2.legend(loc='upper right')
-            plt.title(_("Lịch sử độ ẩm đất và nhiệt độ", "Soil Humidity and Temperature History"))
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            st.pyplot(fig)
-
-        if not df_flow_day.empty:
-            fig2, ax3 = plt.subplots(figsize=(12, 3))
-            ax3.plot(pd.to_datetime(df_flow_day['time']), df_flow_day['flow'], label=_("Lưu lượng nước (L/min)", "Water Flow (L/min)"))
-            ax3.set_xlabel(_("Thời gian", "Time"))
-            ax3.set_ylabel(_("Lưu lượng nước (L/min)", "Water Flow (L/min)"))
-            ax3.legend()
-            plt.title(_("Lịch sử lưu lượng nước", "Water Flow History"))
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            st.pyplot(fig2)
+    return df_day, df_flow_day
+
+# PNG cache: key = (chart, range, backend, language, data version of the days in range); the version only
+# changes when ingestion flushes samples for one of those days, so past ranges are served from memory
+chart_resolution = "raw" if history_columns is not None and chart_ranges[chart_range] == 1 else "rollup"
+hist_key = ("history", chart_start.isoformat(), chart_date.isoformat(), chart_resolution, lang,
+            data_versions.version("history", chart_start, chart_date))
+flow_key = ("flow", chart_start.isoformat(), chart_date.isoformat(), chart_resolution, lang,
+            data_versions.version("flow", chart_start, chart_date))
+hist_png = chart_cache.get(hist_key)
+flow_png = chart_cache.get(flow_key)
+if hist_png is None or flow_png is None:
+    df_day, df_flow_day = load_chart_frames()
+    if hist_png is None and not df_day.empty:
+        hist_png = chart_cache.get_or_render(hist_key, lambda: render_history_chart(df_day))
+    if flow_png is None and not df_flow_day.empty:
+        flow_png = chart_cache.get_or_render(flow_key, lambda: render_flow_chart(df_flow_day))
+
+if hist_png is None and flow_png is None:
+    st.info(_("📋 Không có dữ liệu trong khoảng thời gian này.", "📋 No data for selected range."))
+else:
+    if hist_png is not None:
+        st.image(hist_png)
+    if flow_png is not None:
+        st.image(flow_png)
 
 # -----------------------
 # Irrigation history table
 # -----------------------
 st.header(_("📅 Lịch sử tưới nước", "📅 Irrigation History"))
 
-history = load_json(HISTORY_FILE, []) or []
-if history:
-    df_hist = pd.DataFrame(history)
-    if 'timestamp' in df_hist.columns:
-        df_hist['timestamp'] = pd.to_datetime(df_hist['timestamp'], errors='coerce')
-    df_hist = df_hist.sort_values(by='timestamp', ascending=False)
-    st.dataframe(df_hist)
+def _next_history_page(step):
+    st.session_state["irrigation_history_page"] = max(st.session_state.get("irrigation_history_page", 0) + step, 0)
+
+# filters / sort are applied on the event stream and only one page is fetched per rerun
+today = datetime.now(vn_tz).date()
+col_loc, col_range, col_order = st.columns([1, 2, 1])
+with col_loc:
+    all_locations = _("Tất cả", "All")
+    history_location = st.selectbox(_("Địa điểm", "Location"), [all_locations] + location_display_names, key="irrigation_history_location")
+with col_range:
+    history_range = st.date_input(_("Khoảng ngày", "Date range"), value=(today - timedelta(days=30), today), key="irrigation_history_range")
+with col_order:
+    newest_first = st.selectbox(_("Sắp xếp", "Sort"), [_("Mới nhất trước", "Newest first"), _("Cũ nhất trước", "Oldest first")], key="irrigation_history_order") == _("Mới nhất trước", "Newest first")
+history_location = None if history_location == all_locations else history_location
+# a range is a 1-tuple while the second day is being picked
+history_start, history_end = (tuple(history_range) + (today,))[:2] if history_range else (None, None)
+
+history_filters = (history_location, history_start, history_end, newest_first)
+if st.session_state.get("irrigation_history_filters") != history_filters:
+    st.session_state["irrigation_history_filters"] = history_filters
+    st.session_state["irrigation_history_page"] = 0
+history_page = st.session_state.get("irrigation_history_page", 0)
+
+def _history_page(page):
+    return irrigation_events.page(
+        "actions", history_location,
+        start=history_start.isoformat() if history_start else None,
+        end=(history_end + timedelta(days=1)).isoformat() if history_end else None,
+        newest_first=newest_first, offset=page * HISTORY_PAGE_ROWS, limit=HISTORY_PAGE_ROWS,
+    )
+
+page_rows, page_total = _history_page(history_page)
+history_pages = max((page_total + HISTORY_PAGE_ROWS - 1) // HISTORY_PAGE_ROWS, 1)
+if history_page >= history_pages:
+    # the stored page outlived the data (retention, another session's filters): show the last page
+    history_page = st.session_state["irrigation_history_page"] = history_pages - 1
+    page_rows, page_total = _history_page(history_page)
+if page_total:
+    df_hist = pd.DataFrame(page_rows).drop(columns=["type"], errors="ignore")
+    df_hist['timestamp'] = pd.to_datetime(df_hist['timestamp'], errors='coerce')
+    st.dataframe(df_hist.dropna(axis=1, how='all'))
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    col_prev.button(_("◀ Trang trước", "◀ Previous"), key="irrigation_history_prev", disabled=history_page == 0, on_click=_next_history_page, args=(-1,))
+    col_info.caption(_("Trang {} / {} ({} bản ghi)", "Page {} / {} ({} records)").format(history_page + 1, history_pages, page_total))
+    col_next.button(_("Trang sau ▶", "Next ▶"), key="irrigation_history_next", disabled=history_page + 1 >= history_pages, on_click=_next_history_page, args=(1,))
 else:
     st.info(_("Chưa có lịch sử tưới.", "No irrigation history."))
 
+with st.expander(_("📈 Mẫu cảm biến gần nhất", "📈 Latest sensor samples")):
+    history_snapshot = history_frame.snapshot()
+    if len(history_snapshot):
+        # only the newest rows are materialized, cost does not grow with the history length
+        df_samples = history_snapshot.to_frame(max(len(history_snapshot) - HISTORY_TABLE_ROWS, 0))
+        df_samples = df_samples.dropna(axis=1, how='all').sort_values(by='timestamp', ascending=False)
+        st.dataframe(df_samples)
+        st.caption(_("Hiển thị {} / {} bản ghi mới nhất", "Showing latest {} of {} records").format(len(df_samples), len(history_snapshot)))
+    else:
+        st.info(_("Chưa có dữ liệu cảm biến.", "No sensor data yet."))
+
 # -----------------------
 # Footer
 # -----------------------
@@ -1,21 +1,39 @@
 # web_esp.py
 import streamlit as st
+import streamlit.components.v1 as components
 from datetime import datetime, timedelta, date, time
+import functools
 import json
 import os
 import pytz
 import pandas as pd
-import threading
+import matplotlib.pyplot as plt
+from collections import deque
 import random
 from PIL import Image
 import requests
 import paho.mqtt.client as mqtt
-from streamlit_autorefresh import st_autorefresh
+from timeseries_store import get_store
+from ingest_service import get_service
+from ingest_pipeline import get_pipeline
+from write_buffer import get_buffer
+from retention import get_retention_job, merge_policy
+from ts_index import get_time_index
+from topic_routing import get_router, wildcard
+from downsample import downsample_frame
+from chart_cache import get_chart_cache
+from file_utils import file_version
+from planting_table import get_planting_table
+from crop_catalog import get_catalog
+from sqlite_store import get_sqlite_backend
+from irrigation_events import get_irrigation_events
+from live_push import get_live_hub, live_panel_html, live_payload
+from latest_state import LatestStore, get_latest_store
+from irrigation_engine import EngineView, get_irrigation_engine
 # -----------------------
 # Config & helpers
 # -----------------------
 st.set_page_config(page_title="Smart Irrigation WebApp", layout="wide")
-st_autorefresh(interval=60 * 1000, key="init_refresh")
 
 # --- I18N ---
 lang = st.sidebar.selectbox("🌐 Language / Ngôn ngữ", ["Tiếng Việt", "English"])
@@ -25,11 +43,24 @@ def _(vi_text, en_text):
 
 # Files
 DATA_FILE = "crop_data.json"
-HISTORY_FILE = "history_irrigation.json"
-FLOW_FILE = "flow_data.json"  # lưu dữ liệu lưu lượng (esp32) theo thời gian
+HISTORY_FILE = "history_irrigation.json"  # file cũ: mẫu cảm biến -> history_irrigation/*.jsonl, phiên tưới -> irrigation_events/*.jsonl
+FLOW_FILE = "flow_data.json"  # file cũ, lưu lượng (esp32) được chuyển sang flow_data/*.jsonl
 CONFIG_FILE = "config.json"   # lưu cấu hình chung: khung giờ tưới + chế độ
+ENGINE_STATUS_FILE = "irrigation_status.json"  # quyết định tưới mới nhất của bộ máy (đọc được từ tiến trình khác)
+ENGINE_HOLDS_FILE = "irrigation_holds.json"    # yêu cầu dừng tưới gửi tới bộ máy chạy ở tiến trình riêng
+
+# SQLite (WAL) tùy chọn: IRRIGATION_STORAGE=sqlite lưu tài liệu JSON, dữ liệu cảm biến và cây trồng trong
+# irrigation.db (biểu đồ lịch sử / bảng cây trồng đọc qua bảng có chỉ mục); các file JSON hiện có được nhập ở lần
+# đọc đầu tiên
+STORAGE_BACKEND = os.environ.get("IRRIGATION_STORAGE", "json")
+# IRRIGATION_ENGINE=external: MQTT + bộ máy tưới chạy ở tiến trình riêng (python irrigation_engine.py, cùng thư
+# mục dữ liệu); trang không mở client MQTT / bộ máy của mình, chỉ đọc trạng thái và gửi yêu cầu dừng tưới qua file
+EMBEDDED_ENGINE = os.environ.get("IRRIGATION_ENGINE", "embedded") != "external"
+sqlite_db = get_sqlite_backend("irrigation.db") if STORAGE_BACKEND == "sqlite" else None
 
 def load_json(path, default):
+    if sqlite_db is not None:
+        return sqlite_db.load_doc(os.path.basename(path), default, import_from=path)
     if os.path.exists(path):
         try:
             with open(path, "r", encoding="utf-8") as f:
@@ -40,58 +71,107 @@ def load_json(path, default):
         return default
 
 def save_json(path, data):
+    if sqlite_db is not None:
+        sqlite_db.save_doc(os.path.basename(path), data)
+        return
     with open(path, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
+def data_version(path):
+    # thay đổi sau mỗi lần save_json(path, ...), dùng làm khóa cache
+    if sqlite_db is not None:
+        return sqlite_db.doc_version(os.path.basename(path))
+    return file_version(path)
+
 # Timezone
 vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
 
-# Hàm thêm record lưu lượng vào flow_data
-def add_flow_record(flow_val, location=""):
-    now_iso = datetime.now(vn_tz).isoformat()
-    new_record = {
-        "time": now_iso,
-        "flow": flow_val,
-        "location": location,
-    }
-    flow = load_json(FLOW_FILE, [])
-    flow.append(new_record)
-    save_json(FLOW_FILE, flow)
-
-# Hàm thêm record cảm biến vào history
-def add_history_record(sensor_hum, sensor_temp, location=""):
-    now_iso = datetime.now(vn_tz).isoformat()
-    new_record = {
-        "timestamp": now_iso,
-        "sensor_hum": sensor_hum,
-        "sensor_temp": sensor_temp,
-        "location": location,
-    }
-    history = load_json(HISTORY_FILE, [])
-    history.append(new_record)
-    save_json(HISTORY_FILE, history)
-
-# Hàm chuyển list dict lịch sử thành DataFrame và sắp xếp theo thời gian
-def to_df(lst):
-    if not lst:
-        return pd.DataFrame()
-    df = pd.DataFrame(lst)
-    time_col = "timestamp" if "timestamp" in df.columns else ("time" if "time" in df.columns else None)
-    if time_col:
-        df[time_col] = pd.to_datetime(df[time_col], errors='coerce')
-        df = df.dropna(subset=[time_col])
-        df = df.sort_values(by=time_col)
-        df = df.reset_index(drop=True)
-    return df
+# Lịch sử cảm biến / lưu lượng: mỗi ngày một segment, ghi thêm O(1)
+history_store = get_store(os.path.splitext(HISTORY_FILE)[0], time_key="timestamp", legacy_file=HISTORY_FILE)
+flow_store = get_store(os.path.splitext(FLOW_FILE)[0], time_key="time", legacy_file=FLOW_FILE)
+# phiên tưới (start / end) là luồng sự kiện riêng, có chỉ mục phiên đang mở theo khu vực;
+# history_irrigation.json cũ (hoặc tài liệu cùng tên trong SQLite) được nhập một lần
+irrigation_events = get_irrigation_events(
+    "irrigation_events", sessions_file=HISTORY_FILE,
+    legacy_sessions=(lambda: sqlite_db.load_doc(HISTORY_FILE, [])) if sqlite_db is not None else None)
+HISTORY_PAGE_ROWS = 50  # số phiên tưới mỗi trang của bảng lịch sử
+# bản sao vào bảng SQLite có chỉ mục (location, device, ts) qua cùng bộ đệm ghi trễ
+history_sink = sqlite_db.sink("history", "timestamp") if sqlite_db is not None else None
+flow_sink = sqlite_db.sink("flow", "time") if sqlite_db is not None else None
+# Chỉ mục (khu vực, thời gian) -> vị trí bản ghi, truy vấn theo khu vực không phải quét toàn bộ lịch sử
+history_index = get_time_index(history_store)
+flow_index = get_time_index(flow_store)
+# ảnh PNG của biểu đồ lịch sử, hết hạn theo phiên bản dữ liệu của khu vực đang xem (chỉ mục thời gian)
+chart_cache = get_chart_cache()
+HISTORY_CHART_DAYS = 7  # biểu đồ lịch sử chỉ vẽ (và chỉ đọc) số ngày gần nhất này
+# Ghi trễ theo lô: mẫu nằm trong bộ nhớ tối đa HISTORY_FLUSH_SECONDS giây trước khi ghi xuống đĩa
+HISTORY_FLUSH_SECONDS = 2.0
+HISTORY_FLUSH_BATCH = 200
+sample_buffer = get_buffer("web_tuoi_tieu", batch_size=HISTORY_FLUSH_BATCH, flush_interval=HISTORY_FLUSH_SECONDS)
+
+
+# Bảng lịch sử tưới theo trang: lọc khu vực / ngày và sắp xếp ngay trên luồng sự kiện, mỗi lần chỉ lấy một trang
+def _next_history_page(key, step):
+    st.session_state[f"{key}_page"] = max(st.session_state.get(f"{key}_page", 0) + step, 0)
+
+def show_irrigation_history(location, key):
+    today = datetime.now(vn_tz).date()
+    col_range, col_order = st.columns([2, 1])
+    with col_range:
+        date_range = st.date_input(_("Khoảng ngày", "Date range"), value=(today - timedelta(days=30), today), key=f"{key}_range")
+    with col_order:
+        newest_first = st.selectbox(_("Sắp xếp", "Sort"), [_("Mới nhất trước", "Newest first"), _("Cũ nhất trước", "Oldest first")], key=f"{key}_order") == _("Mới nhất trước", "Newest first")
+    start_day, end_day = (tuple(date_range) + (today,))[:2] if date_range else (None, None)
+    # đổi bộ lọc thì quay về trang đầu
+    filters = (location, start_day, end_day, newest_first)
+    if st.session_state.get(f"{key}_filters") != filters:
+        st.session_state[f"{key}_filters"] = filters
+        st.session_state[f"{key}_page"] = 0
+    page = st.session_state.get(f"{key}_page", 0)
+
+    def fetch(page):
+        return irrigation_events.page(
+            "sessions", location,
+            start=start_day.isoformat() if start_day else None,
+            end=(end_day + timedelta(days=1)).isoformat() if end_day else None,
+            newest_first=newest_first, offset=page * HISTORY_PAGE_ROWS, limit=HISTORY_PAGE_ROWS,
+        )
+
+    rows, total = fetch(page)
+    pages = max((total + HISTORY_PAGE_ROWS - 1) // HISTORY_PAGE_ROWS, 1)
+    if page >= pages:
+        # trang đã lưu vượt quá dữ liệu hiện có (dữ liệu hết hạn, ...): hiển thị trang cuối
+        page = st.session_state[f"{key}_page"] = pages - 1
+        rows, total = fetch(page)
+    if not total:
+        st.info(_("Chưa có lịch sử tưới cho khu vực này.", "No irrigation history for this location."))
+        return
+    df_irrig = pd.DataFrame(rows).drop(columns=["session_id"], errors="ignore")
+    df_irrig["start_time"] = pd.to_datetime(df_irrig["start_time"])
+    df_irrig["end_time"] = pd.to_datetime(df_irrig["end_time"])
+    st.dataframe(df_irrig)
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    col_prev.button(_("◀ Trang trước", "◀ Previous"), key=f"{key}_prev", disabled=page == 0, on_click=_next_history_page, args=(key, -1))
+    col_info.caption(_("Trang {} / {} ({} phiên)", "Page {} / {} ({} sessions)").format(page + 1, pages, total))
+    col_next.button(_("Trang sau ▶", "Next ▶"), key=f"{key}_next", disabled=page + 1 >= pages, on_click=_next_history_page, args=(key, 1))
 
 # -----------------------
 # Load persistent data
 # -----------------------
 crop_data = load_json(DATA_FILE, {})
-history_data = load_json(HISTORY_FILE, [])
-flow_data = load_json(FLOW_FILE, [])
 config = load_json(CONFIG_FILE, {"watering_schedule": "06:00-08:00", "mode": "auto"})
 
+# Giới hạn thời gian lưu trữ theo từng luồng dữ liệu, chạy nền (không cắt khi ghi)
+retention_policy = merge_policy(config.get("retention"))
+retention_job = get_retention_job()
+retention_job.add_store("tuoi_tieu_history", history_store, retention_policy["history"]["days"], retention_policy["history"]["archive"])
+retention_job.add_store("tuoi_tieu_flow", flow_store, retention_policy["flow"]["days"], retention_policy["flow"]["archive"])
+retention_job.add_store("tuoi_tieu_irrigation", irrigation_events, retention_policy["irrigation"]["days"])
+if sqlite_db is not None:
+    # bảng readings trong SQLite theo cùng chính sách (DELETE các dòng hết hạn)
+    retention_job.add_store("tuoi_tieu_history_sqlite", history_sink, retention_policy["history"]["days"])
+    retention_job.add_store("tuoi_tieu_flow_sqlite", flow_sink, retention_policy["flow"]["days"])
+
 # -----------------------
 # UI - Header & Logo
 # -----------------------
@@ -116,6 +196,8 @@ st.markdown(f"<h3>⏰ { _('Thời gian hiện tại', 'Current time') }: {now.st
 # -----------------------
 st.sidebar.title(_("🔐 Chọn vai trò người dùng", "🔐 Select User Role"))
 user_type = st.sidebar.radio(_("Bạn là:", "You are:"), [_("Người điều khiển", "Control Administrator"), _("Người giám sát", " Monitoring Officer")])
+# số liệu trực tiếp được đẩy tới trình duyệt (live_hub) và việc tưới tự động chạy nền (irrigation_engine),
+# không cần tự làm mới cả trang
 
 if user_type == _("Người điều khiển", "Control Administrator"):
     password = st.sidebar.text_input(_("🔑 Nhập mật khẩu:", "🔑 Enter password:"), type="password")
@@ -124,6 +206,8 @@ if user_type == _("Người điều khiển", "Control Administrator"):
         st.stop()
     else:
         st.sidebar.success(_("✅ Xác thực thành công.", "✅ Authentication successful."))
+        with st.sidebar.expander(_("📥 Trạng thái ghi dữ liệu", "📥 Ingestion status")):
+            st.json(sample_buffer.stats())
 
 # -----------------------
 # Locations & crops
@@ -148,14 +232,18 @@ location_display_names = [location_names[k] for k in locations.keys()]
 selected_city_display = st.selectbox(_("📍 Chọn địa điểm:", "📍 Select location:"), location_display_names)
 selected_city = next(k for k, v in location_names.items() if v == selected_city_display)
 latitude, longitude = locations[selected_city]
-
-crops = {
-    "Ngô": (75, 100),
-    "Chuối": (270, 365),
-    "Ớt": (70, 90),
-}
-required_soil_moisture = {"Ngô": 65, "Chuối": 70, "Ớt": 65}
-crop_names = {"Ngô": _("Ngô", "Corn"), "Chuối": _("Chuối", "Banana"), "Ớt": _("Ớt", "Chili pepper")}
+# khu vực của thiết bị cũ trên esp32/soil_moisture, esp32/water_flow (topic không mang khu vực):
+# IRRIGATION_LEGACY_LOCATION, "legacy_location" trong config, khu vực duy nhất của crop_data, hoặc khu vực mặc định
+# của trang (bản cũ gán cho khu vực đang chọn, mặc định là khu vực đầu tiên)
+LEGACY_LOCATION = (os.environ.get("IRRIGATION_LEGACY_LOCATION") or config.get("legacy_location")
+                   or (next(iter(crop_data)) if len(crop_data) == 1 else next(iter(locations))))
+
+# danh mục cây trồng dùng chung (crop_catalog.json), nạp một lần cho cả tiến trình
+catalog = get_catalog()
+crops = catalog.harvest_windows()
+required_soil_moisture = catalog.default_thresholds()
+crop_names = catalog.names(lang == "Tiếng Việt")
+stage_tables = catalog.stage_tables(lang == "Tiếng Việt")
 
 # -----------------------
 # Crop management
@@ -197,76 +285,24 @@ if user_type == _("Người giám sát", " Monitoring Officer"):
     st.subheader(_("Thông tin cây trồng tại khu vực", "Plantings at this location"))
     if selected_city in crop_data and crop_data[selected_city].get("plots"):
         plots = crop_data[selected_city]["plots"]
-        rows = []
-        for p in plots:
-            crop_k = p["crop"]
-            pd_iso = p["planting_date"]
-            try:
-                pd_date = date.fromisoformat(pd_iso)
-            except:
-                pd_date = date.today()
-            min_d, max_d = crops[crop_k]
-            harvest_min = pd_date + timedelta(days=min_d)
-            harvest_max = pd_date + timedelta(days=max_d)
-            days_planted = (date.today() - pd_date).days
-            def giai_doan_cay(crop, days):
-                if crop == "Chuối":
-                    if days <= 14: return _("🌱 Mới trồng", "🌱 Newly planted")
-                    elif days <= 180: return _("🌿 Phát triển", "🌿 Growing")
-                    elif days <= 330: return _("🌼 Ra hoa", "🌼 Flowering")
-                    else: return _("🍌 Đã thu hoạch", "🍌 Harvested")
-                elif crop == "Ngô":
-                    if days <= 25: return _("🌱 Mới trồng", "🌱 Newly planted")
-                    elif days <= 70: return _("🌿 Thụ phấn", "🌿 Pollination")
-                    elif days <= 100: return _("🌼 Trái phát triển", "🌼 Kernel growth")
-                    else: return _("🌽 Đã thu hoạch", "🌽 Harvested")
-                elif crop == "Ớt":
-                    if days <= 20: return _("🌱 Mới trồng", "🌱 Newly planted")
-                    elif days <= 500: return _("🌼 Ra hoa", "🌼 Flowering")
-                    else: return _("🌶️ Đã thu hoạch", "🌶️ Harvested")
-            rows.append({
-                "crop": crop_names[crop_k],
-                "planting_date": pd_date.strftime("%d/%m/%Y"),
-                "expected_harvest_from": harvest_min.strftime("%d/%m/%Y"),
-                "expected_harvest_to": harvest_max.strftime("%d/%m/%Y"),
-                "days_planted": days_planted,
-                "stage": giai_doan_cay(crop_k, days_planted)
-            })
-        df_plots = pd.DataFrame(rows)
+        if sqlite_db is not None:
+            # bảng plantings có chỉ mục (location, area) thay cho tài liệu crop_data
+            plots = sqlite_db.plantings(selected_city, "")
+        # bảng tính theo cột (searchsorted trên mốc giai đoạn), dùng lại cho tới khi crop_data được lưu lại
+        df_plots = get_planting_table((data_version(DATA_FILE), selected_city, lang), plots, crops, stage_tables, crop_names)
         st.dataframe(df_plots)
     else:
         st.info(_("📍 Chưa có thông tin gieo trồng tại khu vực này.", "📍 No crop information available in this location."))
 
     # 3. Hiển thị lịch sử tưới
     st.subheader(_("📜 Lịch sử tưới nước", "📜 Irrigation History"))
-    irrigation_hist = load_json(HISTORY_FILE, [])
-    filtered_irrigation = [r for r in irrigation_hist if r.get("location") == selected_city]
-    if filtered_irrigation:
-        df_irrig = pd.DataFrame(filtered_irrigation)
-        if "start_time" in df_irrig.columns:
-            df_irrig["start_time"] = pd.to_datetime(df_irrig["start_time"])
-        if "end_time" in df_irrig.columns:
-            df_irrig["end_time"] = pd.to_datetime(df_irrig["end_time"])
-        st.dataframe(df_irrig.sort_values(by="start_time", ascending=False))
-    else:
-        st.info(_("Chưa có lịch sử tưới cho khu vực này.", "No irrigation history for this location."))
+    # chỉ đọc một trang phiên tưới của khu vực (luồng sự kiện riêng, không đụng tới mẫu cảm biến)
+    show_irrigation_history(selected_city, "irrigation_history_monitor")
 
     # 4. Biểu đồ lịch sử độ ẩm đất và lưu lượng nước
     st.header(_("📊 Biểu đồ lịch sử cảm biến", "📊 Sensor History Charts"))
 
-    history_data = load_json(HISTORY_FILE, [])
-    flow_data = load_json(FLOW_FILE, [])
-
-    # Lọc dữ liệu lịch sử và lưu lượng theo khu vực
-    filtered_hist = [h for h in history_data if h.get("location") == selected_city]
-    filtered_flow = [f for f in flow_data if f.get("location") == selected_city]
-
-    df_hist_all = pd.DataFrame(filtered_hist)
-    df_flow_all = pd.DataFrame(filtered_flow)
-
-    # Biểu đồ độ ẩm đất và nhiệt độ
-    if not df_hist_all.empty and 'timestamp' in df_hist_all.columns:
-        df_hist_all['timestamp'] = pd.to_datetime(df_hist_all['timestamp'], errors='coerce')
+    def render_hist_chart(df_hist_all):
         fig, ax1 = plt.subplots(figsize=(12, 5))
         ax1.plot(df_hist_all['timestamp'], df_hist_all['sensor_hum'], 'b-', label=_("Độ ẩm đất", "Soil Humidity"))
         ax1.set_xlabel(_("Thời gian", "Time"))
@@ -283,13 +319,9 @@ if user_type == _("Người giám sát", " Monitoring Officer"):
         plt.title(_("Lịch sử độ ẩm đất và nhiệt độ", "Soil Humidity and Temperature History"))
         plt.xticks(rotation=45)
         plt.tight_layout()
-        st.pyplot(fig)
-    else:
-        st.info(_("Chưa có dữ liệu cảm biến cho khu vực này.", "No sensor data for this location."))
+        return fig
 
-    # Biểu đồ lưu lượng nước
-    if not df_flow_all.empty and 'time' in df_flow_all.columns:
-        df_flow_all['time'] = pd.to_datetime(df_flow_all['time'], errors='coerce')
+    def render_flow_chart(df_flow_all):
         fig2, ax3 = plt.subplots(figsize=(12, 3))
         ax3.plot(df_flow_all['time'], df_flow_all['flow'], 'g-', label=_("Lưu lượng nước (L/min)", "Water Flow (L/min)"))
         ax3.set_xlabel(_("Thời gian", "Time"))
@@ -299,7 +331,47 @@ if user_type == _("Người giám sát", " Monitoring Officer"):
         plt.title(_("Lịch sử lưu lượng nước", "Water Flow History"))
         plt.xticks(rotation=45)
         plt.tight_layout()
-        st.pyplot(fig2)
+        return fig2
+
+    # Ảnh biểu đồ lấy từ cache khi khu vực này chưa có dữ liệu mới trong khoảng vẽ (phiên bản theo khu vực,
+    # mẫu của khu vực khác không làm mất cache)
+    chart_start = (datetime.now(vn_tz) - timedelta(days=HISTORY_CHART_DAYS - 1)).date().isoformat()
+    hist_key = ("tuoi_tieu_history", selected_city, lang, chart_start, history_index.version(selected_city, start=chart_start))
+    flow_key = ("tuoi_tieu_flow", selected_city, lang, chart_start, flow_index.version(selected_city, start=chart_start))
+    hist_png = chart_cache.get(hist_key)
+    flow_png = chart_cache.get(flow_key)
+
+    # Biểu đồ độ ẩm đất và nhiệt độ
+    if hist_png is None:
+        # Lấy dữ liệu lịch sử của khu vực qua chỉ mục (chỉ đọc các bản ghi của khu vực này trong khoảng vẽ)
+        if sqlite_db is not None:
+            df_hist_all = pd.DataFrame(sqlite_db.readings("history", location=selected_city, start=chart_start))
+        else:
+            df_hist_all = pd.DataFrame(history_index.query(selected_city, start=chart_start))
+        if not df_hist_all.empty and 'timestamp' in df_hist_all.columns:
+            df_hist_all['timestamp'] = pd.to_datetime(df_hist_all['timestamp'], errors='coerce')
+            df_hist_all = df_hist_all.dropna(subset=['timestamp'])
+            # giảm còn ~độ rộng biểu đồ, giữ nguyên đỉnh / đáy của từng khoảng (min/max bucketing)
+            df_hist_all = downsample_frame(df_hist_all, 'timestamp', ['sensor_hum', 'sensor_temp'], method="minmax")
+            hist_png = chart_cache.get_or_render(hist_key, lambda: render_hist_chart(df_hist_all))
+    if hist_png is not None:
+        st.image(hist_png)
+    else:
+        st.info(_("Chưa có dữ liệu cảm biến cho khu vực này.", "No sensor data for this location."))
+
+    # Biểu đồ lưu lượng nước
+    if flow_png is None:
+        if sqlite_db is not None:
+            df_flow_all = pd.DataFrame(sqlite_db.readings("flow", location=selected_city, start=chart_start))
+        else:
+            df_flow_all = pd.DataFrame(flow_index.query(selected_city, start=chart_start))
+        if not df_flow_all.empty and 'time' in df_flow_all.columns:
+            df_flow_all['time'] = pd.to_datetime(df_flow_all['time'], errors='coerce')
+            df_flow_all = df_flow_all.dropna(subset=['time'])
+            df_flow_all = downsample_frame(df_flow_all, 'time', ['flow'], method="minmax")
+            flow_png = chart_cache.get_or_render(flow_key, lambda: render_flow_chart(df_flow_all))
+    if flow_png is not None:
+        st.image(flow_png)
     else:
         st.info(_("Chưa có dữ liệu lưu lượng nước cho khu vực này.", "No water flow data for this location."))
 
@@ -360,83 +432,154 @@ else:
         elif manual_type_display == _("Thủ công ở tủ điện", "Manual on cabinet") or manual_type_display == "Manual on cabinet":
             st.markdown(_("⚙️ Phương thức thủ công: Thủ công ở tủ điện", "⚙️ Manual method: Manual on cabinet"))
 
-# Kiểm tra thời gian trong khung tưới
-def is_in_watering_time():
-    now_time = datetime.now(vn_tz).time()
-    start_str, end_str = config["watering_schedule"].split("-")
-    start_t = datetime.strptime(start_str, "%H:%M").time()
-    end_t = datetime.strptime(end_str, "%H:%M").time()
-    if start_t <= now_time <= end_t:
-        return True
-    return False
 
 # -----------------------
 # MQTT Client for receiving data from ESP32-WROOM
 # -----------------------
 mqtt_broker = "broker.hivemq.com"  # Thay broker phù hợp
 mqtt_port = 1883
-mqtt_topic_humidity = "esp32/soil_moisture"
+mqtt_topic_humidity = "esp32/soil_moisture"  # topic cũ, một thiết bị, giá trị thô
 mqtt_topic_flow = "esp32/water_flow"
+mqtt_topic_devices = wildcard("sensor")  # farm/<location>/<area>/<device>/sensor, payload JSON
 
-# Global data containers for live update
-live_soil_moisture = []
-live_water_flow = []
-
-def on_connect(client, userdata, flags, rc):
-    print(f"Connected with result code {rc}")
-    client.subscribe(mqtt_topic_humidity)
-    client.subscribe(mqtt_topic_flow)
+LIVE_POINTS = 500  # số điểm giữ lại cho biểu đồ trực tiếp
+LIVE_SPARK_POINTS = 120  # số điểm vẽ trên bảng trực tiếp (trình duyệt)
+router = get_router()
+# chỉ định tuyến các khu vực đã biết (danh sách khu vực + crop_data), topic của khu vực lạ bị bỏ qua
+router.set_locations([*locations, *crop_data])
 
-def on_message(client, userdata, msg):
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _record_sample(state, engine, now_iso, hum, flow, source, pump=None):
+    # đẩy giá trị mới tới các bảng trực tiếp đang mở (kênh = khu vực); chỉ số liệu dạng số và trạng thái bơm hợp lệ
+    live_hub.publish(source.get("location", ""),
+                     live_payload({"sensor_hum": hum, "flow": flow, "pump_status": pump}, ("sensor_hum", "flow"), now_iso))
+    # giá trị mới nhất theo (khu vực, vùng, thiết bị), cập nhật tại chỗ
+    latest_state.update(source.get("location"), source.get("area"), source.get("device"),
+                        {"sensor_hum": hum, "flow": flow}, ts=now_iso, pump_status=pump)
+    if hum is not None:
+        state.setdefault("live_soil_moisture", deque(maxlen=LIVE_POINTS)).append({"timestamp": now_iso, "sensor_hum": hum, **source})
+        # Đưa vào bộ đệm ghi trễ, callback MQTT trả về ngay
+        sample_buffer.put(history_store, {"timestamp": now_iso, "sensor_hum": hum, **source})
+        if sqlite_db is not None:
+            sample_buffer.put(history_sink, {"timestamp": now_iso, "sensor_hum": hum, **source})
+    if flow is not None:
+        state.setdefault("live_water_flow", deque(maxlen=LIVE_POINTS)).append({"time": now_iso, "flow": flow, **source})
+        sample_buffer.put(flow_store, {"time": now_iso, "flow": flow, **source})
+        if sqlite_db is not None:
+            sample_buffer.put(flow_sink, {"time": now_iso, "flow": flow, **source})
+    if hum is not None:
+        # đánh giá lại khu vực ngay khi có độ ẩm mới (bộ máy tưới chạy trên luồng riêng); sau khi mẫu đã vào bộ đệm
+        engine.notify(source.get("location", ""))
+
+def decode_message(msg):
+    # bước giải mã / kiểm tra của pipeline (chạy trên event loop của pipeline, không chặn luồng MQTT)
     topic = msg.topic
     payload = msg.payload.decode()
     now_iso = datetime.now(vn_tz).isoformat()
-    try:
-        val = float(payload)
-    except:
-        val = None
-    if val is not None:
-        if topic == mqtt_topic_humidity:
-            live_soil_moisture.append({"timestamp": now_iso, "sensor_hum": val, "location": selected_city})
-            # Lưu vào history_data và file
-            history_data.append({"timestamp": now_iso, "sensor_hum": val, "location": selected_city})
-            save_json(HISTORY_FILE, history_data)
-        elif topic == mqtt_topic_flow:
-            live_water_flow.append({"time": now_iso, "flow": val, "location": selected_city})
-            flow_data.append({"time": now_iso, "flow": val, "location": selected_city})
-            save_json(FLOW_FILE, flow_data)
-
-# Tạo client và chạy thread riêng
-def mqtt_thread():
-    client = mqtt.Client()
-    client.on_connect = on_connect
-    client.on_message = on_message
-    client.connect(mqtt_broker, mqtt_port, 60)
-    client.loop_forever()
-
-threading.Thread(target=mqtt_thread, daemon=True).start()
+    route = router.route(topic)
+    if route is not None:
+        # khu vực / vùng / thiết bị lấy từ topic, không phụ thuộc khu vực đang chọn trên giao diện
+        data = json.loads(payload)
+        if not isinstance(data, dict):
+            raise ValueError("sensor payload is not an object")
+        router.touch(route)
+        route.state["last"] = data
+        source = {"location": route.location, "area": route.area, "device": route.device}
+        hum, flow = _to_float(data.get("soil_moisture")), _to_float(data.get("water_flow"))
+        pump = data.get("pump_status")
+    else:
+        # topic cũ không mang khu vực: gán cho khu vực cố định IRRIGATION_LEGACY_LOCATION (như irrigation_engine),
+        # không theo khu vực mà phiên vừa rerun đang chọn
+        source = {"location": LEGACY_LOCATION}
+        val = _to_float(payload)
+        hum = val if topic == mqtt_topic_humidity else None
+        flow = val if topic == mqtt_topic_flow else None
+        pump = None
+    if hum is None and flow is None:
+        return None
+    return now_iso, hum, flow, source, pump
+
+def persist_message(state, engine, value):
+    # state / engine được gắn bằng functools.partial: pipeline dùng chung có thể gọi hàm của lần rerun này trước
+    # khi các biến toàn cục phía sau được gán
+    now_iso, hum, flow, source, pump = value
+    _record_sample(state, engine, now_iso, hum, flow, source, pump)
+
+# kênh đẩy (server-sent events) cho độ ẩm / lưu lượng / đèn bơm trực tiếp, xem live_push.py
+# cổng riêng (không trùng 8501 / 8502 của Streamlit hay web_phan_quyen); WEB_TUOI_TIEU_LIVE_URL khi qua proxy
+LIVE_PORT = int(os.environ.get("WEB_TUOI_TIEU_LIVE_PORT", "8611"))
+if EMBEDDED_ENGINE:
+    live_hub = get_live_hub("web_tuoi_tieu", LIVE_PORT, public_url=os.environ.get("WEB_TUOI_TIEU_LIVE_URL", ""))
+    # trạng thái mới nhất của từng thiết bị (đọc O(1), có cờ dữ liệu cũ); ảnh chụp dùng chung với api_server
+    latest_state = get_latest_store("web_tuoi_tieu", "latest_state.json")
+else:
+    # không có gì để đẩy; trạng thái mới nhất đọc từ ảnh chụp do tiến trình bộ máy ghi
+    live_hub = None
+    latest_state = LatestStore.from_snapshot("latest_state.json")
+
+if EMBEDDED_ENGINE:
+    # Một client MQTT cho cả tiến trình server; mỗi lần rerun chỉ gắn vào state dùng chung
+    # (chỉ kết nối sau khi đã gắn pipeline bên dưới)
+    ingest = get_service("web_tuoi_tieu", mqtt_broker, mqtt_port, [mqtt_topic_humidity, mqtt_topic_flow, mqtt_topic_devices], None,
+                         buffer=sample_buffer, autostart=False)
+    ingest.state.setdefault("live_soil_moisture", deque(maxlen=LIVE_POINTS))
+    ingest.state.setdefault("live_water_flow", deque(maxlen=LIVE_POINTS))
+    # Bộ máy quyết định tưới chạy nền, một lần cho cả tiến trình: đánh giá mọi khu vực mỗi 30 s và từng khu vực khi
+    # có độ ẩm mới; cấu hình / dữ liệu cây chỉ đọc lại khi được lưu; trạng thái ghi ra irrigation_status.json
+    irrigation_engine = get_irrigation_engine(
+        "web_tuoi_tieu", latest_state, irrigation_events,
+        (lambda: data_version(CONFIG_FILE), lambda: load_json(CONFIG_FILE, {"watering_schedule": "06:00-08:00", "mode": "auto"})),
+        (lambda: data_version(DATA_FILE), lambda: load_json(DATA_FILE, {})),
+        required_soil_moisture, vn_tz, status_path=ENGINE_STATUS_FILE,
+    )
+
+    # receive -> decode -> persist với hàng đợi giới hạn; tạm dừng ghi khi bộ đệm ghi trễ quá đầy
+    INGEST_HIGH_WATER = 15000
+    pipeline = get_pipeline("web_tuoi_tieu", decode_message, functools.partial(persist_message, ingest.state, irrigation_engine),
+                            ready=lambda: sample_buffer.depth() < INGEST_HIGH_WATER)
+    ingest.set_pipeline(pipeline)
+    ingest.start()
+
+    # Global data containers for live update
+    live_soil_moisture = [r for r in list(ingest.state["live_soil_moisture"]) if r.get("location") == selected_city]
+    live_water_flow = [r for r in list(ingest.state["live_water_flow"]) if r.get("location") == selected_city]
+else:
+    # trạng thái / yêu cầu dừng qua file của tiến trình bộ máy; số liệu gần nhất của hôm nay đọc qua chỉ mục
+    irrigation_engine = EngineView(ENGINE_STATUS_FILE, ENGINE_HOLDS_FILE, vn_tz)
+    today_start = datetime.now(vn_tz).date()
+    live_soil_moisture = history_index.query(selected_city, start=today_start)[-LIVE_POINTS:]
+    live_water_flow = flow_index.query(selected_city, start=today_start)[-LIVE_POINTS:]
 
 # -----------------------
 # Hiển thị biểu đồ dữ liệu mới nhất
 # -----------------------
 st.header(_("📊 Biểu đồ dữ liệu cảm biến hiện tại", "📊 Current Sensor Data Charts"))
-df_soil_live = to_df(live_soil_moisture)
-df_flow_live = to_df(live_water_flow)
-
-col1, col2 = st.columns(2)
-with col1:
-    st.markdown(_("### Độ ẩm đất (Sensor Humidity)", "### Soil Moisture"))
-    if not df_soil_live.empty:
-        st.line_chart(df_soil_live["sensor_hum"])
-    else:
-        st.info(_("Chưa có dữ liệu độ ẩm đất nhận từ ESP32.", "No soil moisture data received from ESP32."))
-
-with col2:
-    st.markdown(_("### Lưu lượng nước (Water Flow)", "### Water Flow"))
-    if not df_flow_live.empty:
-        st.line_chart(df_flow_live["flow"])
-    else:
-        st.info(_("Chưa có dữ liệu lưu lượng nước nhận từ ESP32.", "No water flow data received from ESP32."))
+if not live_soil_moisture and not live_water_flow:
+    st.info(_("Chưa có dữ liệu nhận từ ESP32.", "No data received from ESP32 yet."))
+# các mẫu gần nhất làm điểm xuất phát, sau đó bảng tự cập nhật theo kênh đẩy (không rerun)
+live_history = sorted(
+    [{"timestamp": r["timestamp"], "sensor_hum": r["sensor_hum"]} for r in live_soil_moisture]
+    + [{"timestamp": r["time"], "flow": r["flow"]} for r in live_water_flow],
+    key=lambda r: r["timestamp"],
+)
+if live_hub is None:
+    # bộ máy ở tiến trình riêng: không có kênh đẩy, biểu đồ cập nhật ở lần rerun sau
+    if live_history:
+        st.line_chart(pd.DataFrame(live_history).set_index("timestamp"))
+elif live_hub.error:
+    st.error(_("Bảng trực tiếp không khả dụng: {}", "Live panel unavailable: {}").format(live_hub.error))
+else:
+    components.html(live_panel_html(
+        live_hub, [selected_city],
+        [("sensor_hum", _("Độ ẩm đất", "Soil Moisture"), "%"),
+         ("flow", _("Lưu lượng nước", "Water Flow"), "L/min")],
+        pump_label=_("Trạng thái bơm", "Pump status"), spark_points=LIVE_SPARK_POINTS, history=live_history,
+    ), height=200)
 
 # -----------------------
 # Phần tưới nước tự động hoặc thủ công (dành cho người điều khiển)
@@ -452,7 +595,7 @@ if user_type == _("Người điều khiển", "Control Administrator"):
 
     # Logic tự động tưới có thể viết thêm
 # -----------------------
-# Logic tưới tự động + lưu lịch sử tưới (người điều khiển)
+# Trạng thái tưới tự động + lịch sử tưới (người điều khiển)
 # -----------------------
 
 import time
@@ -460,83 +603,49 @@ import time
 if user_type == _("Người điều khiển", "Control Administrator"):
     st.header(_("🚿 Điều khiển hệ thống tưới", "🚿 Irrigation Control"))
 
-    # Lấy thông tin cây trồng tại khu vực
+    # Quyết định tưới do irrigation_engine chạy nền (không phụ thuộc trang đang mở); ở đây chỉ hiển thị kết quả
     plots = crop_data.get(selected_city, {}).get("plots", [])
+    engine_status = irrigation_engine.status(selected_city)
     if len(plots) == 0:
         st.warning(_("❗ Khu vực chưa có cây trồng. Vui lòng cập nhật trước khi tưới.", "❗ No crops found in location. Please update before irrigation."))
     else:
-        # Giả sử chỉ tưới cây đầu tiên trong danh sách plots (để đơn giản)
-        crop_info = plots[0]
-        crop_key = crop_info["crop"]
+        crop_key = plots[0]["crop"]
         thresh_moisture = required_soil_moisture.get(crop_key, 65)
-        
-        # Lấy giá trị độ ẩm đất mới nhất trong lịch sử cảm biến của khu vực
-        hist_crop = [h for h in history_data if h.get("location") == selected_city]
-        if hist_crop:
-            latest_data = sorted(hist_crop, key=lambda x: x["timestamp"], reverse=True)[0]
-            current_moisture = latest_data.get("sensor_hum", None)
-        else:
+        # độ ẩm mới nhất của khu vực, thiết bị đo lưu lượng gửi sau không che mất giá trị này
+        current_state = latest_state.field(selected_city, "sensor_hum")
+        current_moisture = current_state["value"] if current_state else None
+        if current_state is not None and current_state["stale"]:
+            st.warning(_("⚠️ Dữ liệu cảm biến đã cũ (lần cuối: {})", "⚠️ Sensor data is stale (last update: {})").format(current_state["timestamp"]))
             current_moisture = None
 
         st.markdown(f"**{_('Cây trồng hiện tại', 'Current crop')}:** {crop_names[crop_key]}")
         st.markdown(f"**{_('Độ ẩm đất hiện tại', 'Current soil moisture')}:** {current_moisture if current_moisture is not None else _('Chưa có dữ liệu', 'No data yet')} %")
         st.markdown(f"**{_('Ngưỡng độ ẩm tối thiểu để không tưới', 'Minimum moisture threshold')}:** {thresh_moisture} %")
 
-        # Kiểm tra trong khung giờ tưới
-        if is_in_watering_time():
-            st.info(_("⏰ Hiện đang trong khung giờ tưới.", "⏰ Currently in watering time window."))
-            # Nếu tự động
-            if config.get("mode", "auto") == "auto":
-                if current_moisture is not None and current_moisture < thresh_moisture:
-                    # Bật tưới tự động
-                    st.success(_("✅ Độ ẩm thấp, bắt đầu tưới tự động.", "✅ Moisture low, starting automatic irrigation."))
-                    # Lưu lịch sử tưới bắt đầu
-                    history_irrigation = load_json(HISTORY_FILE, [])
-                    # Nếu tưới chưa bật lần nào trong lịch sử đang mở
-                    if not history_irrigation or history_irrigation[-1].get("end_time") is not None:
-                        new_irrigation = {
-                            "location": selected_city,
-                            "crop": crop_key,
-                            "start_time": datetime.now(vn_tz).isoformat(),
-                            "end_time": None,
-                        }
-                        history_irrigation.append(new_irrigation)
-                        save_json(HISTORY_FILE, history_irrigation)
-                    # Hiển thị nút dừng tưới thủ công
-                    if st.button(_("⏹ Dừng tưới", "⏹ Stop irrigation")):
-                        history_irrigation = load_json(HISTORY_FILE, [])
-                        # Cập nhật thời gian kết thúc lần tưới gần nhất chưa đóng
-                        for i in reversed(range(len(history_irrigation))):
-                            if history_irrigation[i].get("location") == selected_city and history_irrigation[i].get("end_time") is None:
-                                history_irrigation[i]["end_time"] = datetime.now(vn_tz).isoformat()
-                                save_json(HISTORY_FILE, history_irrigation)
-                                st.success(_("🚰 Đã dừng tưới.", "🚰 Irrigation stopped."))
-                                break
-                else:
-                    st.info(_("🌿 Độ ẩm đất đủ, không cần tưới.", "🌿 Soil moisture adequate, no irrigation needed."))
-                    # Nếu có phiên tưới đang mở thì đóng lại
-                    history_irrigation = load_json(HISTORY_FILE, [])
-                    if history_irrigation and history_irrigation[-1].get("end_time") is None:
-                        history_irrigation[-1]["end_time"] = datetime.now(vn_tz).isoformat()
-                        save_json(HISTORY_FILE, history_irrigation)
-            else:
-                st.warning(_("⚠️ Hệ thống đang ở chế độ thủ công.", "⚠️ System is in manual mode."))
-        else:
+        decision = engine_status["decision"] if engine_status else None
+        if decision == "irrigating":
+            st.success(_("✅ Độ ẩm thấp, đang tưới tự động.", "✅ Moisture low, automatic irrigation running."))
+            if st.button(_("⏹ Dừng tưới", "⏹ Stop irrigation")):
+                # dừng tới hết khung giờ tưới hiện tại, bộ máy không tự mở lại phiên
+                if irrigation_engine.hold(selected_city) is not None:
+                    st.success(_("🚰 Đã dừng tưới.", "🚰 Irrigation stopped."))
+        elif decision == "held":
+            st.info(_("⏸ Đã dừng tưới thủ công tới hết khung giờ tưới.", "⏸ Irrigation stopped manually until the watering window ends."))
+        elif decision in ("adequate", "no_data"):
+            st.info(_("🌿 Độ ẩm đất đủ hoặc chưa có dữ liệu, không tưới.", "🌿 Soil moisture adequate or no data, no irrigation."))
+        elif decision == "manual":
+            st.warning(_("⚠️ Hệ thống đang ở chế độ thủ công.", "⚠️ System is in manual mode."))
+        elif decision == "outside_window":
             st.info(_("🕒 Không phải giờ tưới.", "🕒 Not watering time."))
+        else:
+            st.info(_("⏳ Đang chờ lần đánh giá đầu tiên.", "⏳ Waiting for the first evaluation."))
+        if engine_status:
+            st.caption(_("Đánh giá lần cuối: {}", "Last evaluated: {}").format(engine_status["evaluated_at"]))
 
     # Hiển thị lịch sử tưới của khu vực
     st.subheader(_("📜 Lịch sử tưới nước", "📜 Irrigation History"))
-    irrigation_hist = load_json(HISTORY_FILE, [])
-    filtered_irrigation = [r for r in irrigation_hist if r.get("location") == selected_city]
-    if filtered_irrigation:
-        df_irrig = pd.DataFrame(filtered_irrigation)
-        if "start_time" in df_irrig.columns:
-            df_irrig["start_time"] = pd.to_datetime(df_irrig["start_time"])
-        if "end_time" in df_irrig.columns:
-            df_irrig["end_time"] = pd.to_datetime(df_irrig["end_time"])
-        st.dataframe(df_irrig.sort_values(by="start_time", ascending=False))
-    else:
-        st.info(_("Chưa có lịch sử tưới cho khu vực này.", "No irrigation history for this location."))
+    # chỉ đọc một trang phiên tưới của khu vực (luồng sự kiện riêng, không đụng tới mẫu cảm biến)
+    show_irrigation_history(selected_city, "irrigation_history_control")
 # -----------------------
 # Kết thúc
 # -----------------------
@@ -0,0 +1,186 @@
+# write_buffer.py
+# Write-behind buffer for incoming sensor samples
+# - put() only appends to a bounded in-memory deque, so the MQTT callback returns immediately
+# - a background thread flushes batches to the segment stores when batch_size samples are waiting
+#   or when the oldest sample has waited flush_interval seconds (the durability window)
+# - when the buffer is full the oldest samples are dropped and counted, memory stays bounded
+# - a store whose append fails gets its samples back at the head of the queue (still bounded by max_items),
+#   they are retried by the next flush, at most once per flush_interval while the store keeps failing
+# - flush() / close() are called on shutdown so nothing acknowledged by the buffer is lost on a clean stop
+
+import atexit
+import threading
+import time
+from collections import deque
+
+
+class WriteBehindBuffer:
+    def __init__(self, name, max_items=20000, batch_size=200, flush_interval=2.0):
+        self.name = name
+        self.max_items = max_items
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._retry_at = 0.0  # monotonic time before which a failed flush is not retried
+        # counters
+        self.enqueued = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{name}", daemon=True)
+        self._thread.start()
+
+    # -----------------------
+    # Producer side (MQTT callback)
+    # -----------------------
+    def put(self, store, record):
+        with self._cond:
+            if self._closed:
+                return False
+            if len(self._items) >= self.max_items:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append((store, record, time.monotonic()))
+            self.enqueued += 1
+            depth = len(self._items)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            if depth >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    # -----------------------
+    # Consumer side
+    # -----------------------
+    def _take_all(self):
+        with self._cond:
+            items = list(self._items)
+            self._items.clear()
+        return items
+
+    def flush(self):
+        # serialize flushes so a shutdown flush never interleaves with the background one
+        with self._flush_lock:
+            items = self._take_all()
+            if not items:
+                return 0
+            t0 = time.perf_counter()
+            groups = {}
+            for item in items:
+                groups.setdefault(id(item[0]), []).append(item)
+            written = 0
+            failed = []
+            for group in groups.values():
+                try:
+                    written += group[0][0].append_many([record for _, record, _ in group])
+                except Exception as e:
+                    self.flush_errors += 1
+                    failed.extend(group)
+                    print(f"WriteBehindBuffer {self.name} flush error:", e)
+            if failed:
+                self._requeue(failed)
+            ms = (time.perf_counter() - t0) * 1000.0
+            self.flushes += 1
+            self.flushed += written
+            self.last_flush_ms = ms
+            self.total_flush_ms += ms
+            if ms > self.max_flush_ms:
+                self.max_flush_ms = ms
+            return written
+
+    def _requeue(self, failed):
+        # failed samples go back in front of the newer ones, in arrival order; the oldest give way when full
+        failed.sort(key=lambda item: item[2])
+        with self._cond:
+            self._items.extendleft(reversed(failed))
+            while len(self._items) > self.max_items:
+                self._items.popleft()
+                self.dropped += 1
+            self._retry_at = time.monotonic() + self.flush_interval
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                if len(self._items) < self.batch_size or now < self._retry_at:
+                    wait = self.flush_interval
+                    if self._items:
+                        wait = max(0.0, self.flush_interval - (now - self._items[0][2]), self._retry_at - now)
+                    self._cond.wait(timeout=wait)
+                if self._closed:
+                    return
+                now = time.monotonic()
+                due = now >= self._retry_at and (len(self._items) >= self.batch_size or (
+                    self._items and now - self._items[0][2] >= self.flush_interval
+                ))
+            if due:
+                self.flush()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    # -----------------------
+    # Metrics
+    # -----------------------
+    def depth(self):
+        with self._cond:
+            return len(self._items)
+
+    def stats(self):
+        with self._cond:
+            depth = len(self._items)
+            oldest_age = time.monotonic() - self._items[0][2] if self._items else 0.0
+        return {
+            "depth": depth,
+            "max_depth": self.max_depth,
+            "oldest_age_s": round(oldest_age, 3),
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+
+# -----------------------
+# Registry: one buffer per name for the whole server process
+# -----------------------
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_buffer(name, max_items=20000, batch_size=200, flush_interval=2.0):
+    with _buffers_lock:
+        buf = _buffers.get(name)
+        if buf is None:
+            buf = WriteBehindBuffer(name, max_items=max_items, batch_size=batch_size, flush_interval=flush_interval)
+            _buffers[name] = buf
+        return buf
+
+
+def close_all():
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+        _buffers.clear()
+    for buf in buffers:
+        buf.close()
+
+
+atexit.register(close_all)